@@ -0,0 +1,154 @@
+"""
+Per-intersection DeepQ agents.
+
+In the shared mode all lights act with and train one network from one replay
+memory, and the transitions of all lights that decided in a step go into a
+single stacked minibatch. In the independent mode every light has its own
+network and replay memory. With the NumPy backend the networks live in
+stacked arrays, see qnetwork.StackedMLP, and the lights that decided train
+in one batched update like LinearAgents does. With the Keras backend, which
+releases the GIL, the per-light updates run on a thread pool.
+"""
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+import profiler
+import qnetwork
+import qlearning
+from qlearning import DeepQ
+from qlearning import ExperienceReplay
+from qlearning import PrioritizedReplay
+
+
+class DQNAgents:
+    def __init__(self, num_agents, input_size, num_actions, mode="shared", replay="uniform", threads=None,
+                 backend="numpy", hidden=(), tau=1.0, prof=profiler.NULL, stacked=True):
+        self.num_agents = num_agents
+        self.input_size = input_size
+        self.num_actions = num_actions
+        self.mode = mode
+        n = 1 if mode == "shared" else num_agents
+        Replay = PrioritizedReplay if replay == "prioritized" else ExperienceReplay
+        self.dqn = [DeepQ(input_size, num_actions, backend, hidden, tau=tau) for i in range(n)]
+        self.replay = [Replay() for i in range(n)]
+        self.prof = prof
+        self.online = self.target = None
+        if mode != "shared" and backend == "numpy" and stacked:
+            self.online = qnetwork.StackedMLP([d.model for d in self.dqn], qlearning.learning_rate)
+            self.target = qnetwork.StackedMLP([d.target_model for d in self.dqn], qlearning.learning_rate)
+        self.pool = None
+        if threads is None:
+            threads = num_agents if backend == "keras" else 1
+        if mode != "shared" and threads > 1:
+            self.pool = ThreadPool(threads)
+
+    def agent(self, k):
+        return 0 if self.mode == "shared" else k
+
+    def getAction(self, k, state):
+        return self.dqn[self.agent(k)].getAction(state)
+
+    def getQValues(self, lights, states):
+        """Q-values of light lights[i] in states[i], one forward pass per network"""
+        return self.qValues(self.dqn, lights, states)
+
+    def qValues(self, networks, lights, states):
+        """getQValues with networks in place of the online DeepQs, e.g. snapshots of them"""
+        if self.mode == "shared":
+            return networks[0].getQValues(states)
+        lights = np.asarray(lights)
+        q = np.empty((len(lights), self.num_actions))
+        # one forward pass per network over all rows of its lights
+        for k in np.unique(lights):
+            rows = np.flatnonzero(lights == k)
+            q[rows] = networks[k].getQValues(states[rows])
+        return q
+
+    def getActions(self, lights, states):
+        return np.argmax(self.getQValues(lights, states), axis=1)
+
+    def remember(self, k, transition, game_over=False):
+        self.replay[self.agent(k)].remember(transition, game_over)
+
+    def rememberBatch(self, lights, states, actions, rewards, next_states, game_over=False):
+        """stores transition i for light lights[i], one bulk insert per replay memory"""
+        if self.mode == "shared":
+            self.replay[0].rememberBatch(states, actions, rewards, next_states, game_over)
+            return
+        lights = np.asarray(lights)
+        rewards = np.broadcast_to(rewards, lights.shape)
+        game_over = np.broadcast_to(game_over, lights.shape)
+        for k in np.unique(lights):
+            rows = lights == k
+            self.replay[k].rememberBatch(states[rows], actions[rows], rewards[rows], next_states[rows],
+                                         game_over[rows])
+
+    def updateTarget(self):
+        if self.target is not None:
+            qnetwork.syncWeights(self.online, self.target, self.dqn[0].tau)
+            return
+        for d in self.dqn:
+            d.updateTarget()
+
+    def trainAgent(self, k, batch_size, discount):
+        # with independent agents on the pool the phases of all threads add up
+        begin = self.prof.start()
+        batch = self.replay[k].get_batch(batch_size)
+        begin = self.prof.stop("train.sample", begin)
+        loss = self.dqn[k].trainModel(batch, discount, self.input_size, self.num_actions)
+        begin = self.prof.stop("train.update", begin)
+        self.replay[k].updatePriorities(batch, self.dqn[k].td_errors)
+        self.prof.stop("train.priorities", begin)
+        return loss
+
+    def train(self, lights, batch_size, discount):
+        """one update for the given lights, i.e. the ones that stored a transition"""
+        if len(lights) == 0:
+            return
+        if self.mode == "shared":
+            # one stacked minibatch instead of one update per light
+            return self.trainAgent(0, batch_size * len(lights), discount)
+        if self.online is not None:
+            return self.trainStacked(lights, batch_size, discount)
+        if self.pool is None:
+            return [self.trainAgent(k, batch_size, discount) for k in lights]
+        return self.pool.map(lambda k: self.trainAgent(k, batch_size, discount), lights)
+
+    def trainStacked(self, lights, batch_size, discount):
+        """train for the NumPy networks, one batched update for all lights
+
+        A light listed several times gets that many updates, one more per
+        round, like consecutive trainAgent calls.
+        """
+        lights, repeats = np.unique(lights, return_counts=True)
+        losses = []
+        for round in range(repeats.max()):
+            agents = lights[repeats > round]
+            if len(agents) == 1:
+                # the networks are views into the stacks, a single one trains cheaper on its own
+                losses.append(self.trainAgent(agents[0], batch_size, discount))
+                continue
+            begin = self.prof.start()
+            batches = [self.replay[k].get_batch(batch_size) for k in agents]
+            begin = self.prof.stop("train.sample", begin)
+            loss, errors = qlearning.trainStacked(self.online, self.target, agents, batches, discount)
+            begin = self.prof.stop("train.update", begin)
+            for k, batch, e in zip(agents, batches, errors):
+                self.replay[k].updatePriorities(batch, e)
+            self.prof.stop("train.priorities", begin)
+            losses.extend(loss)
+        return losses
+
+    def getState(self):
+        return {"dqn": dict((str(i), d.getState()) for i, d in enumerate(self.dqn)),
+                "replay": dict((str(i), r.getState()) for i, r in enumerate(self.replay))}
+
+    def setState(self, state):
+        for i, d in enumerate(self.dqn):
+            d.setState(state["dqn"][str(i)])
+        for i, r in enumerate(self.replay):
+            r.setState(state["replay"][str(i)])
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
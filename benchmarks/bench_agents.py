@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Step time of shared and independent per-light agents as the number of
+lights grows, on MockSumo grids of 2x2 up to 8x8 intersections. Every light
+decides and trains in every step. With --dqn it also times one train call
+of independent DQN agents for all lights, the stacked networks against one
+update per light.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env import TrafficEnv
+from mocksumo import MockSumo
+from linearreg import LinearAgents
+
+
+def linearStep(agents, env, s, lights):
+    a = agents.getActions(lights, np.tile(s, (len(lights), 1)))
+    ss, r = env.step(a)
+    n = len(lights)
+    agents.trainBatch(lights, np.tile(s, (n, 1)), a, np.full(n, r), np.tile(ss, (n, 1)), 0.9)
+    return ss
+
+
+def dqnStep(agents, env, s, lights):
+    a = np.array([agents.getAction(k, s) for k in lights])
+    ss, r = env.step(a)
+    for k in lights:
+        agents.remember(k, [s, a[k], r, ss])
+    agents.train(lights, 32, 0.9)
+    return ss
+
+
+def measureTrain(lights, stacked, steps, input_size=40, hidden=(32, )):
+    """milliseconds per DQNAgents.train of independent agents with every light training"""
+    from agents import DQNAgents
+    agents = DQNAgents(lights, input_size, 2, "independent", hidden=hidden, stacked=stacked)
+    for k in range(lights):
+        for i in range(64):
+            agents.remember(k, [np.random.rand(input_size), i % 2, 0.5, np.random.rand(input_size)])
+    every = np.arange(lights)
+    agents.train(every, 32, 0.9)
+    begin = time.time()
+    for t in range(steps):
+        agents.train(every, 32, 0.9)
+    agents.close()
+    return (time.time() - begin) / steps * 1000
+
+
+def measure(kind, mode, size, steps):
+    env = TrafficEnv(MockSumo(lights=size * size), decision_interval=1)
+    lights = np.arange(len(env.lights))
+    if kind == "linear":
+        agents = LinearAgents(len(lights), env.input_size, 2, shared=mode == "shared")
+        f = linearStep
+    else:
+        from agents import DQNAgents
+        agents = DQNAgents(len(lights), env.input_size, 2, mode)
+        f = dqnStep
+    s = env.reset()
+    # warm up the replay memories before timing
+    for t in range(10):
+        s = f(agents, env, s, lights)
+    begin = time.time()
+    for t in range(steps):
+        s = f(agents, env, s, lights)
+    return (time.time() - begin) / steps * 1000
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--steps", type="int", default=200, help="timed steps per configuration")
+    optParser.add_option("--dqn", action="store_true", default=False, help="also measure the DeepQ agents")
+    options, args = optParser.parse_args()
+    kinds = ["linear", "dqn"] if options.dqn else ["linear"]
+    print('%-8s %-12s %8s %12s' % ('agent', 'mode', 'lights', 'ms/step'))
+    for kind in kinds:
+        for mode in ("shared", "independent"):
+            for size in (2, 4, 8):
+                print('%-8s %-12s %8i %12.3f' % (kind, mode, size * size, measure(kind, mode, size, options.steps)))
+    if options.dqn:
+        print('%-8s %12s %12s' % ('lights', 'stacked ms', 'per light ms'))
+        for lights in (1, 4, 16, 64):
+            print('%-8i %12.3f %12.3f' % (lights, measureTrain(lights, True, options.steps),
+                                          measureTrain(lights, False, options.steps)))
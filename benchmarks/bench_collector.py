@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Compares steps per second of the per-vehicle TraCI queries the runners used
+to issue with the subscription based StateCollector.
+
+Each variant runs in its own sumo instance on data/cross.sumocfg, so run
+runner.py once before to generate data/cross.rou.xml.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import subprocess
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.environ.get("SUMO_HOME", ""), "tools"))
+try:
+    from sumolib import checkBinary
+    import traci
+except ImportError:
+    sys.exit("please declare environment variable 'SUMO_HOME' as the root directory of your sumo installation")
+from collector import StateCollector
+from rewards import Rewards
+import runner
+
+PORT = 8873
+
+
+def legacyStep():
+    """one step with the queries runner.step, getReward, getWaitingTime and getCO2 used to do"""
+    traci.simulationStep()
+    for l in traci.trafficlights.getIDList():
+        traci.trafficlights.getPhase(l)
+        traci.trafficlights.getPhase(l)
+    for i in traci.inductionloop.getIDList():
+        traci.inductionloop.getLastStepVehicleNumber(i)
+    traci.vehicle.getIDList()
+    r = 0.0
+    lanes = traci.lane.getIDList()
+    for l in lanes:
+        speed = 0
+        for c in traci.lane.getLastStepVehicleIDs(l):
+            traci.vehicle.getWaitingTime(c)
+            speed += traci.vehicle.getSpeed(c)
+        r += speed / (max(1, len(traci.lane.getLastStepVehicleIDs(l))) * 10)
+        traci.lane.getWaitingTime(l)
+    for l in lanes:
+        r -= traci.lane.getCO2Emission(l) / 10000.0
+    w = 0
+    for l in traci.lane.getIDList():
+        for c in traci.lane.getLastStepVehicleIDs(l):
+            w += traci.vehicle.getWaitingTime(c)
+    co2 = 0
+    for l in traci.lane.getIDList():
+        co2 += traci.lane.getCO2Emission(l)
+    return r, w, co2
+
+
+def collectorStep(collector, rewards):
+    traci.simulationStep()
+    collector.update()
+    return rewards.evaluate(collector), rewards.value(runner.WAITING), rewards.value("co2")
+
+
+def measure(sumoBinary, steps, useCollector):
+    sumoProcess = subprocess.Popen([sumoBinary, "-c", "data/cross.sumocfg", "--no-step-log",
+                                    "--remote-port", str(PORT)], stdout=open(os.devnull, "w"))
+    traci.init(PORT)
+    if useCollector:
+        collector = StateCollector(traci)
+        rewards = Rewards(runner.REWARD, ("co2", runner.WAITING))
+    begin = time.time()
+    for t in range(steps):
+        if useCollector:
+            collectorStep(collector, rewards)
+        else:
+            legacyStep()
+    elapsed = time.time() - begin
+    traci.close()
+    sumoProcess.wait()
+    return steps / elapsed
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--steps", type="int", default=2000, help="simulation steps per variant")
+    options, args = optParser.parse_args()
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    if not os.path.exists("data/cross.rou.xml"):
+        sys.exit("data/cross.rou.xml is missing, run runner.py once to generate it")
+    sumoBinary = checkBinary('sumo')
+    legacy = measure(sumoBinary, options.steps, False)
+    batched = measure(sumoBinary, options.steps, True)
+    print('per-vehicle queries: %.1f steps/s' % legacy)
+    print('subscriptions:       %.1f steps/s (%.1fx)' % (batched, batched / legacy))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Steps per second, training updates per second and peak memory of the
+controllers in runner.py, linear.py and shortcycle.py on mocksumo.MockSumo,
+so no SUMO installation is needed. Every configuration runs in a fresh
+interpreter with fixed seeds. One JSON line per configuration is appended
+to the results file together with the commit and versions, and the table
+compares each configuration with its previous record in that file.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import json
+import optparse
+import platform
+import random
+import subprocess
+import time
+import numpy as np
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root)
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+# name: (module, keyword arguments of its run)
+CONFIGS = {
+    "shortcycle": ("shortcycle", {}),
+    "linear-shared": ("linear", {"agents": "shared"}),
+    "linear-independent": ("linear", {"agents": "independent"}),
+    "dqn-uniform-shared": ("runner", {"replay": "uniform", "agents": "shared"}),
+    "dqn-prioritized-shared": ("runner", {"replay": "prioritized", "agents": "shared"}),
+    "dqn-uniform-independent": ("runner", {"replay": "uniform", "agents": "independent"}),
+    "dqn-prioritized-independent": ("runner", {"replay": "prioritized", "agents": "independent"}),
+    "dqn-hidden32": ("runner", {"hidden": (32, )}),
+    "dqn-pipelined": ("runner", {"pipeline": True}),
+}
+STEPS = 500
+
+
+def peakMemory():
+    """peak resident set size of this process in MB, None where resource is missing"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024.0 ** (2 if sys.platform == "darwin" else 1)
+
+
+def countCalls(cls, name, counter, weight=lambda *args: 1):
+    """counts the calls of cls.name, each adds weight(*args) to counter[0]"""
+    method = getattr(cls, name)
+
+    def counted(self, *args, **kwargs):
+        counter[0] += weight(*args)
+        return method(self, *args, **kwargs)
+    setattr(cls, name, counted)
+
+
+def measure(name, iterations, seed):
+    """runs one configuration in this process and returns its record"""
+    from mocksumo import MockSumo
+    from qlearning import DeepQ
+    from qnetwork import StackedMLP
+    from linearreg import LinearAgents
+    module, kwargs = CONFIGS[name]
+    controller = __import__(module)
+    updates = [0]
+    # also the updates of the pipeline's trainer thread
+    countCalls(DeepQ, "trainModel", updates)
+    # a batched update of independent agents is one update per network
+    countCalls(StackedMLP, "train_on_batch", updates, lambda X, Y, agents, *args: len(agents))
+    countCalls(LinearAgents, "trainBatch", updates)
+    random.seed(seed)
+    np.random.seed(seed)
+    conn = MockSumo(seed=seed)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    begin = time.time()
+    try:
+        controller.run(reset="remove", iterations=iterations, conn=conn, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    seconds = time.time() - begin
+    steps = iterations * STEPS
+    return {"config": name, "iterations": iterations, "steps": steps, "seconds": seconds,
+            "steps_per_second": steps / seconds, "updates": updates[0],
+            "updates_per_second": updates[0] / seconds, "peak_mb": peakMemory()}
+
+
+def commit():
+    try:
+        out = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=root,
+                                      stderr=open(os.devnull, "w"))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode().strip()
+
+
+def previous(path):
+    """the last record of every configuration in the results file"""
+    last = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    last[record["config"]] = record
+    return last
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--configs", default=",".join(sorted(CONFIGS)),
+                         help="comma separated configurations [default: all]")
+    optParser.add_option("--iterations", type="int", default=4, help="episodes of %i steps per run" % STEPS)
+    optParser.add_option("--seed", type="int", default=42, help="seed of the simulator and the learners")
+    optParser.add_option("--output", default=RESULTS, help="results file to append to [default: %default]")
+    optParser.add_option("--run", help=optparse.SUPPRESS_HELP)
+    options, args = optParser.parse_args()
+    # the runners write the route file relative to the working directory
+    os.chdir(root)
+    if options.run:
+        print(json.dumps(measure(options.run, options.iterations, options.seed)))
+        sys.exit()
+    names = options.configs.split(",")
+    for name in names:
+        if name not in CONFIGS:
+            optParser.error("unknown configuration %s, choose from %s" % (name, ", ".join(sorted(CONFIGS))))
+    last = previous(options.output)
+    common = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit(), "python": platform.python_version(),
+              "numpy": np.__version__, "machine": platform.machine(), "seed": options.seed}
+    print('%-28s %10s %10s %10s %9s' % ('config', 'steps/s', 'updates/s', 'peak MB', 'vs last'))
+    with open(options.output, "a") as f:
+        for name in names:
+            out = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--run", name,
+                                           "--iterations", str(options.iterations), "--seed", str(options.seed)])
+            record = json.loads(out.decode().strip().splitlines()[-1])
+            record.update(common)
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+            f.flush()
+            before = last.get(name)
+            change = "%8.2fx" % (record["steps_per_second"] / before["steps_per_second"]) if before else "%9s" % "-"
+            print('%-28s %10.1f %10.1f %10s %s' % (name, record["steps_per_second"], record["updates_per_second"],
+                                                   "%.1f" % record["peak_mb"] if record["peak_mb"] else "-", change))
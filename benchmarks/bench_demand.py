@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Measures the startup cost of writing the runner.py route file: the former
+print per flow, demand.generate and the skip of an unchanged profile.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import shutil
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import demand
+
+
+def printRoutefile(path, episodes):
+    """the former runner.generate_routefile"""
+    periods = demand.RUNNER["periods"]
+    with open(path, "w") as routes:
+        print(demand.HEADER, end="", file=routes)
+        f = 0
+        for ep in range(episodes):
+            b = ep * 500
+            for begin, end, p in periods:
+                for i in range(8):
+                    for j in range(8):
+                        if i == j:
+                            continue
+                        print('    <flow id="%i" begin="%i" end="%i" probability="%f" type="typeWE" from="%ii" to="%io"/>' % (
+                            f, b + begin, b + end, p, i, j), file=routes)
+                        f += 1
+        print("</routes>", file=routes)
+
+
+def seconds(f, repeat):
+    best = None
+    for i in range(repeat):
+        begin = time.time()
+        f()
+        elapsed = time.time() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--episodes", type="int", default=500, help="episodes in the profile")
+    optParser.add_option("--repeat", type="int", default=5, help="runs per measurement, the best counts")
+    options, args = optParser.parse_args()
+    profile = dict(demand.RUNNER, episodes=options.episodes)
+    directory = tempfile.mkdtemp()
+    try:
+        old = os.path.join(directory, "print.rou.xml")
+        new = os.path.join(directory, "cross.rou.xml")
+        results = [
+            ('print per flow', seconds(lambda: printRoutefile(old, options.episodes), options.repeat)),
+            ('generate', seconds(lambda: demand.generate(profile, new, force=True), options.repeat)),
+            ('unchanged', seconds(lambda: demand.generate(profile, new), options.repeat)),
+        ]
+        # apart from the stamp both files hold the same flows
+        with open(old) as a, open(new) as b:
+            b.readline()
+            assert a.read() == b.read()
+        flows = options.episodes * len(profile["periods"]) * len(profile["pairs"])
+        print('%i flows, %.1f MB' % (flows, os.path.getsize(new) / 1e6))
+        for name, elapsed in results:
+            print('%-16s %10.4f s' % (name, elapsed))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Measures the controller step on growing grids of mocksumo.MockSumo lights:
+the collector update, the observation and the greedy actions of a shared
+linear model for every light. The neighbourhood observation keeps its size
+while the observation of all lights grows with the grid.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import grid
+from mocksumo import MockSumo
+from collector import StateCollector
+from observation import ObservationEncoder, NeighbourhoodEncoder
+from linearreg import LinearAgents
+
+
+def measure(rows, cols, steps, history_len, neighbourhood):
+    """returns the observation size per light and the controller steps per second, without the mock"""
+    sim = MockSumo(lights=rows * cols)
+    collector = StateCollector(sim)
+    n = len(collector.lights)
+    if neighbourhood:
+        topology = grid.Topology(grid.mockLayout(rows, cols), collector.lights, collector.loops)
+        encoder = NeighbourhoodEncoder(topology.neighbours, topology.approaches, len(collector.loops), history_len)
+    else:
+        encoder = ObservationEncoder(n, len(collector.loops), history_len, loops=True)
+    agents = LinearAgents(n, encoder.input_size, 2)
+    lights = np.arange(n)
+    s = encoder.reset()
+    elapsed = 0.0
+    for t in range(steps):
+        sim.simulationStep()
+        begin = time.time()
+        states = s if neighbourhood else np.tile(s, (n, 1))
+        agents.getActions(lights, states)
+        collector.update()
+        s = encoder.update(collector.phase, collector.loop_vehicles)
+        elapsed += time.time() - begin
+    return encoder.input_size, steps / elapsed
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--sizes", default="2x2,5x5,10x10,12x12", help="grid sizes to measure")
+    optParser.add_option("--steps", type="int", default=200, help="steps per measurement")
+    optParser.add_option("--history-len", type="int", default=5, help="past phases per light")
+    options, args = optParser.parse_args()
+    print('%8s %7s %14s %10s %14s %10s' % ('grid', 'lights', 'all lights', 'steps/s', 'neighbourhood', 'steps/s'))
+    for size in options.sizes.split(","):
+        rows, cols = [int(n) for n in size.split("x")]
+        full = measure(rows, cols, options.steps, options.history_len, False)
+        local = measure(rows, cols, options.steps, options.history_len, True)
+        print('%8s %7i %14i %10.0f %14i %10.0f' % (size, rows * cols, full[0], full[1], local[0], local[1]))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of the Linear Q-learner: the former per-element weight loop
+against the vectorized trainModel and trainBatch.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import linearreg
+from linearreg import Linear
+
+
+class LoopLinear:
+    """the previous implementation, kept here as the baseline"""
+    def __init__(self, input_size, num_actions):
+        self.model = [np.random.rand(input_size), np.random.rand(input_size)]
+
+    def getAction(self, state):
+        state = np.array(state)
+        q0 = np.dot(self.model[0], state)
+        q1 = np.dot(self.model[1], state)
+        return int(q1 > q0)
+
+    def trainModel(self, sa, discount, input_size, num_actions):
+        state = np.array(sa[0])
+        action = sa[1]
+        reward = sa[2]
+        newState = np.array(sa[3])
+        a = self.getAction(newState)
+        d = reward + discount * np.dot(self.model[a], newState) - np.dot(self.model[action], state)
+        for i in range(input_size):
+            self.model[action][i] += linearreg.learning_rate * d * state[i]
+
+
+def perSecond(f, count, repeat):
+    begin = time.time()
+    for i in range(repeat):
+        f()
+    return count * repeat / (time.time() - begin)
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--input-size", type="int", default=70, help="state size, linear.py uses 70")
+    optParser.add_option("--batch", type="int", default=4, help="transitions per trainBatch call")
+    optParser.add_option("--repeat", type="int", default=20000, help="calls per measurement")
+    options, args = optParser.parse_args()
+    n, k = options.input_size, options.batch
+    states = np.random.uniform(size=(k, n)) / n
+    newStates = np.random.uniform(size=(k, n)) / n
+    actions = np.random.randint(2, size=k)
+    rewards = np.random.uniform(size=k)
+    sa = [list(states[0]), int(actions[0]), rewards[0], list(newStates[0])]
+    old, new = LoopLinear(n, 2), Linear(n, 2)
+    results = [
+        ('loop trainModel', perSecond(lambda: old.trainModel(sa, 0.9, n, 2), 1, options.repeat)),
+        ('trainModel', perSecond(lambda: new.trainModel(sa, 0.9, n, 2), 1, options.repeat)),
+        ('trainBatch', perSecond(lambda: new.trainBatch(states, actions, rewards, newStates, 0.9), k, options.repeat)),
+        ('loop getAction', perSecond(lambda: old.getAction(sa[0]), 1, options.repeat)),
+        ('getActions', perSecond(lambda: new.getActions(states), k, options.repeat)),
+    ]
+    print('input size %i, batch %i' % (n, k))
+    for name, rate in results:
+        print('%-16s %12.0f per second' % (name, rate))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Decision latency per step as the number of lights grows: the former loop
+with one epsilon draw and one single row forward pass per light against
+policy.EpsilonGreedy with one forward pass for all lights. Every light
+decides in every measured step and explores with probability 0.1. The
+batched call has a fixed cost of a few hundredths of a millisecond, so with
+4 lights or fewer the loop is still as fast or faster.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from policy import EpsilonGreedy
+from linearreg import Linear
+
+
+def loopActions(agent, s, phases, epsilon):
+    """the per light selection runner.run used to do"""
+    actions = np.full(len(phases), -1, dtype=np.int64)
+    for k in range(len(phases)):
+        if phases[k] % 2 != 0:
+            continue
+        elif np.random.uniform() < epsilon:
+            actions[k] = np.random.randint(2)
+        else:
+            actions[k] = agent.getAction(s)
+    return actions
+
+
+def measure(agent, lights, input_size, repeat):
+    """milliseconds per step of the loop and of the batched policy"""
+    s = np.random.uniform(size=input_size)
+    states = np.broadcast_to(s, (lights, input_size))
+    phases = np.zeros(lights, dtype=np.int64)
+    policy = EpsilonGreedy(2, epsilon=0.1, decay=1.0, interval=1)
+    qValues = lambda k, states: agent.getQValues(states)
+    begin = time.time()
+    for i in range(repeat):
+        loopActions(agent, s, phases, 0.1)
+    loop = (time.time() - begin) / repeat * 1e3
+    begin = time.time()
+    for i in range(repeat):
+        policy.act(qValues, states, phases, 0)
+    batched = (time.time() - begin) / repeat * 1e3
+    return loop, batched
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--lights", default="4,16,64,144", help="numbers of lights to measure")
+    optParser.add_option("--input-size", type="int", default=24, help="observation size")
+    optParser.add_option("--repeat", type="int", default=200, help="steps per measurement")
+    optParser.add_option("--dqn", action="store_true", default=False, help="also measure DeepQ on its NumPy backend")
+    options, args = optParser.parse_args()
+    agents = [("linear", Linear(options.input_size, 2))]
+    if options.dqn:
+        from qlearning import DeepQ
+        agents.append(("dqn", DeepQ(options.input_size, 2)))
+    print('%-8s %8s %12s %12s' % ('agent', 'lights', 'loop ms', 'batched ms'))
+    for name, agent in agents:
+        for lights in [int(n) for n in options.lights.split(",")]:
+            loop, batched = measure(agent, lights, options.input_size, options.repeat)
+            print('%-8s %8i %12.4f %12.4f' % (name, lights, loop, batched))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Startup and per-batch training time of DeepQ with the NumPy and the Keras
+backend. Startup is measured in a fresh interpreter from the import of
+qlearning to the first constructed DeepQ, the Keras backend is skipped when
+Keras is not installed.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import subprocess
+import time
+import numpy as np
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root)
+from qlearning import DeepQ, ExperienceReplay
+
+STARTUP = """
+import sys, time
+begin = time.time()
+sys.path.append(%r)
+import qlearning
+qlearning.DeepQ(%i, 2, %r, %r)
+print(time.time() - begin)
+"""
+
+
+def startup(backend, input_size, hidden):
+    out = subprocess.check_output([sys.executable, "-c", STARTUP % (root, input_size, backend, hidden)])
+    return float(out.decode().split()[-1])
+
+
+def training(backend, input_size, hidden, batch_size, repeat):
+    """microseconds per trainModel call on a full replay memory"""
+    dqn = DeepQ(input_size, 2, backend, hidden)
+    replay = ExperienceReplay(10000)
+    for i in range(10000):
+        replay.remember([np.random.uniform(size=input_size), np.random.randint(2), np.random.uniform(),
+                         np.random.uniform(size=input_size)], False)
+    dqn.updateTarget()
+    batches = [replay.get_batch(batch_size) for i in range(10)]
+    begin = time.time()
+    for i in range(repeat):
+        dqn.trainModel(batches[i % len(batches)], 0.9, input_size, 2)
+    return (time.time() - begin) / repeat * 1e6
+
+
+def hasKeras():
+    try:
+        import keras
+    except ImportError:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--input-size", type="int", default=24, help="observation size, runner.py uses 24")
+    optParser.add_option("--hidden", default="", help="comma separated hidden layer sizes")
+    optParser.add_option("--batch-size", type="int", default=32, help="transitions per update")
+    optParser.add_option("--repeat", type="int", default=2000, help="updates to time")
+    options, args = optParser.parse_args()
+    hidden = tuple(int(n) for n in options.hidden.split(",") if n)
+    backends = ["numpy"]
+    if hasKeras():
+        backends.append("keras")
+    else:
+        print("keras is not installed, measuring the numpy backend only")
+    print('%-8s %12s %14s' % ('backend', 'startup s', 'us/batch'))
+    for backend in backends:
+        print('%-8s %12.3f %14.1f' % (backend, startup(backend, options.input_size, hidden),
+                                      training(backend, options.input_size, hidden, options.batch_size,
+                                               options.repeat)))
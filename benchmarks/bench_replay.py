@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Measures insert, sample and priority update cost of the uniform and the
+prioritized experience replay at the full max_memory capacity.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import qlearning
+from qlearning import ExperienceReplay
+from qlearning import PrioritizedReplay
+
+
+def timeit(f, repeat):
+    begin = time.time()
+    for i in range(repeat):
+        f()
+    return (time.time() - begin) / repeat * 1e6
+
+
+def measure(replay, input_size, batch_size, repeat):
+    state = np.random.uniform(size=input_size)
+    begin = time.time()
+    for i in range(replay.max_memory):
+        replay.remember([state, i % 2, 1.0, state], False)
+    insert = (time.time() - begin) / replay.max_memory * 1e6
+    sample = timeit(lambda: replay.get_batch(batch_size), repeat)
+    batch = replay.get_batch(batch_size)
+    errors = np.random.normal(size=len(batch[1]))
+    update = timeit(lambda: replay.updatePriorities(batch, errors), repeat)
+    return insert, sample, update
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--input-size", type="int", default=25, help="state size")
+    optParser.add_option("--batch-size", type="int", default=32, help="minibatch size")
+    optParser.add_option("--repeat", type="int", default=2000, help="repetitions per measurement")
+    options, args = optParser.parse_args()
+    print('capacity %i, batch size %i, times in microseconds' % (qlearning.max_memory, options.batch_size))
+    print('%-12s %10s %10s %10s' % ('replay', 'insert', 'sample', 'update'))
+    for name, replay in (('uniform', ExperienceReplay()), ('prioritized', PrioritizedReplay())):
+        print('%-12s %10.1f %10.1f %10.1f' % ((name, ) + measure(replay, options.input_size, options.batch_size, options.repeat)))
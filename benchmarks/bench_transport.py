@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Compares the per-step latency of the socket and the in-process (libsumo)
+TraCI transport with the work a controller does every step: one phase query
+per light, the simulation step and the StateCollector update. The cost of a
+single call is measured with repeated getPhase queries.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.environ.get("SUMO_HOME", ""), "tools"))
+try:
+    from sumolib import checkBinary
+except ImportError:
+    sys.exit("please declare environment variable 'SUMO_HOME' as the root directory of your sumo installation")
+import connection
+import demand
+from collector import StateCollector
+
+PORT = 8873
+
+
+def measure(transport, sumoBinary, steps, calls):
+    """returns milliseconds per step and microseconds per call"""
+    conn, sumoProcess = connection.launch(transport, sumoBinary, PORT, ["--no-step-log"],
+                                          stdout=open(os.devnull, "w"))
+    collector = StateCollector(conn)
+    begin = time.time()
+    for t in range(steps):
+        for l in collector.lights:
+            conn.trafficlights.getPhase(l)
+        conn.simulationStep()
+        collector.update()
+    perStep = (time.time() - begin) / steps * 1e3
+    light = collector.lights[0]
+    begin = time.time()
+    for i in range(calls):
+        conn.trafficlights.getPhase(light)
+    perCall = (time.time() - begin) / calls * 1e6
+    conn.close()
+    if sumoProcess:
+        sumoProcess.wait()
+    return perStep, perCall
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--steps", type="int", default=2000, help="simulation steps per transport")
+    optParser.add_option("--calls", type="int", default=20000, help="getPhase calls per transport")
+    options, args = optParser.parse_args()
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    demand.generate(demand.RUNNER)
+    sumoBinary = checkBinary('sumo')
+    transports = ["socket"]
+    if connection.hasLibsumo():
+        # libsumo stays loaded once started, so it goes last
+        transports.append("libsumo")
+    else:
+        print("libsumo is not available, measuring the socket only")
+    results = [(t, measure(t, sumoBinary, options.steps, options.calls)) for t in transports]
+    for transport, (perStep, perCall) in results:
+        print('%-8s %8.3f ms/step %8.1f us/call' % (transport, perStep, perCall))
+    if len(results) == 2:
+        print('in process: %.1fx faster per step' % (results[0][1][0] / results[1][1][0]))
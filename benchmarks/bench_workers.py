@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""
+Reports environment steps per second of workers.train for 1 to N rollout
+workers, against mocksumo by default or against sumo with --sumo.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import workers
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser()
+    optParser.add_option("--max-workers", type="int", default=8, help="largest worker count")
+    optParser.add_option("--episodes", type="int", default=4, help="episodes per worker")
+    optParser.add_option("--steps", type="int", default=500, help="steps per episode")
+    optParser.add_option("--updates-per-transition", type="float", default=0.25,
+                         help="learner updates per received transition")
+    optParser.add_option("--sumo", help="sumo binary to use instead of the mock simulator")
+    options, args = optParser.parse_args()
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    n, base = 1, None
+    print('%8s %12s %10s %8s' % ('workers', 'steps/s', 'updates', 'scaling'))
+    while n <= options.max_workers:
+        stats = workers.train(n, options.sumo or "mock", options.episodes, options.steps,
+                              updates_per_transition=options.updates_per_transition)
+        base = base or stats["steps_per_second"]
+        print('%8i %12.1f %10i %8.2f' % (n, stats["steps_per_second"], stats["updates"], stats["steps_per_second"] / base))
+        n *= 2
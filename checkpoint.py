@@ -0,0 +1,172 @@
+"""
+Checkpoints of a training run, written in the background.
+
+A checkpoint is a nested dict: NumPy arrays are written as .npy files so
+they can be read back memory-mapped, everything else (counters, RNG
+states, metric lists) goes into one pickle. Checkpointer.save takes the
+snapshot right away and leaves the writing to a thread, so the control
+loop only pays for copying the arrays. Each checkpoint is a directory
+ckpt<step>; the file latest names the newest complete one and is replaced
+atomically after all files are written, so a crash while writing never
+leaves a broken latest checkpoint.
+"""
+from __future__ import absolute_import
+
+import os
+import copy
+import pickle
+import random
+import shutil
+import threading
+import numpy as np
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+def flatten(state, prefix=""):
+    """yields (path, value) for every leaf of the nested dict state"""
+    for key, value in state.items():
+        path = prefix + str(key)
+        if isinstance(value, dict):
+            for item in flatten(value, path + "/"):
+                yield item
+        else:
+            yield path, value
+
+
+def unflatten(items):
+    state = {}
+    for path, value in items:
+        node = state
+        keys = path.split("/")
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = value
+    return state
+
+
+def write(path, state):
+    os.makedirs(path)
+    meta = {}
+    for name, value in flatten(state):
+        if isinstance(value, np.ndarray):
+            np.save(os.path.join(path, name.replace("/", ".") + ".npy"), value)
+        else:
+            meta[name] = value
+    with open(os.path.join(path, "meta.pickle"), "wb") as f:
+        pickle.dump(meta, f, protocol=2)
+
+
+def latest(directory):
+    """the newest complete checkpoint in directory or None"""
+    try:
+        with open(os.path.join(directory, "latest")) as f:
+            return os.path.join(directory, f.read().strip())
+    except IOError:
+        return None
+
+
+def load(path, mmap=True):
+    """the state saved in path, arrays memory-mapped unless mmap=False"""
+    with open(os.path.join(path, "meta.pickle"), "rb") as f:
+        items = list(pickle.load(f).items())
+    for name in os.listdir(path):
+        if name.endswith(".npy"):
+            items.append((name[:-4].replace(".", "/"), np.load(os.path.join(path, name),
+                                                                 mmap_mode="r" if mmap else None)))
+    return unflatten(items)
+
+
+def runState(iteration, total_steps, agents, policy, episodes, metrics):
+    """what a runner needs to continue after iteration
+
+    agents and policy provide getState, metrics maps names to the metric
+    history lists. episodes may be None, e.g. after surrogate.py pretraining.
+    """
+    state = {"iteration": iteration, "total_steps": total_steps, "agents": agents.getState(),
+             "policy": policy.getState(), "rng": {"numpy": np.random.get_state(), "random": random.getstate()},
+             "metrics": dict(metrics)}
+    if episodes is not None:
+        state["episodes"] = episodes.random.get_state()
+    return state
+
+
+def resumeRun(state, agents, policy, episodes):
+    """restores a runState, returns (next iteration, total_steps, metrics)"""
+    agents.setState(state["agents"])
+    policy.setState(state["policy"])
+    if "episodes" in state:
+        episodes.random.set_state(state["episodes"])
+    np.random.set_state(state["rng"]["numpy"])
+    random.setstate(state["rng"]["random"])
+    return state["iteration"] + 1, state["total_steps"], state["metrics"]
+
+
+class Checkpointer:
+    """Saves checkpoints into directory on a background thread and keeps the last keep of them.
+
+    The checkpoints already in directory, e.g. of the run being resumed,
+    count towards keep as well.
+    """
+    def __init__(self, directory, keep=2):
+        self.directory = directory
+        self.keep = keep
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.queue = Queue()
+        self.saved = [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                      if name.startswith("ckpt") and os.path.isdir(os.path.join(directory, name))]
+        self.error = None
+        self.thread = threading.Thread(target=self.writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, step, state):
+        """snapshots state now and writes it in the background
+
+        Everything is copied here, so the caller may change it right after.
+        """
+        if self.error is not None:
+            raise self.error
+        snapshot = unflatten((name, np.array(value) if isinstance(value, np.ndarray) else copy.deepcopy(value))
+                             for name, value in flatten(state))
+        self.queue.put((step, snapshot))
+
+    def writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            step, state = item
+            try:
+                name = "ckpt%08i" % step
+                path = os.path.join(self.directory, name)
+                if os.path.exists(path):
+                    shutil.rmtree(path)
+                write(path, state)
+                tmp = os.path.join(self.directory, "latest.tmp")
+                with open(tmp, "w") as f:
+                    f.write(name)
+                os.rename(tmp, os.path.join(self.directory, "latest"))
+                if path in self.saved:
+                    self.saved.remove(path)
+                self.saved.append(path)
+                while len(self.saved) > self.keep:
+                    shutil.rmtree(self.saved.pop(0), ignore_errors=True)
+            except Exception as e:
+                self.error = e
+            self.queue.task_done()
+
+    def wait(self):
+        """blocks until every checkpoint saved so far is written"""
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.wait()
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,69 @@
+import numpy as np
+
+# TraCI variable ids (see traci.constants), repeated here so the collector
+# can be imported before the SUMO tools directory is on the path
+LAST_STEP_VEHICLE_NUMBER = 0x10
+LAST_STEP_MEAN_SPEED = 0x11
+LAST_STEP_VEHICLE_HALTING_NUMBER = 0x14
+VAR_CO2EMISSION = 0x60
+VAR_WAITING_TIME = 0x7a
+TL_CURRENT_PHASE = 0x28
+
+LANE_VARS = (LAST_STEP_VEHICLE_NUMBER, LAST_STEP_MEAN_SPEED, LAST_STEP_VEHICLE_HALTING_NUMBER,
+             VAR_WAITING_TIME, VAR_CO2EMISSION)
+LOOP_VARS = (LAST_STEP_VEHICLE_NUMBER, )
+TLS_VARS = (TL_CURRENT_PHASE, )
+
+
+def subscriptionResults(domain):
+    # newer traci versions dropped getSubscriptionResults(None) for all objects
+    if hasattr(domain, "getAllSubscriptionResults"):
+        return domain.getAllSubscriptionResults()
+    return domain.getSubscriptionResults(None)
+
+
+class StateCollector:
+    """Reads lane, induction loop and traffic light state once per step.
+
+    Every object is subscribed once, so after each simulationStep the values
+    arrive with the step response instead of one round-trip per query.
+    """
+    def __init__(self, conn, lanes=None, loops=None, lights=None):
+        self.conn = conn
+        self.lanes = list(lanes if lanes is not None else conn.lane.getIDList())
+        self.loops = list(loops if loops is not None else conn.inductionloop.getIDList())
+        self.lights = list(lights if lights is not None else conn.trafficlights.getIDList())
+        # one row per entry of LANE_VARS, the lane_* arrays are views of it
+        self.lane_values = np.zeros((len(LANE_VARS), len(self.lanes)))
+        (self.lane_vehicles, self.lane_speed, self.lane_halting, self.lane_waiting,
+         self.lane_co2) = self.lane_values
+        self.loop_vehicles = np.zeros(len(self.loops), dtype=np.int64)
+        self.phase = np.zeros(len(self.lights), dtype=np.int64)
+        self.subscribe()
+        self.update()
+
+    def subscribe(self):
+        for l in self.lanes:
+            self.conn.lane.subscribe(l, LANE_VARS)
+        for i in self.loops:
+            self.conn.inductionloop.subscribe(i, LOOP_VARS)
+        for l in self.lights:
+            self.conn.trafficlights.subscribe(l, TLS_VARS)
+
+    def update(self):
+        """copy the subscription results of the last step into the arrays"""
+        lanes = subscriptionResults(self.conn.lane)
+        self.lane_values.T[:] = [[lanes[l][v] for v in LANE_VARS] for l in self.lanes]
+        # an empty lane reports its speed limit as mean speed
+        self.lane_speed[self.lane_vehicles == 0] = 0
+        loops = subscriptionResults(self.conn.inductionloop)
+        for k, i in enumerate(self.loops):
+            self.loop_vehicles[k] = loops[i][LAST_STEP_VEHICLE_NUMBER]
+        lights = subscriptionResults(self.conn.trafficlights)
+        for k, l in enumerate(self.lights):
+            self.phase[k] = lights[l][TL_CURRENT_PHASE]
+
+    def setPhase(self, index, phase):
+        """set a phase and keep the cached value in sync until the next update"""
+        self.conn.trafficlights.setPhase(self.lights[index], phase)
+        self.phase[index] = phase
@@ -0,0 +1,71 @@
+"""
+Connections to SUMO over the different TraCI transports.
+
+"socket" starts sumo as a server and talks TraCI over a local socket, which
+costs a round trip per call. "libsumo" loads the simulation into this
+process through the libsumo binding, so a call is a plain function call.
+"embedded" is the traci module of a sumo that runs the script itself
+through --python-script, see embedded.py. All of them return something
+with the traci module interface.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+import subprocess
+
+TRANSPORTS = ("socket", "libsumo", "embedded")
+CONFIG = "data/cross.sumocfg"
+
+
+def sumoCommand(sumoBinary, extra=(), config=CONFIG):
+    return [sumoBinary, "-c", config] + list(extra)
+
+
+def isEmbedded():
+    try:
+        import traci
+    except ImportError:
+        return False
+    # traci.isEmbedded only exists in SUMO versions that support it
+    return getattr(traci, "isEmbedded", lambda: False)()
+
+
+def hasLibsumo():
+    try:
+        import libsumo
+    except ImportError:
+        return False
+    return True
+
+
+def compat(conn):
+    """the controllers use the old traci.trafficlights name"""
+    if not hasattr(conn, "trafficlights"):
+        conn.trafficlights = conn.trafficlight
+    return conn
+
+
+def launch(transport, sumoBinary, port, extra=(), stdout=sys.stdout, config=CONFIG):
+    """starts sumo and connects, returns the connection and the sumo process (None in process)
+
+    Without the libsumo binding "libsumo" falls back to "socket".
+    """
+    if transport == "embedded":
+        import traci
+        if not isEmbedded():
+            raise RuntimeError("not running inside sumo, start the script with embedded.py")
+        return compat(traci), None
+    if transport == "libsumo":
+        if hasLibsumo():
+            import libsumo
+            libsumo.start(sumoCommand(sumoBinary, extra, config))
+            return compat(libsumo), None
+        print("libsumo is not available, connecting over a socket instead")
+    elif transport != "socket":
+        raise ValueError("unknown transport %s" % transport)
+    import traci
+    sumoProcess = subprocess.Popen(sumoCommand(sumoBinary, list(extra) + ["--remote-port", str(port)], config),
+                                   stdout=stdout, stderr=sys.stderr)
+    traci.init(port)
+    return compat(traci), sumoProcess
@@ -0,0 +1,112 @@
+"""
+On-disk transition datasets for training without the simulator.
+
+A dataset is a directory with a meta.json and one sub directory per chunk,
+each holding the columns states.npy, actions.npy, rewards.npy,
+next_states.npy and done.npy. Chunks are read memory-mapped, so datasets
+larger than the available memory only page in what a batch touches.
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import numpy as np
+
+COLUMNS = ("states", "actions", "rewards", "next_states", "done")
+
+
+class TransitionRecorder:
+    """Streams transitions into chunks of chunk_size rows."""
+    def __init__(self, directory, input_size, chunk_size=65536):
+        self.directory = directory
+        self.input_size = input_size
+        self.chunk_size = chunk_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.chunks = []
+        metaFile = os.path.join(directory, "meta.json")
+        if os.path.exists(metaFile):
+            # append to an existing recording
+            with open(metaFile) as f:
+                meta = json.load(f)
+            if meta["input_size"] != input_size:
+                raise ValueError("%s holds states of size %i, not %i" % (directory, meta["input_size"], input_size))
+            self.chunks = meta["chunks"]
+        self.buffers = (np.empty((chunk_size, input_size), dtype=np.float32),
+                        np.empty(chunk_size, dtype=np.int64),
+                        np.empty(chunk_size, dtype=np.float32),
+                        np.empty((chunk_size, input_size), dtype=np.float32),
+                        np.empty(chunk_size, dtype=bool))
+        self.size = 0
+
+    def record(self, state, action, reward, newState, done=False):
+        i = self.size
+        states, actions, rewards, next_states, dones = self.buffers
+        states[i] = state
+        actions[i] = action
+        rewards[i] = reward
+        next_states[i] = newState
+        dones[i] = done
+        self.size += 1
+        if self.size == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.size == 0:
+            return
+        chunk = os.path.join(self.directory, "chunk%05i" % len(self.chunks))
+        if not os.path.isdir(chunk):
+            os.makedirs(chunk)
+        for name, column in zip(COLUMNS, self.buffers):
+            np.save(os.path.join(chunk, name + ".npy"), column[:self.size])
+        self.chunks.append(self.size)
+        self.size = 0
+        # meta.json is rewritten last so a crash never lists a partial chunk
+        tmp = os.path.join(self.directory, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"input_size": self.input_size, "chunks": self.chunks}, f)
+        os.rename(tmp, os.path.join(self.directory, "meta.json"))
+
+    def close(self):
+        self.flush()
+
+
+class TransitionDataset:
+    """Reads a recorded dataset, memory-mapped unless mmap=False."""
+    def __init__(self, directory, mmap=True):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.input_size = meta["input_size"]
+        self.sizes = np.array(meta["chunks"], dtype=np.int64)
+        mode = "r" if mmap else None
+        self.chunks = [tuple(np.load(os.path.join(directory, "chunk%05i" % k, name + ".npy"), mmap_mode=mode)
+                             for name in COLUMNS)
+                       for k in range(len(self.sizes))]
+
+    def __len__(self):
+        return int(self.sizes.sum())
+
+    def batches(self, batch_size, shuffle=True):
+        """one pass over all transitions as (states, actions, rewards, next_states, done) arrays
+
+        Shuffling happens within a chunk and over the chunk order, so only
+        one chunk at a time has to be paged in.
+        """
+        order = np.random.permutation(len(self.chunks)) if shuffle else np.arange(len(self.chunks))
+        for k in order:
+            chunk = self.chunks[k]
+            n = self.sizes[k]
+            rows = np.random.permutation(n) if shuffle else np.arange(n)
+            for begin in range(0, n, batch_size):
+                # sorted rows keep the reads from the mapped file sequential
+                index = np.sort(rows[begin:begin + batch_size])
+                yield tuple(np.asarray(column[index]) for column in chunk)
+
+    def sample(self, batch_size):
+        """a uniform random batch from the whole dataset"""
+        index = np.sort(np.random.randint(len(self), size=batch_size))
+        chunk = np.searchsorted(np.cumsum(self.sizes), index, side="right")
+        offsets = np.concatenate(([0], np.cumsum(self.sizes)[:-1]))
+        parts = [tuple(np.asarray(column[index[chunk == k] - offsets[k]]) for column in self.chunks[k])
+                 for k in np.unique(chunk)]
+        return tuple(np.concatenate(columns) for columns in zip(*parts))
@@ -0,0 +1,83 @@
+"""
+Route file generation from declarative demand profiles.
+
+A profile lists the demand periods of one episode as (begin, end,
+probability) with times relative to the episode start, how often the
+episode repeats and the origin/destination pairs. generate writes one
+<flow> per period, episode and pair. The profile hash is stored in the
+first line of the file, so an unchanged profile is not written again.
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import hashlib
+
+ROUTE_FILE = "data/cross.rou.xml"
+
+HEADER = """<routes>
+        <vType id="typeWE" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>
+        <vType id="typeNS" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>
+"""
+
+# all pairs of the 8 entries and exits of the cross network
+CROSS_PAIRS = [(i, j) for i in range(8) for j in range(8) if i != j]
+
+
+def profile(periods, episodes=1, episode_length=0, pairs=CROSS_PAIRS, vtype="typeWE"):
+    return {"periods": [list(p) for p in periods], "episodes": episodes, "episode_length": episode_length,
+            "pairs": [list(p) for p in pairs], "vtype": vtype}
+
+
+# runner.py: 500 episodes of 500s with rising and falling demand
+RUNNER = profile([(0, 100, 0.005), (100, 200, 0.007), (200, 300, 0.009), (300, 400, 0.007), (400, 500, 0.0045)],
+                 episodes=500, episode_length=500)
+# linear.py and shortcycle.py: constant demand
+LINEAR = profile([(0, 3600000, 0.007)])
+SHORTCYCLE = profile([(0, 360000, 0.009)])
+
+
+def profileHash(demand):
+    return hashlib.sha1(json.dumps(demand, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def stamp(demand):
+    return "<!-- demand %s -->\n" % profileHash(demand)
+
+
+def isCurrent(demand, path=ROUTE_FILE):
+    """whether path was generated from this profile"""
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        return f.readline() == stamp(demand)
+
+
+def flows(demand):
+    """yields the <flow> lines of one period of one episode at a time"""
+    vtype = demand["vtype"]
+    # the part after the probability is the same for every period
+    tails = ['" type="%s" from="%ii" to="%io"/>\n' % (vtype, i, j) for i, j in demand["pairs"]]
+    f = 0
+    for ep in range(demand["episodes"]):
+        b = ep * demand["episode_length"]
+        for begin, end, p in demand["periods"]:
+            head = '" begin="%i" end="%i" probability="%f' % (b + begin, b + end, p)
+            yield "".join(['    <flow id="%i%s%s' % (f + n, head, tail) for n, tail in enumerate(tails)])
+            f += len(tails)
+
+
+def generate(demand, path=ROUTE_FILE, force=False):
+    """writes the route file unless it is up to date, returns whether it wrote"""
+    if not force and isCurrent(demand, path):
+        return False
+    tmp = path + ".tmp"
+    with open(tmp, "w", 1 << 20) as routes:
+        routes.write(stamp(demand))
+        routes.write(HEADER)
+        for block in flows(demand):
+            routes.write(block)
+        routes.write("</routes>\n")
+    # a run that is interrupted never leaves a partial file with a valid stamp
+    os.rename(tmp, path)
+    return True
@@ -23,33 +23,65 @@ from __future__ import absolute_import
 
 import os
 import sys
+import json
 import subprocess
 # the embedded python does not add the current dir to the python path, so
 # we need to do it
 sys.path.append(os.path.dirname(__file__))
-import runner
+import connection
 
+# how each controller calls its run with its own options
+CONTROLLERS = {
+    "runner": lambda m, o: m.run(o.replay, o.agents, o.history_len, o.record, o.reset, o.warmup, o.pool_size,
+                                 o.reward, grid=o.grid, backend=o.backend, hidden=o.hidden,
+                                 target_period=o.target_period, tau=o.tau, checkpoint_dir=o.checkpoint,
+                                 checkpoint_interval=o.checkpoint_interval, resume=o.resume,
+                                 profile=o.profile, profile_trace=o.profile_trace,
+                                 profile_interval=o.profile_interval, pipeline=o.pipeline,
+                                 update_ratio=o.update_ratio,
+                                 snapshot_interval=o.snapshot_interval, index=m.networkIndex(o)),
+    "linear": lambda m, o: m.run(o.agents, o.history_len, o.detector_window, o.record, o.reset, o.warmup,
+                                 o.pool_size, o.reward, o.checkpoint, o.checkpoint_interval, o.resume,
+                                 index=m.networkIndex(o)),
+    "shortcycle": lambda m, o: m.run(o.history_len, o.detector_window, o.record, o.reset, o.warmup, o.pool_size,
+                                     o.reward, index=m.networkIndex(o)),
+}
 
-if runner.traci.isEmbedded():
+if connection.isEmbedded():
     # this script has been called from the sumo-internal python interpreter
-    # only execute the main control procedure
-    runner.run()
+    # only execute the main control procedure with the options of the outer call
+    name = os.environ.get("TRAFFIC_CONTROLLER", "runner")
+    sys.argv = [name + ".py"] + json.loads(os.environ.get("TRAFFIC_ARGS", "[]"))
+    controller = __import__(name)
+    CONTROLLERS[name](controller, controller.get_options())
 else:
-    options = runner.get_options()
+    # usage: embedded.py [runner|linear|shortcycle] [options of the controller]
+    name = "runner"
+    if len(sys.argv) > 1 and sys.argv[1] in CONTROLLERS:
+        name = sys.argv.pop(1)
+    controller = __import__(name)
+    options = controller.get_options()
     # this script has been called from the command line. It will start sumo with
     # this script as argument
     if options.nogui:
-        sumoBinary = runner.checkBinary('sumo')
+        sumoBinary = controller.checkBinary('sumo')
     else:
         # gui running probably does not work yet
-        sumoBinary = runner.checkBinary('sumo-gui')
+        sumoBinary = controller.checkBinary('sumo-gui')
 
-    # first, generate the route file for this simulation
-    runner.generate_routefile()
+    # first, generate the route file for this simulation, or the whole grid
+    # network for runner.py --grid
+    config = connection.CONFIG
+    if getattr(options, "grid", None):
+        config = controller.gridnet.generate(options.grid[0], options.grid[1], controller.checkBinary('netconvert'))
+    else:
+        controller.generate_routefile()
 
     # call sumo with the request to run this very same script again in the internal interpreter
-    # when this happens, the method traci.isEmbedded() in line 23 will evaluate to true
+    # when this happens, connection.isEmbedded() above will evaluate to true
     # and then the run method will be called
-    retCode = subprocess.call([sumoBinary, "-c", "data/cross.sumocfg", "--python-script", __file__],
+    os.environ["TRAFFIC_CONTROLLER"] = name
+    os.environ["TRAFFIC_ARGS"] = json.dumps(sys.argv[1:])
+    retCode = subprocess.call(connection.sumoCommand(sumoBinary, ["--python-script", __file__], config),
                               stdout=sys.stdout, stderr=sys.stderr)
     sys.exit(retCode)
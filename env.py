@@ -0,0 +1,69 @@
+import numpy as np
+import netindex
+from collector import StateCollector
+from observation import ObservationEncoder
+from episodes import EpisodeReset
+from rewards import Rewards
+
+
+# runner.REWARD: mean speed per lane minus scaled CO2
+REWARD = "speed:0.1,co2:-0.0001"
+
+
+class TrafficEnv:
+    """The observation, action and reward loop of runner.run on any connection.
+
+    conn is anything with the traci module interface: the traci module after
+    traci.init, a traci connection or a mocksumo.MockSumo. The observation
+    comes from an ObservationEncoder, so it is only valid until the step after
+    next. With reset set to one of the episodes.MODES every reset also
+    restores the traffic, otherwise the simulation just keeps running.
+    index is the netindex.NetIndex of the network like for runner.run.
+    """
+    def __init__(self, conn, history_len=5, loops=False, detector_window=20, decision_interval=15, reset=None,
+                 reward=REWARD, index=None):
+        self.conn = conn
+        if index is None:
+            self.collector = StateCollector(conn)
+        else:
+            self.collector = StateCollector(conn, index.lanes, index.loops, index.lights)
+        self.lights = self.collector.lights
+        self.phases = netindex.standard(len(self.lights)) if index is None else index.phaseTable()
+        self.rewards = Rewards(reward)
+        self.encoder = ObservationEncoder(len(self.lights), len(self.collector.loops), history_len,
+                                          detector_window, loops)
+        self.decision_interval = decision_interval
+        self.num_actions = 2
+        self.input_size = self.encoder.input_size
+        self.episodes = EpisodeReset(conn, reset) if reset else None
+        self.reset()
+
+    def reset(self):
+        self.t = 0
+        if self.episodes:
+            self.episodes.reset()
+        for k in range(len(self.lights)):
+            self.collector.setPhase(k, self.phases.greens[k, 0])
+        return self.encoder.reset()
+
+    def decisions(self):
+        """lights that may pick an action in this step"""
+        if self.t % self.decision_interval != 0:
+            return np.zeros(len(self.lights), dtype=bool)
+        return self.phases.decisions(self.collector.phase)
+
+    def step(self, actions):
+        """actions holds one action per light, -1 keeps the current phase"""
+        changed = 0
+        for k, l in enumerate(self.lights):
+            changed += self.phases.setState(self.conn, l, k, actions[k], self.collector.phase[k])
+        self.conn.simulationStep()
+        self.collector.update()
+        self.t += 1
+        ss = self.encoder.update(self.collector.phase, self.collector.loop_vehicles)
+        return ss, self.rewards.evaluate(self.collector, changed)
+
+    def close(self):
+        if self.episodes:
+            self.episodes.close()
+        self.conn.close()
@@ -0,0 +1,146 @@
+"""
+Episode resets through saved simulation states.
+
+Removing every vehicle at the end of an episode costs one TraCI call per
+vehicle and keeps the simulation clock running, so the next episode starts
+wherever the demand happens to be. EpisodeReset instead loads a simulation
+state saved after a warm-up period, picked at random from a pool, in one
+call. The states are written once into a directory and reused by later runs.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+MODES = ("remove", "snapshot", "pool")
+
+
+def removeVehicles(conn):
+    for car in conn.vehicle.getIDList():
+        conn.vehicle.remove(car)
+
+
+def canSaveState(conn):
+    return hasattr(conn.simulation, "saveState") and hasattr(conn.simulation, "loadState")
+
+
+class EpisodeReset:
+    """Brings the simulation back to the start of an episode.
+
+    mode "remove" removes all vehicles like runner.run used to, "snapshot"
+    loads the state reached after warmup steps and "pool" loads one of
+    pool_size states saved warmup, warmup + interval, ... steps into the
+    simulation. Without saveState/loadState on the connection it falls back
+    to "remove". Without a directory the states go into a temporary one that
+    close removes. Saved states are only valid for the network and route file
+    they were made with, so directory should change with both, see
+    stateDirectory. The warm-up settings go into a manifest next to the
+    states and prepare saves the pool again when they do not match. Only
+    "remove" keeps the clock running, so only it lines the episodes up with
+    time varying demand like demand.RUNNER, the runners default to it.
+    """
+    def __init__(self, conn, mode="remove", directory=None, warmup=300, pool_size=8, interval=100, seed=None):
+        if mode not in MODES:
+            raise ValueError("unknown reset mode %s" % mode)
+        self.conn = conn
+        self.mode = mode
+        self.directory = directory
+        self.warmup = warmup
+        self.pool_size = 1 if mode == "snapshot" else pool_size
+        self.interval = interval
+        self.random = np.random.RandomState(seed)
+        self.states = None
+        self.temporary = None
+        if mode != "remove" and not canSaveState(conn):
+            print("the connection cannot save simulation states, removing vehicles instead")
+            self.mode = "remove"
+
+    def stateFile(self, k):
+        return os.path.join(self.directory, "warm%03i.xml" % k)
+
+    def manifestFile(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def readManifest(self):
+        """the settings the saved states were made with, None without a manifest"""
+        try:
+            with open(self.manifestFile()) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def reusable(self):
+        """whether the directory holds the pool for these settings"""
+        manifest = self.readManifest()
+        if manifest is None or manifest.get("warmup") != self.warmup:
+            return False
+        # a larger pool saved with the same settings starts with this one
+        if manifest.get("interval") != self.interval and self.pool_size > 1:
+            return False
+        if manifest.get("pool_size", 0) < self.pool_size:
+            return False
+        return all(os.path.exists(f) for f in self.states)
+
+    def prepare(self):
+        """saves the pool unless the directory already holds it, returns the state files"""
+        if self.directory is None:
+            self.directory = self.temporary = tempfile.mkdtemp(prefix="states")
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.states = [self.stateFile(k) for k in range(self.pool_size)]
+        if self.reusable():
+            return self.states
+        # states of other settings are never mixed with the new ones, the
+        # manifest is written last so an interrupted run leaves none
+        if os.path.exists(self.manifestFile()):
+            os.remove(self.manifestFile())
+        for name in os.listdir(self.directory):
+            if name.startswith("warm") and name.endswith(".xml"):
+                os.remove(os.path.join(self.directory, name))
+        # the warm-up runs the programs of the network, a loaded state starts
+        # an episode in the middle of the traffic it produced
+        for k, f in enumerate(self.states):
+            for t in range(self.warmup if k == 0 else self.interval):
+                self.conn.simulationStep()
+            self.conn.simulation.saveState(f)
+        with open(self.manifestFile(), "w") as f:
+            json.dump({"warmup": self.warmup, "interval": self.interval, "pool_size": self.pool_size}, f)
+        return self.states
+
+    def reset(self):
+        """restores an episode start, returns the index of the loaded state or -1"""
+        if self.mode == "remove":
+            removeVehicles(self.conn)
+            return -1
+        if self.states is None:
+            self.prepare()
+        k = self.random.randint(len(self.states))
+        self.conn.simulation.loadState(self.states[k])
+        return k
+
+    def close(self):
+        """removes the temporary state directory, if any"""
+        if self.temporary is not None:
+            shutil.rmtree(self.temporary, ignore_errors=True)
+            self.directory = self.temporary = self.states = None
+
+
+def stateDirectory(routeFile="data/cross.rou.xml", netFile="data/cross.net.xml", root="data/states"):
+    """a directory for the states of the current route and network file
+
+    demand.generate stamps the profile hash into the first line of the route
+    file, the network goes in with its contents, so states saved for other
+    demand or another network are never loaded.
+    """
+    h = hashlib.sha1()
+    with open(routeFile, "rb") as f:
+        h.update(f.readline() + str(os.path.getsize(routeFile)).encode("ascii"))
+    with open(netFile, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return os.path.join(root, h.hexdigest()[:12])
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+Generated rows x cols grid networks for running the controllers on more
+than the four lights of data/cross.net.xml.
+
+generate writes nodes, edges, detectors, routes and a sumo config into
+data/grid<rows>x<cols>/ and calls netconvert for the net. Every junction is
+a traffic light with one single lane approach per direction and an
+induction loop before the stop line. The layout (which lights neighbour
+each other and which loops belong to which approach) is written to
+layout.json, Topology turns it into index arrays for the ids the simulation
+reports. The light, edge and detector ids are strings on purpose, nothing
+may assume they are small integers.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import json
+import optparse
+import subprocess
+import numpy as np
+
+import demand
+
+DIRECTIONS = "NESW"
+# row and column offset of the neighbour in each direction
+OFFSETS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+LENGTH = 150.0
+ARM = 400.0
+# vehicles per second entering at every fringe edge
+ENTRY_RATE = 0.1
+
+
+def directory(rows, cols):
+    return os.path.join("data", "grid%ix%i" % (rows, cols))
+
+
+def lightId(r, c):
+    return "n%i_%i" % (r, c)
+
+
+def loopId(r, c, d):
+    return "d%i_%i%s" % (r, c, DIRECTIONS[d])
+
+
+def layout(rows, cols, lightId=lightId, loopId=loopId):
+    """neighbours (None at the border) and approach loops of every light in NESW order"""
+    lights = [lightId(r, c) for r in range(rows) for c in range(cols)]
+    neighbours, loops = {}, {}
+    for r in range(rows):
+        for c in range(cols):
+            l = lightId(r, c)
+            neighbours[l] = [lightId(r + dr, c + dc) if 0 <= r + dr < rows and 0 <= c + dc < cols else None
+                             for dr, dc in OFFSETS]
+            loops[l] = [loopId(r, c, d) for d in range(len(DIRECTIONS))]
+    return {"rows": rows, "cols": cols, "lights": lights, "neighbours": neighbours, "loops": loops}
+
+
+def mockLayout(rows, cols):
+    """the layout of mocksumo.MockSumo(lights=rows * cols) read as a grid"""
+    return layout(rows, cols, lambda r, c: str(r * cols + c),
+                  lambda r, c, d: str((r * cols + c) * len(DIRECTIONS) + d))
+
+
+def fringes(rows, cols):
+    """(row, col, direction) of every border approach, the index is the fringe edge number"""
+    result = []
+    for c in range(cols):
+        result.append((rows - 1, c, 0))
+        result.append((0, c, 2))
+    for r in range(rows):
+        result.append((r, cols - 1, 1))
+        result.append((r, 0, 3))
+    return result
+
+
+def profile(rows, cols):
+    n = len(fringes(rows, cols))
+    pairs = [(i, j) for i in range(n) for j in range(n) if i != j]
+    return demand.profile([(0, 3600000, ENTRY_RATE / (n - 1))], pairs=pairs)
+
+
+def writeFiles(rows, cols, path):
+    nodes, edges, detectors = [], [], []
+    for r in range(rows):
+        for c in range(cols):
+            nodes.append('   <node id="%s" x="%.1f" y="%.1f" type="traffic_light"/>' % (lightId(r, c), c * LENGTH, r * LENGTH))
+    # the edge from each side into a light, fringe edges are named
+    # <k>i and <k>o like in the cross network so demand can address them
+    incoming = {}
+    for k, (r, c, d) in enumerate(fringes(rows, cols)):
+        dr, dc = OFFSETS[d]
+        node = "f%i" % k
+        nodes.append('   <node id="%s" x="%.1f" y="%.1f" type="priority"/>' % (
+            node, c * LENGTH + dc * ARM, r * LENGTH + dr * ARM))
+        edges.append('   <edge id="%ii" from="%s" to="%s" numLanes="1" speed="13.89"/>' % (k, node, lightId(r, c)))
+        edges.append('   <edge id="%io" from="%s" to="%s" numLanes="1" speed="13.89"/>' % (k, lightId(r, c), node))
+        incoming[(r, c, d)] = "%ii" % k
+    for r in range(rows):
+        for c in range(cols):
+            for d, (dr, dc) in enumerate(OFFSETS):
+                if 0 <= r + dr < rows and 0 <= c + dc < cols:
+                    edge = "%s-%s" % (lightId(r + dr, c + dc), lightId(r, c))
+                    edges.append('   <edge id="%s" from="%s" to="%s" numLanes="1" speed="13.89"/>' % (
+                        edge, lightId(r + dr, c + dc), lightId(r, c)))
+                    incoming[(r, c, d)] = edge
+                detectors.append('   <inductionLoop id="%s" lane="%s_0" pos="-10" friendlyPos="true" freq="30" file="grid.out"/>' % (
+                    loopId(r, c, d), incoming[(r, c, d)]))
+    files = {"grid.nod.xml": "<nodes>\n%s\n</nodes>\n" % "\n".join(nodes),
+             "grid.edg.xml": "<edges>\n%s\n</edges>\n" % "\n".join(edges),
+             "grid.det.xml": "<additional>\n%s\n</additional>\n" % "\n".join(detectors),
+             "grid.sumocfg": """<configuration>
+    <input>
+        <net-file value="grid.net.xml"/>
+        <route-files value="grid.rou.xml"/>
+        <additional-files value="grid.det.xml"/>
+    </input>
+    <report>
+        <no-step-log value="true"/>
+    </report>
+</configuration>
+"""}
+    for name, content in files.items():
+        with open(os.path.join(path, name), "w") as f:
+            f.write(content)
+    with open(os.path.join(path, "layout.json"), "w") as f:
+        json.dump(layout(rows, cols), f)
+
+
+def generate(rows, cols, netconvert="netconvert", force=False):
+    """writes the grid files unless they exist, returns the sumo config"""
+    path = directory(rows, cols)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    net = os.path.join(path, "grid.net.xml")
+    if force or not os.path.exists(net):
+        writeFiles(rows, cols, path)
+        # opposites gives the same four phase program as the cross network,
+        # green north/south, yellow, green east/west, yellow
+        subprocess.check_call([netconvert, "--node-files", os.path.join(path, "grid.nod.xml"),
+                               "--edge-files", os.path.join(path, "grid.edg.xml"), "--output-file", net,
+                               "--no-turnarounds", "--tls.layout", "opposites", "--tls.left-green.time", "0"])
+    demand.generate(profile(rows, cols), os.path.join(path, "grid.rou.xml"))
+    return os.path.join(path, "grid.sumocfg")
+
+
+def loadLayout(rows, cols):
+    with open(os.path.join(directory(rows, cols), "layout.json")) as f:
+        return json.load(f)
+
+
+class Topology:
+    """The layout as index arrays into the light and loop order of a StateCollector.
+
+    neighbours[k] holds the indices of the lights next to light k and
+    approaches[k] the indices of the loops on its approaches, both in NESW
+    order with -1 where there is none.
+    """
+    def __init__(self, layout, lights, loops):
+        lightIndex = dict((l, k) for k, l in enumerate(lights))
+        loopIndex = dict((i, k) for k, i in enumerate(loops))
+        self.neighbours = np.array([[lightIndex[n] if n is not None else -1 for n in layout["neighbours"][l]]
+                                    for l in lights], dtype=np.int64)
+        self.approaches = np.array([[loopIndex.get(i, -1) for i in layout["loops"][l]] for l in lights],
+                                   dtype=np.int64)
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser(usage="%prog [options] ROWS COLS")
+    optParser.add_option("--netconvert", default="netconvert", help="netconvert binary")
+    optParser.add_option("--force", action="store_true", default=False, help="regenerate existing files")
+    options, args = optParser.parse_args()
+    if len(args) != 2:
+        optParser.error("expected the number of rows and columns")
+    print(generate(int(args[0]), int(args[1]), options.netconvert, options.force))
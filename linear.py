@@ -29,8 +29,17 @@ import subprocess
 import random
 import time
 import numpy as np
-from linearreg import Linear
-from sklearn import linear_model
+import demand
+from collector import StateCollector
+from rewards import Rewards
+from observation import ObservationEncoder
+from dataset import TransitionRecorder
+import connection
+import netindex
+import checkpoint
+from episodes import EpisodeReset, stateDirectory
+from linearreg import LinearAgents
+from policy import EpsilonGreedy
 
 # we need to import python modules from the $SUMO_HOME/tools directory
 try:
@@ -40,10 +49,21 @@ try:
         os.path.dirname(__file__), "..", "..", "..")), "tools"))  # tutorial in docs
     from sumolib import checkBinary
 except ImportError:
-    sys.exit(
-        "please declare environment variable 'SUMO_HOME' as the root directory of your sumo installation (it should contain folders 'bin', 'tools' and 'docs')")
+    # run works on a connection passed in, e.g. mocksumo, without SUMO
+    def checkBinary(name):
+        sys.exit(
+            "please declare environment variable 'SUMO_HOME' as the root directory of your sumo installation (it should contain folders 'bin', 'tools' and 'docs')")
+
+try:
+    import traci
+except ImportError:
+    traci = None
+
+try:
+    xrange
+except NameError:
+    xrange = range
 
-import traci
 # the port used for communicating with your sumo instance
 PORT = 8873
 
@@ -51,23 +71,7 @@ startTime = {}
 
 def generate_routefile():
     random.seed(42)  # make tests reproducible
-    N = 3600000  # number of time steps
-    p = "0.007" #probability of generating car
-    # demand per second from different directions
-    pWE = 1. / 10
-    pEW = 1. / 10
-    pNS = 1. / 20
-    pSN = 1. / 20
-    with open("data/cross.rou.xml", "w") as routes:
-        print("""<routes>
-        <vType id="typeWE" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>
-        <vType id="typeNS" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>""", file=routes)
-        for i in range(8):
-            for j in range(8):
-                if i == j:
-                    continue
-                print('    <flow id="%i" begin="0" end="%i" probability="%s" type="typeWE" from="%ii" to="%io"/>' % (i * 8 + j, N, p, i, j), file=routes)
-        print("</routes>", file=routes)
+    demand.generate(demand.LINEAR)
 
 # The program looks like this
 #    <tlLogic id="0" type="static" programID="0" offset="0">
@@ -78,149 +82,133 @@ def generate_routefile():
 #        <phase duration="6"  state="ryry"/>
 #    </tlLogic>
 
-def actionState(l):
-    actions = []
-    if traci.trafficlights.getPhase(l) % 2 == 0:
-        # we are not already switching
-        actions.append(0)
-        actions.append(1)
-    return actions
-
-def setState(light, action):
-    #0 is default state, 1 is other state
-    s = traci.trafficlights.getPhase(light)
-    if action == 0:
-        if s == 0:
-            traci.trafficlights.setPhase(light, 0)
-        else:
-            traci.trafficlights.setPhase(light, 3)
-            return 1
-    if action == 1:
-        if s == 2:
-            traci.trafficlights.setPhase(light, 2)
-        else:
-            traci.trafficlights.setPhase(light, 1)
-            return 1
-    return 0
+# which phases are decisions and how actions switch comes from
+# netindex.PhaseTable, for this program action 0 asks for phase 0 and
+# action 1 for phase 2, each through the yellow phase before it
+
+
+def networkIndex(options):
+    """the netindex.NetIndex of the network the options control"""
+    return netindex.load(netindex.NET_FILE, netindex.DETECTOR_FILE)
 
 e = 1
 
-def getReward(changed):
-    lanes = traci.lane.getIDList()
-    s = 0.0
-    for l in lanes:
-        q, w, speed = 0, 0, 0
-        for c in traci.lane.getLastStepVehicleIDs(l):
-            if traci.vehicle.getWaitingTime(c) > 0:
-                q += 1
-            speed += traci.vehicle.getSpeed(c)
-        speed /= max(1, len(traci.lane.getLastStepVehicleIDs(l))) * 10
-        w = traci.lane.getWaitingTime(l)
-        #s -= 1 * (q) ** 1.5 + 2 * (w) ** 1.5 - speed ** 1.5
-        s += speed
-    #s /= max(len(traci.vehicle.getIDList()), 1)
-    #for l in lanes:        
-        #s -= traci.lane.getCO2Emission(l) / 10000.0
-    #s -= changed
-    return s
-
-def getCO2():
-    s = 0
-    for l in traci.lane.getIDList():
-        s += traci.lane.getCO2Emission(l)
-    return s
-
-def getWaitingTime():
-    s = 0
-    for l in traci.lane.getIDList():
-        for c in traci.lane.getLastStepVehicleIDs(l):
-            if traci.vehicle.getWaitingTime(c) > 0:
-                s += 1
-    return s
-
-def step(lights, loops, history, cars_detected, actions):
-    light_state = [0] * len(lights)
-    cars_total = [0] * len(loops)
+# reward terms and their weights, see rewards.TERMS
+REWARD = "speed:0.1"
+# the waiting time metric: number of waiting cars
+WAITING = "halting"
+
+
+def step(collector, encoder, rewards, actions, phases):
     changed = 0
-    for l in lights:
-        changed += setState(l, actions[int(l)])
+    for k, l in enumerate(collector.lights):
+        changed += phases.setState(traci, l, k, actions[k], collector.phase[k])
     traci.simulationStep()
-    for l in lights:
-        light_state[int(l)] = traci.trafficlights.getPhase(l)
-        history[int(l)].append(traci.trafficlights.getPhase(l))
-        history[int(l)].pop(0)
-    for i in loops:
-        cars_detected[int(i)].append(traci.inductionloop.getLastStepVehicleNumber(i))
-        cars_detected[int(i)].pop(0)
-        cars_total[int(i)] = sum(cars_detected[int(i)])
-    ss = np.append(cars_total, light_state)
-    ss = np.append(ss, sum(history, []))
-    cars = traci.vehicle.getIDList()
-    r = getReward(changed)
-    #for c in cars:
+    collector.update()
+    ss = encoder.update(collector.phase, collector.loop_vehicles)
+    r = rewards.evaluate(collector, changed)
+    #for c in traci.vehicle.getIDList():
         #travel_time = traci.simulation.getCurrentTime() / 1000 - startTime[c]
         #r -= travel_time
-    return ss, r, cars_detected, history
+    return ss, r
 
 
-def run():
-    """execute the TraCI control loop"""
-    # first, generate the route file for this simulation
-    generate_routefile()
-    traci.init(PORT)
-    loops = traci.inductionloop.getIDList()
-    lights = traci.trafficlights.getIDList()
-    history_len = 10
-    input_size = len(loops) + len(lights) + history_len * len(lights)
-    num_actions = 2
-    update_target = 10
-    e = 1
-    linear = [Linear(input_size, num_actions)] * len(lights)
-    maxSteps = 500
-    total_steps = 0
-    totalCO2, totalWaitingTime = [], []
-    for iteration in xrange(0, 1000):
-        R, t = 0, 0
-        cars_detected = [[0 for i in range(20)] for j in range(len(loops))]
-        history = [[0 for i in range(history_len)] for j in range(len(lights))]
-        s = [0] * (input_size)
-        actions = [0] * len(lights)
-        totalCO2.append(0)
-        totalWaitingTime.append(0)
-        for l in lights:
-            traci.trafficlights.setPhase(l, 0)
-        while t < maxSteps:
-            for l in lights:
-                a = -1
-                if len(actionState(l)) == 0 or t % 15 != 0:
-                    actions[int(l)] = -1
-                    continue
-                elif np.random.uniform() < e:
-                    a = np.random.choice(actionState(l))
-                else:
-                    a = linear[int(l)].getAction(s)
-                actions[int(l)] = a
-            ss, r, cars_detected, history = step(lights, loops, history, cars_detected, actions)
-            R += r
-            totalWaitingTime[len(totalWaitingTime) - 1] += getWaitingTime()
-            totalCO2[len(totalWaitingTime) - 1] += getCO2()
-            for l in lights:
-                sa = [s, actions[int(l)], r, ss]
-                linear[int(l)].trainModel(sa, 0.9, input_size, num_actions)
-            t += 1
-            total_steps += 1
-            if e > 0.01:
-                e *= 0.9999
-            s = ss
-        totalWaitingTime[len(totalWaitingTime) - 1] /= t
-        totalCO2[len(totalWaitingTime) - 1] /= t
-        if iteration > 10:
-            totalWaitingTime.pop(0)
-            totalCO2.pop(0)
-        print('Iteration %i completed with Average CO2: %d and Average waiting time %d reward %i' % (iteration, sum(totalCO2) / len(totalCO2), sum(totalWaitingTime) / len(totalWaitingTime), R))
-        for car in traci.vehicle.getIDList():
-            traci.vehicle.remove(car)
-    traci.close()
+def run(agents="shared", history_len=10, detector_window=20, record=None, reset="remove", warmup=300,
+        pool_size=8, reward=REWARD, checkpoint_dir=None, checkpoint_interval=10, resume=False, iterations=1000,
+        index=None, conn=None):
+    """execute the TraCI control loop, on conn if given
+
+    With checkpoint_dir the training state is saved there every
+    checkpoint_interval iterations, resume continues from the latest
+    checkpoint in it. index is the netindex.NetIndex of the network, without it the ids come
+    from the simulation and every light runs netindex.STANDARD.
+    """
+    global traci
+    # the module level traci is rebound to the connection of this run,
+    # later users get the previous one back
+    previous = traci
+    try:
+        # first, generate the route file for this simulation
+        generate_routefile()
+        if conn is not None:
+            # all functions of this module talk to the traci name
+            traci = conn
+        elif not connection.isEmbedded():
+            traci.init(PORT)
+        if index is None:
+            collector = StateCollector(traci)
+        else:
+            collector = StateCollector(traci, index.lanes, index.loops, index.lights)
+        rewards = Rewards(reward, ("co2", WAITING))
+        loops = collector.loops
+        lights = collector.lights
+        phases = netindex.standard(len(lights)) if index is None else index.phaseTable()
+        encoder = ObservationEncoder(len(lights), len(loops), history_len, detector_window, loops=True)
+        input_size = encoder.input_size
+        recorder = TransitionRecorder(record, input_size) if record else None
+        episodes = EpisodeReset(traci, reset, stateDirectory(), warmup, pool_size)
+        num_actions = 2
+        update_target = 10
+        policy = EpsilonGreedy(num_actions, decay=0.9999, legal=phases.legal)
+        linear = LinearAgents(len(lights), input_size, num_actions, shared=agents == "shared")
+        light_index = np.arange(len(lights))
+        maxSteps = 500
+        total_steps = 0
+        totalCO2, totalWaitingTime = [], []
+        start = 0
+        checkpoints = checkpoint.Checkpointer(checkpoint_dir) if checkpoint_dir else None
+        if resume and checkpoint.latest(checkpoint_dir):
+            path = checkpoint.latest(checkpoint_dir)
+            start, total_steps, metrics = checkpoint.resumeRun(checkpoint.load(path), linear, policy, episodes)
+            totalCO2, totalWaitingTime = metrics["co2"], metrics["waiting"]
+            print('Resuming from %s at iteration %i' % (path, start))
+        elif resume:
+            print('No checkpoint in %s, starting a new run' % checkpoint_dir)
+        for iteration in xrange(start, iterations):
+            R, t = 0, 0
+            episodes.reset()
+            s = encoder.reset()
+            totalCO2.append(0)
+            totalWaitingTime.append(0)
+            for k in range(len(lights)):
+                collector.setPhase(k, phases.greens[k, 0])
+            while t < maxSteps:
+                # all lights at once, -1 for the ones that keep their phase
+                actions = policy.act(linear.getQValues, encoder.lights(s), collector.phase, t)
+                ss, r = step(collector, encoder, rewards, actions, phases)
+                R += r
+                if recorder:
+                    for k in range(len(lights)):
+                        if actions[k] != -1:
+                            recorder.record(s, actions[k], r, ss)
+                totalWaitingTime[len(totalWaitingTime) - 1] += rewards.value(WAITING)
+                totalCO2[len(totalWaitingTime) - 1] += rewards.value("co2")
+                # one transition per light, lights without a decision update the
+                # last action like model[-1] did in the per light trainModel calls
+                a = actions.copy()
+                a[a < 0] = num_actions - 1
+                n = len(lights)
+                linear.trainBatch(light_index, np.tile(s, (n, 1)), a[light_index], np.full(n, r), np.tile(ss, (n, 1)), 0.9)
+                t += 1
+                total_steps += 1
+                s = ss
+            totalWaitingTime[len(totalWaitingTime) - 1] /= t
+            totalCO2[len(totalWaitingTime) - 1] /= t
+            if iteration > 10:
+                totalWaitingTime.pop(0)
+                totalCO2.pop(0)
+            print('Iteration %i completed with Average CO2: %d and Average waiting time %d reward %i' % (iteration, sum(totalCO2) / len(totalCO2), sum(totalWaitingTime) / len(totalWaitingTime), R))
+            if checkpoints and (iteration + 1) % checkpoint_interval == 0:
+                checkpoints.save(iteration, checkpoint.runState(iteration, total_steps, linear, policy, episodes,
+                                                                {"co2": totalCO2, "waiting": totalWaitingTime}))
+        if checkpoints:
+            checkpoints.close()
+        if recorder:
+            recorder.close()
+        episodes.close()
+        traci.close()
+    finally:
+        traci = previous
     sys.stdout.flush()
 
 
@@ -228,7 +216,33 @@ def get_options():
     optParser = optparse.OptionParser()
     optParser.add_option("--nogui", action="store_true",
                          default=False, help="run the commandline version of sumo")
+    optParser.add_option("--history-len", type="int", default=10,
+                         help="number of past phases per light in the observation [default: %default]")
+    optParser.add_option("--detector-window", type="int", default=20,
+                         help="steps the detector counts are summed over [default: %default]")
+    optParser.add_option("--agents", type="choice", choices=["shared", "independent"], default="shared",
+                         help="one model for all lights or one per light [default: %default]")
+    optParser.add_option("--record", metavar="DIR",
+                         help="write all transitions to this dataset directory for offline.py")
+    optParser.add_option("--reward", default=REWARD,
+                         help="reward terms and weights as name:weight,... [default: %default]")
+    optParser.add_option("--transport", type="choice", choices=["socket", "libsumo"], default="socket",
+                         help="talk to sumo over a socket or run it in this process [default: %default]")
+    optParser.add_option("--reset", type="choice", choices=["remove", "snapshot", "pool"], default="remove",
+                         help="start episodes by removing all vehicles, from one saved state or from a pool of them [default: %default]")
+    optParser.add_option("--warmup", type="int", default=300,
+                         help="simulation steps before the first saved state [default: %default]")
+    optParser.add_option("--pool-size", type="int", default=8,
+                         help="number of saved states to start episodes from [default: %default]")
+    optParser.add_option("--checkpoint", metavar="DIR",
+                         help="save the training state to this directory while running")
+    optParser.add_option("--checkpoint-interval", type="int", default=10,
+                         help="iterations between checkpoints [default: %default]")
+    optParser.add_option("--resume", action="store_true", default=False,
+                         help="continue from the latest checkpoint in the --checkpoint directory")
     options, args = optParser.parse_args()
+    if options.resume and not options.checkpoint:
+        optParser.error("--resume needs --checkpoint DIR")
     return options
 
 
@@ -244,8 +258,13 @@ if __name__ == "__main__":
         sumoBinary = checkBinary('sumo')
 
     # this is the normal way of using traci. sumo is started as a
-    # subprocess and then the python script connects and runs
-    sumoProcess = subprocess.Popen([sumoBinary, "-c", "data/cross.sumocfg", "--tripinfo-output",
-                                    "tripinfo.xml", "--remote-port", str(PORT)], stdout=sys.stdout, stderr=sys.stderr)
-    run()
-    sumoProcess.wait()
+    # subprocess and then the python script connects and runs, with
+    # --transport libsumo it runs in this process instead
+    generate_routefile()
+    conn, sumoProcess = connection.launch(options.transport, sumoBinary, PORT, ["--tripinfo-output", "tripinfo.xml"])
+    run(options.agents, options.history_len, options.detector_window,
+        options.record, options.reset, options.warmup, options.pool_size,
+        options.reward, options.checkpoint, options.checkpoint_interval, options.resume,
+        index=networkIndex(options), conn=conn)
+    if sumoProcess:
+        sumoProcess.wait()
@@ -4,24 +4,73 @@ import numpy as np
 learning_rate = 0.01
 
 class Linear:
+    """Linear Q-function with one row of weights per action."""
     def __init__(self, input_size, num_actions):
-        self.model = [self.createModel(input_size), self.createModel(input_size)]
+        self.model = np.random.rand(num_actions, input_size)
 
-    def createModel(self, input_size):
-            model = np.random.rand(input_size)
-            return model
     def getAction(self, state):
-        state = np.array(state)
-        q0 = np.dot(self.model[0], state)
-        q1 = np.dot(self.model[1], state)
-        return int(q1 > q0)
+        return int(np.argmax(np.dot(self.model, state)))
+    def getActions(self, states):
+        """greedy action for every row of states, e.g. one per light"""
+        return np.argmax(self.getQValues(states), axis=1)
+    def getQValues(self, states):
+        return np.dot(states, self.model.T)
     def trainModel(self, sa, discount, input_size, num_actions):
-            state = np.array(sa[0])
+            state = np.asarray(sa[0])
             action = sa[1]
             reward = sa[2]
-            newState = np.array(sa[3])
-            a = self.getAction(newState)
-            d = reward + discount * np.dot(self.model[a], newState) -  np.dot(self.model[action], state)
-            for i in range(input_size):
-                #print(self.model[action])
-                self.model[action][i] += learning_rate * d * state[i]
\ No newline at end of file
+            newState = np.asarray(sa[3])
+            d = reward + discount * np.max(np.dot(self.model, newState)) - np.dot(self.model[action], state)
+            self.model[action] += learning_rate * d * state
+    def trainBatch(self, states, actions, rewards, newStates, discount):
+        """TD update from many transitions at once
+
+        All TD errors are computed with the current weights and the updates
+        are summed, like a single gradient step on the whole batch.
+        """
+        states = np.asarray(states)
+        actions = np.asarray(actions)
+        d = rewards + discount * np.max(np.dot(newStates, self.model.T), axis=1) \
+            - np.einsum('ij,ij->i', self.model[actions], states)
+        for a in range(len(self.model)):
+            self.model[a] += learning_rate * np.dot(d * (actions == a), states)
+
+
+class LinearAgents:
+    """Linear Q-functions of many lights stacked into one weight tensor.
+
+    With shared=True every light uses the same weights, otherwise light k
+    has its own (num_actions x input_size) matrix weights[k]. Action choice
+    and TD updates for all lights are single array operations either way.
+    """
+    def __init__(self, num_agents, input_size, num_actions, shared=True):
+        self.shared = shared
+        self.weights = np.random.rand(1 if shared else num_agents, num_actions, input_size)
+
+    def agents(self, lights):
+        lights = np.asarray(lights)
+        return np.zeros_like(lights) if self.shared else lights
+
+    def getActions(self, lights, states):
+        """greedy action of light lights[i] in states[i]"""
+        return np.argmax(self.getQValues(lights, states), axis=1)
+    def getQValues(self, lights, states):
+        if self.shared:
+            return np.dot(states, self.weights[0].T)
+        return np.einsum('iad,id->ia', self.weights[self.agents(lights)], states)
+    def trainBatch(self, lights, states, actions, rewards, newStates, discount, scale=1.0):
+        """TD update for transition i of light lights[i], all computed with the current weights
+
+        The updates are summed, scale multiplies the learning rate, e.g. to
+        average over simulations that run side by side.
+        """
+        agents = self.agents(lights)
+        actions = np.asarray(actions)
+        w = self.weights[agents]
+        q = np.einsum('iad,id->ia', w, newStates)
+        d = rewards + discount * np.max(q, axis=1) - np.einsum('id,id->i', w[np.arange(len(actions)), actions], states)
+        np.add.at(self.weights, (agents, actions), scale * learning_rate * d[:, None] * states)
+    def getState(self):
+        return {"weights": self.weights}
+    def setState(self, state):
+        self.weights[...] = state["weights"]
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Streaming reader and aggregates for induction loop output like data/cross.out.
+
+readIntervals parses the file incrementally and yields one record per
+aggregation interval with one array entry per detector, so memory does not
+grow with the file. load collects the records into (intervals x detectors)
+arrays and keeps them in a binary .npz cache next to the file, so repeated
+analyses skip the XML.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import optparse
+import numpy as np
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+ATTRIBUTES = ("nVehContrib", "flow", "occupancy", "speed", "length", "nVehEntered")
+
+
+def readIntervals(path):
+    """yields (begin, end, ids, values) per interval, values maps ATTRIBUTES to arrays"""
+    context = iter(ET.iterparse(path, events=("start", "end")))
+    root = None
+    begin, end, ids, rows = None, None, [], []
+    while True:
+        try:
+            event, elem = next(context)
+        except StopIteration:
+            break
+        except ET.ParseError:
+            # the output of an aborted run lacks the closing tag
+            if root is None:
+                raise
+            break
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag != "interval":
+            continue
+        b = float(elem.get("begin"))
+        if b != begin and ids:
+            yield begin, end, ids, dict(zip(ATTRIBUTES, np.array(rows).T))
+            ids, rows = [], []
+        begin, end = b, float(elem.get("end"))
+        ids.append(elem.get("id"))
+        rows.append([float(elem.get(a, "nan")) for a in ATTRIBUTES])
+        # drop what is parsed so far to keep the memory constant
+        root.clear()
+    if ids:
+        yield begin, end, ids, dict(zip(ATTRIBUTES, np.array(rows).T))
+
+
+class LoopData:
+    """all intervals of a file, every attribute as an (intervals x detectors) array"""
+    def __init__(self, begin, end, ids, values):
+        self.begin = begin
+        self.end = end
+        self.ids = [str(i) for i in ids]
+        self.values = values
+
+    def __getattr__(self, name):
+        if name in ATTRIBUTES:
+            return self.values[name]
+        raise AttributeError(name)
+
+
+def cacheFile(path):
+    return path + ".npz"
+
+
+def load(path, cache=True):
+    stat = os.stat(path)
+    if cache and os.path.exists(cacheFile(path)):
+        with np.load(cacheFile(path)) as data:
+            if data["source"][0] == stat.st_size and data["source"][1] == stat.st_mtime:
+                return LoopData(data["begin"], data["end"], data["ids"], dict((a, data[a]) for a in ATTRIBUTES))
+    index = {}
+    begins, ends, rows = [], [], []
+    for begin, end, ids, values in readIntervals(path):
+        for i in ids:
+            if i not in index:
+                index[i] = len(index)
+        cols = np.array([index[i] for i in ids])
+        row = np.full((len(ATTRIBUTES), len(index)), np.nan)
+        row[:, cols] = [values[a] for a in ATTRIBUTES]
+        begins.append(begin)
+        ends.append(end)
+        rows.append(row)
+    # detectors that showed up late have no values in the first intervals
+    table = np.full((len(rows), len(ATTRIBUTES), len(index)), np.nan)
+    for k, row in enumerate(rows):
+        table[k, :, :row.shape[1]] = row
+    ids = sorted(index, key=index.get)
+    values = dict((a, table[:, j, :]) for j, a in enumerate(ATTRIBUTES))
+    data = LoopData(np.array(begins), np.array(ends), ids, values)
+    if cache:
+        np.savez(cacheFile(path), begin=data.begin, end=data.end, ids=np.array(ids),
+                 source=np.array([stat.st_size, stat.st_mtime]), **values)
+    return data
+
+
+def aggregate(data, bucket=300.0):
+    """flow, occupancy and mean speed per detector and time bucket of bucket seconds
+
+    Flow and occupancy are averaged over the intervals of a bucket, the speed
+    is weighted by the vehicles that contributed to each interval.
+    """
+    if len(data.begin) == 0:
+        empty = np.zeros((0, len(data.ids)))
+        return {"begin": np.zeros(0), "flow": empty, "occupancy": empty, "speed": empty, "vehicles": empty}
+    buckets = np.floor(data.begin / bucket).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(buckets)])[:, None]
+    vehicles = np.nan_to_num(data.nVehContrib)
+    speed = np.where(data.speed >= 0, data.speed, 0)
+    weighted = np.add.reduceat(speed * vehicles, starts, axis=0)
+    contributed = np.add.reduceat(vehicles, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        meanSpeed = np.where(contributed > 0, weighted / contributed, np.nan)
+    return {"begin": buckets[starts] * bucket,
+            "flow": np.add.reduceat(np.nan_to_num(data.flow), starts, axis=0) / counts,
+            "occupancy": np.add.reduceat(np.nan_to_num(data.occupancy), starts, axis=0) / counts,
+            "speed": meanSpeed,
+            "vehicles": contributed}
+
+
+if __name__ == "__main__":
+    optParser = optparse.OptionParser(usage="%prog [options] FILE")
+    optParser.add_option("--bucket", type="float", default=3600., help="aggregation period in seconds")
+    optParser.add_option("--no-cache", action="store_true", default=False, help="neither read nor write the .npz cache")
+    options, args = optParser.parse_args()
+    if len(args) != 1:
+        optParser.error("expected the detector output file")
+    data = load(args[0], not options.no_cache)
+    agg = aggregate(data, options.bucket)
+    print("%10s %8s %10s %10s %10s" % ("begin", "detector", "flow", "occupancy", "speed"))
+    for b, begin in enumerate(agg["begin"]):
+        for d, i in enumerate(data.ids):
+            print("%10.0f %8s %10.1f %10.2f %10.2f" % (begin, i, agg["flow"][b, d], agg["occupancy"][b, d], agg["speed"][b, d]))
@@ -0,0 +1,210 @@
+"""
+In-process stand-in for the parts of the TraCI interface the controllers use.
+
+MockSumo mimics the cross network: every traffic light has four single lane
+approaches (N, E, S, W) with an induction loop at the stop line and the four
+phase program of data/cross.net.xml, green for N/S in phase 0 and for E/W in
+phase 2. Vehicles arrive at random but seeded, drive up to the stop line,
+queue and leave the network once they pass a green light. It is not a
+traffic simulation, it only produces plausible values deterministically and
+without a SUMO installation.
+"""
+import pickle
+import numpy as np
+
+from collector import (LAST_STEP_VEHICLE_NUMBER, LAST_STEP_MEAN_SPEED, LAST_STEP_VEHICLE_HALTING_NUMBER,
+                       VAR_CO2EMISSION, VAR_WAITING_TIME, TL_CURRENT_PHASE)
+
+DIRECTIONS = "NESW"
+PROGRAM = ((39, "GrGr"), (6, "yryr"), (39, "rGrG"), (6, "ryry"))
+LANE_LENGTH = 100.0
+MAX_SPEED = 13.89
+VEHICLE_GAP = 7.5
+IDLE_CO2 = 1500.0  # mg/s
+CO2_PER_SPEED = 250.0
+# what saveState writes, like SUMO it keeps the subscriptions and the random
+# number generator running
+STATE = ("lanes", "passed", "phase", "phase_time", "vehicles", "departed", "time")
+
+
+class Vehicle:
+    def __init__(self, id, lane):
+        self.id = id
+        self.lane = lane
+        self.distance = LANE_LENGTH
+        self.speed = MAX_SPEED
+        self.waiting = 0.0
+
+
+class Domain:
+    """subscription handling shared by all object domains"""
+    def __init__(self, sim):
+        self.sim = sim
+        self.subscriptions = {}
+
+    def subscribe(self, objectID, varIDs=(), begin=0, end=2 ** 31 - 1):
+        self.subscriptions[objectID] = tuple(varIDs)
+
+    def getAllSubscriptionResults(self):
+        return dict((objectID, dict((v, self.getValue(objectID, v)) for v in varIDs))
+                    for objectID, varIDs in self.subscriptions.items())
+
+    def getSubscriptionResults(self, objectID=None):
+        if objectID is None:
+            return self.getAllSubscriptionResults()
+        return dict((v, self.getValue(objectID, v)) for v in self.subscriptions.get(objectID, ()))
+
+
+class LaneDomain(Domain):
+    def getIDList(self):
+        return list(self.sim.lanes)
+
+    def getLastStepVehicleIDs(self, laneID):
+        return [v.id for v in self.sim.lanes[laneID]]
+
+    def getLastStepVehicleNumber(self, laneID):
+        return len(self.sim.lanes[laneID])
+
+    def getLastStepMeanSpeed(self, laneID):
+        vehicles = self.sim.lanes[laneID]
+        if not vehicles:
+            return MAX_SPEED
+        return sum(v.speed for v in vehicles) / len(vehicles)
+
+    def getLastStepHaltingNumber(self, laneID):
+        return sum(1 for v in self.sim.lanes[laneID] if v.speed < 0.1)
+
+    def getWaitingTime(self, laneID):
+        return sum(v.waiting for v in self.sim.lanes[laneID])
+
+    def getCO2Emission(self, laneID):
+        return sum(IDLE_CO2 + CO2_PER_SPEED * v.speed for v in self.sim.lanes[laneID])
+
+    def getValue(self, laneID, var):
+        return {LAST_STEP_VEHICLE_NUMBER: self.getLastStepVehicleNumber,
+                LAST_STEP_MEAN_SPEED: self.getLastStepMeanSpeed,
+                LAST_STEP_VEHICLE_HALTING_NUMBER: self.getLastStepHaltingNumber,
+                VAR_WAITING_TIME: self.getWaitingTime,
+                VAR_CO2EMISSION: self.getCO2Emission}[var](laneID)
+
+
+class InductionLoopDomain(Domain):
+    def getIDList(self):
+        return list(self.sim.loops)
+
+    def getLastStepVehicleNumber(self, loopID):
+        return self.sim.passed[self.sim.loops[loopID]]
+
+    def getValue(self, loopID, var):
+        return self.getLastStepVehicleNumber(loopID)
+
+
+class TrafficLightDomain(Domain):
+    def getIDList(self):
+        return list(self.sim.lights)
+
+    def getPhase(self, tlsID):
+        return self.sim.phase[self.sim.lights[tlsID]]
+
+    def setPhase(self, tlsID, index):
+        k = self.sim.lights[tlsID]
+        self.sim.phase[k] = index
+        self.sim.phase_time[k] = 0
+
+    def getRedYellowGreenState(self, tlsID):
+        return PROGRAM[self.getPhase(tlsID)][1]
+
+    def getValue(self, tlsID, var):
+        return self.getPhase(tlsID)
+
+
+class VehicleDomain(Domain):
+    def getIDList(self):
+        return list(self.sim.vehicles)
+
+    def getSpeed(self, vehID):
+        return self.sim.vehicles[vehID].speed
+
+    def getWaitingTime(self, vehID):
+        return self.sim.vehicles[vehID].waiting
+
+    def remove(self, vehID, reason=3):
+        v = self.sim.vehicles.pop(vehID)
+        self.sim.lanes[v.lane].remove(v)
+
+
+class SimulationDomain(Domain):
+    def getCurrentTime(self):
+        return self.sim.time * 1000
+
+    def getTime(self):
+        return float(self.sim.time)
+
+    def saveState(self, fileName):
+        with open(fileName, "wb") as f:
+            pickle.dump(dict((name, getattr(self.sim, name)) for name in STATE), f)
+
+    def loadState(self, fileName):
+        with open(fileName, "rb") as f:
+            self.sim.__dict__.update(pickle.load(f))
+
+
+class MockSumo:
+    def __init__(self, lights=4, arrival_rate=0.08, seed=42):
+        self.random = np.random.RandomState(seed)
+        self.arrival_rate = arrival_rate
+        self.lights = dict((str(k), k) for k in range(lights))
+        self.lanes = {}
+        self.loops = {}
+        for k in range(lights):
+            for d in DIRECTIONS:
+                lane = "%i%s_0" % (k, d)
+                self.lanes[lane] = []
+                self.loops[str(len(self.loops))] = len(self.loops)
+        self.lane_ids = sorted(self.lanes, key=lambda l: (int(l[:-3]), DIRECTIONS.index(l[-3])))
+        self.passed = [0] * len(self.loops)
+        self.phase = [0] * lights
+        self.phase_time = [0] * lights
+        self.vehicles = {}
+        self.departed = 0
+        self.time = 0
+        self.lane = LaneDomain(self)
+        self.inductionloop = InductionLoopDomain(self)
+        self.trafficlights = TrafficLightDomain(self)
+        self.trafficlight = self.trafficlights
+        self.vehicle = VehicleDomain(self)
+        self.simulation = SimulationDomain(self)
+
+    def simulationStep(self, step=0):
+        self.time += 1
+        for k in range(len(self.phase)):
+            self.phase_time[k] += 1
+            if self.phase_time[k] >= PROGRAM[self.phase[k]][0]:
+                self.phase[k] = (self.phase[k] + 1) % len(PROGRAM)
+                self.phase_time[k] = 0
+        arrivals = self.random.uniform(size=len(self.lane_ids)) < self.arrival_rate
+        for i, lane in enumerate(self.lane_ids):
+            vehicles = self.lanes[lane]
+            light = int(lane[:-3])
+            green = PROGRAM[self.phase[light]][1][DIRECTIONS.index(lane[-3])] == "G"
+            self.passed[i] = 0
+            if green and vehicles and vehicles[0].distance <= 0:
+                v = vehicles.pop(0)
+                del self.vehicles[v.id]
+                self.passed[i] = 1
+            front = None
+            for v in vehicles:
+                limit = 0.0 if front is None else front.distance + VEHICLE_GAP
+                distance = max(v.distance - MAX_SPEED, limit)
+                v.speed = v.distance - distance
+                v.distance = distance
+                v.waiting = v.waiting + 1 if v.speed < 0.1 else 0.0
+                front = v
+            if arrivals[i] and (not vehicles or vehicles[-1].distance < LANE_LENGTH - VEHICLE_GAP):
+                v = Vehicle("veh%i" % self.departed, lane)
+                self.departed += 1
+                vehicles.append(v)
+                self.vehicles[v.id] = v
+
+    def close(self):
+        pass
@@ -0,0 +1,281 @@
+"""
+Topology and traffic light programs of a SUMO network as index arrays.
+
+build streams through a .net.xml and a .det.xml once and turns them into
+arrays: lane -> edge -> junction, the lane to lane connections with their
+light and link index, the lanes every light controls, detector -> lane ->
+light and the phase table of every light. load keeps the result in an .npz
+file next to the network, keyed by the hash of both files, so later runs
+skip the XML entirely and only hash and read arrays.
+
+Ids are sorted like the getIDList results of SUMO, lanes include the
+internal ones like lane.getIDList does. PhaseTable derives from the
+programs which phases a controller may decide in and which phase switches
+a light to the green of an action, so nothing assumes the four phase
+program of data/cross.net.xml.
+"""
+from __future__ import absolute_import
+
+import os
+import hashlib
+import numpy as np
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+NET_FILE = "data/cross.net.xml"
+DETECTOR_FILE = "data/cross.det.xml"
+# the program of data/cross.net.xml and mocksumo.MockSumo, see runner.py
+STANDARD = ("GrGr", "yryr", "rGrG", "ryry")
+# bump when the arrays change, older cache files are rebuilt
+VERSION = 1
+
+ARRAYS = ("lanes", "lane_internal", "lane_edge", "lane_length", "lane_speed", "edges", "edge_from", "edge_to",
+          "junctions", "lights", "light_junction", "link_from", "link_to", "link_light", "link_index",
+          "controlled_ptr", "controlled_lanes", "loops", "loop_lane", "loop_pos", "loop_light", "num_phases",
+          "durations", "phase_states")
+# string arrays, handed out as lists
+NAMES = ("lanes", "edges", "junctions", "lights", "loops")
+
+
+def junctionOfInternal(edge):
+    """":0_12" -> "0", the junction an internal edge crosses"""
+    return edge[1:].rsplit("_", 1)[0]
+
+
+def strings(values):
+    return np.array(values, dtype=np.str_) if values else np.zeros(0, dtype="U1")
+
+
+class PhaseTable:
+    """Which phases are decisions and how to switch, from the programs of the lights.
+
+    A phase with green and without yellow is a green phase, the controller
+    decides in it. Action a of a light asks for its a-th green phase,
+    greens[k, a]. If the light already shows it the phase is set again,
+    otherwise the light goes to enter[k, a], the transition phase before
+    that green, or straight to the green where there is none. action[k, p]
+    is the action of green phase p and -1 for transitions.
+    """
+    def __init__(self, programs, num_actions=2):
+        """programs holds the list of phase states of every light"""
+        self.num_lights = len(programs)
+        self.num_actions = num_actions
+        phases = max([len(p) for p in programs] or [1])
+        self.num_phases = np.array([len(p) for p in programs], dtype=np.int64)
+        self.decision = np.zeros((self.num_lights, phases), dtype=bool)
+        self.greens = np.zeros((self.num_lights, num_actions), dtype=np.int64)
+        self.enter = np.zeros((self.num_lights, num_actions), dtype=np.int64)
+        self.action = np.full((self.num_lights, phases), -1, dtype=np.int64)
+        for k, program in enumerate(programs):
+            greens = [p for p, state in enumerate(program) if "y" not in state.lower() and "g" in state.lower()]
+            self.decision[k, greens] = True
+            for a in range(num_actions):
+                if not greens:
+                    break
+                g = greens[a % len(greens)]
+                self.greens[k, a] = g
+                before = (g - 1) % len(program)
+                self.enter[k, a] = g if self.decision[k, before] else before
+                if a < len(greens):
+                    self.action[k, g] = a
+
+    def legal(self, phases, num_actions=2):
+        """(n x actions) mask like policy.legalActions, row i belongs to light i % num_lights"""
+        phases = np.asarray(phases)
+        lights = np.arange(len(phases)) % self.num_lights
+        return np.repeat(self.decision[lights, phases][:, None], num_actions, axis=1)
+
+    def decisions(self, phases):
+        """mask of the lights in a decision phase, phases may have a leading axis over copies"""
+        return self.decision[np.arange(self.num_lights), phases]
+
+    def setState(self, conn, light, k, action, s):
+        """switches light, the k-th one, for action in phase s, returns 1 if it changes phase"""
+        if action < 0:
+            return 0
+        g = int(self.greens[k, action])
+        if s == g:
+            conn.trafficlights.setPhase(light, g)
+            return 0
+        conn.trafficlights.setPhase(light, int(self.enter[k, action]))
+        return 1
+
+    def switch(self, phases, actions):
+        """setState for all lights at once on arrays, returns the new phases and the changed mask"""
+        lights = np.arange(self.num_lights)
+        act = actions >= 0
+        a = np.where(act, actions, 0)
+        g = self.greens[lights, a]
+        changed = act & (phases != g)
+        return np.where(changed, self.enter[lights, a], np.where(act, g, phases)), changed
+
+
+def standard(num_lights, num_actions=2):
+    """the PhaseTable of num_lights lights running STANDARD"""
+    return PhaseTable([STANDARD] * num_lights, num_actions)
+
+
+class NetIndex:
+    """The arrays of a network, see the module docstring.
+
+    controlled_lanes[controlled_ptr[k]:controlled_ptr[k + 1]] are the
+    incoming lanes light k controls in link index order. link_light and
+    loop_light are -1 without a light, edge_from and edge_to index junctions.
+    """
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            value = arrays[name]
+            setattr(self, name, value.tolist() if name in NAMES else value)
+        self._lane_index = None
+
+    def laneIndex(self):
+        """lane id -> index"""
+        if self._lane_index is None:
+            self._lane_index = dict((l, i) for i, l in enumerate(self.lanes))
+        return self._lane_index
+
+    def controlledLanes(self, k):
+        return self.controlled_lanes[self.controlled_ptr[k]:self.controlled_ptr[k + 1]]
+
+    def programs(self):
+        """the phase states of every light"""
+        return [list(self.phase_states[k, :n]) for k, n in enumerate(self.num_phases)]
+
+    def phaseTable(self, num_actions=2):
+        return PhaseTable(self.programs(), num_actions)
+
+    def arrays(self):
+        return dict((name, np.asarray(strings(getattr(self, name)) if name in NAMES else getattr(self, name)))
+                    for name in ARRAYS)
+
+
+def build(netFile=NET_FILE, detectorFile=DETECTOR_FILE):
+    """parses the files, returns a NetIndex"""
+    lanes, edges, junctions, programs, connections = {}, {}, [], {}, []
+    context = ET.iterparse(netFile, events=("start", "end"))
+    depth = 0
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        # only the children of the root are complete here, lanes and
+        # phases are read from their parent, which is then dropped
+        if depth != 1:
+            continue
+        tag = elem.tag
+        if tag == "edge":
+            edge = elem.get("id")
+            internal = elem.get("function") == "internal"
+            if internal:
+                edges[edge] = (junctionOfInternal(edge), junctionOfInternal(edge))
+            else:
+                edges[edge] = (elem.get("from"), elem.get("to"))
+            for lane in elem.iter("lane"):
+                lanes[lane.get("id")] = (edge, internal, float(lane.get("length")), float(lane.get("speed")))
+        elif tag == "junction":
+            junctions.append(elem.get("id"))
+        elif tag == "tlLogic":
+            programs[elem.get("id")] = [(float(p.get("duration")), p.get("state")) for p in elem.iter("phase")]
+        elif tag == "connection" and not elem.get("from").startswith(":"):
+            connections.append(("%s_%s" % (elem.get("from"), elem.get("fromLane")),
+                                "%s_%s" % (elem.get("to"), elem.get("toLane")),
+                                elem.get("tl"), int(elem.get("linkIndex", -1))))
+        elem.clear()
+    a = {}
+    laneIds = sorted(lanes)
+    laneIndex = dict((l, i) for i, l in enumerate(laneIds))
+    edgeIds = sorted(edges)
+    edgeIndex = dict((e, i) for i, e in enumerate(edgeIds))
+    junctionIds = sorted(set(junctions))
+    junctionIndex = dict((j, i) for i, j in enumerate(junctionIds))
+    lightIds = sorted(programs)
+    lightIndex = dict((l, k) for k, l in enumerate(lightIds))
+    a["lanes"] = strings(laneIds)
+    a["lane_edge"] = np.array([edgeIndex[lanes[l][0]] for l in laneIds], dtype=np.int64)
+    a["lane_internal"] = np.array([lanes[l][1] for l in laneIds], dtype=bool)
+    a["lane_length"] = np.array([lanes[l][2] for l in laneIds])
+    a["lane_speed"] = np.array([lanes[l][3] for l in laneIds])
+    a["edges"] = strings(edgeIds)
+    a["edge_from"] = np.array([junctionIndex.get(edges[e][0], -1) for e in edgeIds], dtype=np.int64)
+    a["edge_to"] = np.array([junctionIndex.get(edges[e][1], -1) for e in edgeIds], dtype=np.int64)
+    a["junctions"] = strings(junctionIds)
+    a["lights"] = strings(lightIds)
+    a["light_junction"] = np.array([junctionIndex.get(l, -1) for l in lightIds], dtype=np.int64)
+    connections = [c for c in connections if c[0] in laneIndex and c[1] in laneIndex]
+    a["link_from"] = np.array([laneIndex[c[0]] for c in connections], dtype=np.int64)
+    a["link_to"] = np.array([laneIndex[c[1]] for c in connections], dtype=np.int64)
+    a["link_light"] = np.array([lightIndex.get(c[2], -1) for c in connections], dtype=np.int64)
+    a["link_index"] = np.array([c[3] for c in connections], dtype=np.int64)
+    controlled = [[] for l in lightIds]
+    for c in sorted(connections, key=lambda c: c[3]):
+        if c[2] in lightIndex and laneIndex[c[0]] not in controlled[lightIndex[c[2]]]:
+            controlled[lightIndex[c[2]]].append(laneIndex[c[0]])
+    a["controlled_ptr"] = np.concatenate([[0], np.cumsum([len(c) for c in controlled])]).astype(np.int64)
+    a["controlled_lanes"] = np.array([i for c in controlled for i in c], dtype=np.int64)
+    phases = max([len(p) for p in programs.values()] or [1])
+    a["num_phases"] = np.array([len(programs[l]) for l in lightIds], dtype=np.int64)
+    a["durations"] = np.full((len(lightIds), phases), np.inf)
+    states = [[""] * phases for l in lightIds]
+    for k, l in enumerate(lightIds):
+        for p, (duration, state) in enumerate(programs[l]):
+            a["durations"][k, p] = duration
+            states[k][p] = state
+    a["phase_states"] = np.array(states, dtype=np.str_).reshape(len(lightIds), phases)
+    # the light of a loop is the one controlling a connection out of its lane
+    laneLight = np.full(len(laneIds), -1, dtype=np.int64)
+    for k, c in enumerate(controlled):
+        laneLight[c] = k
+    loops = []
+    if detectorFile:
+        for event, elem in ET.iterparse(detectorFile):
+            if elem.tag in ("inductionLoop", "e1Detector") and elem.get("lane") in laneIndex:
+                loops.append((elem.get("id"), laneIndex[elem.get("lane")], float(elem.get("pos"))))
+            elem.clear()
+    loops.sort()
+    a["loops"] = strings([l[0] for l in loops])
+    a["loop_lane"] = np.array([l[1] for l in loops], dtype=np.int64)
+    a["loop_pos"] = np.array([l[2] for l in loops])
+    a["loop_light"] = laneLight[a["loop_lane"]]
+    return NetIndex(a)
+
+
+def fileKey(*files):
+    """hash of the contents of files, None entries count as empty"""
+    h = hashlib.sha1(str(VERSION).encode("ascii"))
+    for name in files:
+        h.update(b"\0")
+        if name is None:
+            continue
+        with open(name, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def cacheFile(netFile):
+    return os.path.splitext(netFile)[0] + ".index.npz"
+
+
+def load(netFile=NET_FILE, detectorFile=DETECTOR_FILE, cache=True):
+    """the NetIndex of the files, from the cache file next to netFile when it is current"""
+    if not cache:
+        return build(netFile, detectorFile)
+    key = fileKey(netFile, detectorFile)
+    path = cacheFile(netFile)
+    if os.path.exists(path):
+        try:
+            with np.load(path) as f:
+                if str(f["key"]) == key:
+                    return NetIndex(dict((name, f[name]) for name in ARRAYS))
+        except (IOError, KeyError, ValueError):
+            pass
+    index = build(netFile, detectorFile)
+    # written under another name and renamed, so readers never see half a file
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, key=np.array(key), **index.arrays())
+    os.rename(tmp, path)
+    return index
@@ -0,0 +1,118 @@
+import numpy as np
+
+
+class ObservationEncoder:
+    """Builds the controller observation without allocating per step.
+
+    The observation is the detector counts summed over the last
+    detector_window steps (only with loops=True), the current phase of every
+    light and the last history_len phases of every light, oldest first.
+
+    Every value is written twice into a circular buffer of twice the window
+    length, so the window in time order is always one contiguous slice.
+    Detector sums are updated incrementally. update alternates between two
+    output arrays, so the previous observation stays valid for one more step.
+    With copies set every array gets a leading axis of that length and update
+    encodes that many independent simulations at once, see surrogate.py.
+    """
+    def __init__(self, num_lights, num_loops, history_len=5, detector_window=20, loops=False, copies=None):
+        self.num_lights = num_lights
+        self.num_loops = num_loops if loops else 0
+        self.history_len = history_len
+        self.detector_window = detector_window
+        self.input_size = self.num_loops + num_lights + history_len * num_lights
+        batch = () if copies is None else (copies, )
+        self.history = np.zeros(batch + (num_lights, 2 * history_len))
+        self.detected = np.zeros(batch + (self.num_loops, 2 * detector_window))
+        self.totals = np.zeros(batch + (self.num_loops, ))
+        self.outputs = [np.zeros(batch + (self.input_size, )), np.zeros(batch + (self.input_size, ))]
+        self.reset()
+
+    def reset(self):
+        """clears the windows and returns the all zero initial observation"""
+        self.history.fill(0)
+        self.detected.fill(0)
+        self.totals.fill(0)
+        self.history_pos = 0
+        self.detector_pos = 0
+        self.current = 0
+        for out in self.outputs:
+            out.fill(0)
+        return self.outputs[0]
+
+    def update(self, phases, loop_vehicles=None):
+        self.current ^= 1
+        out = self.outputs[self.current]
+        n, m, h = self.num_lights, self.num_loops, self.history_len
+        if m:
+            w = self.detector_window
+            p = self.detector_pos = (self.detector_pos + 1) % w
+            # the slot at p holds the count that leaves the window
+            self.totals -= self.detected[..., p]
+            self.totals += loop_vehicles
+            self.detected[..., p] = loop_vehicles
+            self.detected[..., p + w] = loop_vehicles
+            out[..., :m] = self.totals
+        out[..., m:m + n] = phases
+        p = self.history_pos = (self.history_pos + 1) % h
+        self.history[..., p] = phases
+        self.history[..., p + h] = phases
+        # splitting the last axis is a view, also of the rows of a batch
+        np.copyto(out[..., m + n:].reshape(out.shape[:-1] + (n, h)), self.history[..., p + 1:p + 1 + h])
+        return out
+
+    def light(self, obs, k):
+        """the part of obs light k decides on, all of it"""
+        return obs
+
+    def lights(self, obs):
+        """the observations of all lights as rows, here views of obs"""
+        return np.broadcast_to(obs, (self.num_lights, len(obs)))
+
+
+class NeighbourhoodEncoder:
+    """Per light observations from the neighbourhood of each light.
+
+    Row k of the observation holds the detector sums on the approaches of
+    light k, then the phase and the phase history of light k and of its
+    neighbours, in the order of grid.Topology. Missing neighbours and
+    approaches read as 0, so the size of a row does not grow with the
+    network. The windows are kept by an ObservationEncoder over all lights,
+    every update gathers the rows from its output with one precomputed index.
+    """
+    def __init__(self, neighbours, approaches, num_loops, history_len=5, detector_window=20):
+        n = len(neighbours)
+        self.encoder = ObservationEncoder(n, num_loops, history_len, detector_window, loops=True)
+        m, h = self.encoder.num_loops, history_len
+        # the flat encoder output followed by one 0 that -1 entries point to
+        self.flat = np.zeros(self.encoder.input_size + 1)
+        zero = self.encoder.input_size
+        members = np.concatenate([np.arange(n)[:, None], neighbours], axis=1)
+        loops = np.where(approaches >= 0, approaches, zero)
+        phases = np.where(members >= 0, m + members, zero)
+        history = np.where(members[:, :, None] >= 0, m + n + members[:, :, None] * h + np.arange(h), zero)
+        self.index = np.concatenate([loops, phases, history.reshape(n, -1)], axis=1)
+        self.input_size = self.index.shape[1]
+        self.outputs = [np.zeros((n, self.input_size)), np.zeros((n, self.input_size))]
+        self.current = 0
+
+    def reset(self):
+        self.encoder.reset()
+        self.current = 0
+        for out in self.outputs:
+            out.fill(0)
+        return self.outputs[0]
+
+    def update(self, phases, loop_vehicles=None):
+        self.flat[:-1] = self.encoder.update(phases, loop_vehicles)
+        self.current ^= 1
+        out = self.outputs[self.current]
+        np.take(self.flat, self.index, out=out)
+        return out
+
+    def light(self, obs, k):
+        """the part of obs light k decides on"""
+        return obs[k]
+
+    def lights(self, obs):
+        return obs
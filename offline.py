@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Trains agents.DQNAgents or linearreg.LinearAgents from a dataset recorded
+with --record, without a running simulation.
+
+The models have the layout of runner.py and linear.py, --checkpoint writes
+them so that runner.py or linear.py --checkpoint DIR --resume continues from
+them. The dataset does not store which light a transition came from, so
+with --agents independent every light trains on all transitions.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import optparse
+import time
+import numpy as np
+
+from dataset import TransitionDataset
+
+
+def train(directory, agent="dqn", epochs=1, batch_size=32, discount=0.9, update_target=10, mmap=True,
+          backend="numpy", tau=1.0, agents="shared", num_lights=4, hidden=(), replay="uniform"):
+    """returns the trained DQNAgents or LinearAgents of num_lights lights"""
+    data = TransitionDataset(directory, mmap)
+    num_actions = 2
+    if agent == "dqn":
+        import qlearning
+        from agents import DQNAgents
+        model = DQNAgents(num_lights, data.input_size, num_actions, agents, replay, backend=backend,
+                          hidden=hidden, tau=tau)
+        networks = np.arange(len(model.dqn))
+    else:
+        from linearreg import LinearAgents
+        model = LinearAgents(num_lights, data.input_size, num_actions, shared=agents == "shared")
+        lights = np.arange(1 if agents == "shared" else num_lights)
+    updates = 0
+    for epoch in range(epochs):
+        begin = time.time()
+        loss = []
+        for batch in data.batches(batch_size):
+            if agent == "dqn":
+                if updates % update_target == 0:
+                    model.updateTarget()
+                if model.online is not None:
+                    loss.extend(qlearning.trainStacked(model.online, model.target, networks,
+                                                       [batch] * len(networks), discount)[0])
+                else:
+                    loss.extend(d.trainModel(batch, discount, data.input_size, num_actions) for d in model.dqn)
+            else:
+                # every light gets the update of the whole batch
+                n = len(batch[1])
+                model.trainBatch(np.repeat(lights, n), np.tile(batch[0], (len(lights), 1)),
+                                 np.tile(batch[1], len(lights)), np.tile(batch[2], len(lights)),
+                                 np.tile(batch[3], (len(lights), 1)), discount)
+            updates += 1
+        elapsed = time.time() - begin
+        print('Epoch %i: %i transitions in %.1fs (%.0f/s)%s' % (
+            epoch, len(data), elapsed, len(data) / max(elapsed, 1e-9),
+            ' mean loss %f' % np.mean(loss) if loss else ''))
+    return model
+
+
+def get_options():
+    optParser = optparse.OptionParser(usage="%prog [options] DATASET")
+    optParser.add_option("--agent", type="choice", choices=["dqn", "linear"], default="dqn",
+                         help="model to train [default: %default]")
+    optParser.add_option("--agents", type="choice", choices=["shared", "independent"], default="shared",
+                         help="one model for all lights or one per light, as in runner.py and linear.py "
+                              "[default: %default]")
+    optParser.add_option("--lights", type="int", default=4,
+                         help="number of lights of the models [default: %default]")
+    optParser.add_option("--replay", type="choice", choices=["uniform", "prioritized"], default="uniform",
+                         help="replay memory of the dqn checkpoint, as runner.py --replay [default: %default]")
+    optParser.add_option("--hidden", default="",
+                         help="comma separated hidden layer sizes of dqn, as runner.py --hidden [default: none]")
+    optParser.add_option("--backend", type="choice", choices=["numpy", "keras"], default="numpy",
+                         help="Q-network implementation of dqn [default: %default]")
+    optParser.add_option("--target-period", type="int", default=10,
+                         help="updates between target network updates of dqn [default: %default]")
+    optParser.add_option("--tau", type="float", default=1.0,
+                         help="fraction of the online weights blended into the target, 1 copies them")
+    optParser.add_option("--epochs", type="int", default=1, help="passes over the dataset")
+    optParser.add_option("--batch-size", type="int", default=32, help="transitions per update")
+    optParser.add_option("--no-mmap", action="store_true", default=False,
+                         help="load the dataset into memory instead of mapping it")
+    optParser.add_option("--save", help="write the trained weights to this .npz file")
+    optParser.add_option("--checkpoint", metavar="DIR",
+                         help="write the model as a checkpoint for runner.py or linear.py --checkpoint DIR --resume")
+    options, args = optParser.parse_args()
+    if len(args) != 1:
+        optParser.error("expected the dataset directory")
+    options.hidden = tuple(int(n) for n in options.hidden.split(",") if n)
+    return options, args[0]
+
+
+if __name__ == "__main__":
+    options, directory = get_options()
+    model = train(directory, options.agent, options.epochs, options.batch_size, mmap=not options.no_mmap,
+                  update_target=options.target_period, backend=options.backend, tau=options.tau,
+                  agents=options.agents, num_lights=options.lights, hidden=options.hidden, replay=options.replay)
+    if options.save:
+        weights = [w for d in model.dqn for w in d.getWeights()] if options.agent == "dqn" else [model.weights]
+        np.savez(options.save, *weights)
+    if options.checkpoint:
+        import checkpoint
+        from policy import EpsilonGreedy
+        checkpoints = checkpoint.Checkpointer(options.checkpoint)
+        # the decay of the runner that continues
+        policy = EpsilonGreedy(2, decay=0.9998 if options.agent == "dqn" else 0.9999)
+        checkpoints.save(0, checkpoint.runState(-1, 0, model, policy, None, {"co2": [], "waiting": []}))
+        checkpoints.close()
@@ -0,0 +1,161 @@
+"""
+Training on a background thread while the control loop steps the simulation.
+
+PipelinedAgents wraps an agents.DQNAgents and keeps its interface, so
+runner.run drives it unchanged: remember stores the transition, train
+grants the updates DQNAgents.train would run, times update_ratio, and
+returns. A trainer thread spends the granted updates on samples from the
+replay memory while the loop waits for simulationStep. Actions come
+from snapshots of the networks, refreshed every snapshot_interval steps,
+so acting never waits for an update in progress.
+
+The replay memory and the networks each have a lock, an update holds the
+replay lock only to sample and to write the priorities. If the trainer
+falls more than max_backlog updates behind, train blocks until it caught
+up, so the update-to-data ratio holds however slow the updates are. An
+episode then costs about max(simulation, training) instead of their sum.
+"""
+import threading
+import numpy as np
+
+import checkpoint
+import qnetwork
+from qlearning import DeepQ
+
+
+class PipelinedAgents:
+    """DQNAgents with the updates on a thread, see the module docstring."""
+    def __init__(self, agents, update_ratio=1.0, snapshot_interval=15, max_backlog=100):
+        self.agents = agents
+        self.update_ratio = update_ratio
+        self.snapshot_interval = snapshot_interval
+        self.max_backlog = max_backlog
+        self.acting = [DeepQ(agents.input_size, agents.num_actions, d.backend, d.hidden) for d in agents.dqn]
+        self.model_lock = threading.Lock()
+        self.replay_lock = threading.Lock()
+        # guards credit, rows, discount, busy and stopped
+        self.work = threading.Condition()
+        self.busy = False
+        self.credit = np.zeros(len(agents.dqn))
+        self.rows = np.full(len(agents.dqn), 32, dtype=np.int64)
+        self.discount = 0.9
+        self.steps = 0
+        self.updates = 0
+        self.stopped = False
+        self.error = None
+        self.refresh()
+        self.thread = threading.Thread(target=self.trainer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def refresh(self):
+        """copies the online networks into the acting snapshots"""
+        with self.model_lock:
+            for d, a in zip(self.agents.dqn, self.acting):
+                qnetwork.syncWeights(d.model, a.model)
+
+    def getQValues(self, lights, states):
+        return self.agents.qValues(self.acting, lights, states)
+
+    def getActions(self, lights, states):
+        return np.argmax(self.getQValues(lights, states), axis=1)
+
+    def remember(self, k, transition, game_over=False):
+        with self.replay_lock:
+            self.agents.remember(k, transition, game_over)
+
+    def rememberBatch(self, lights, states, actions, rewards, next_states, game_over=False):
+        with self.replay_lock:
+            self.agents.rememberBatch(lights, states, actions, rewards, next_states, game_over)
+
+    def updateTarget(self):
+        with self.model_lock:
+            self.agents.updateTarget()
+
+    def train(self, lights, batch_size, discount):
+        """ends a step, the updates DQNAgents.train would run go to the trainer
+
+        In the shared mode that is one minibatch of batch_size rows per light,
+        otherwise one minibatch of batch_size per light and network.
+        """
+        if self.error is not None:
+            raise self.error
+        self.steps += 1
+        if self.steps % self.snapshot_interval == 0:
+            self.refresh()
+        with self.work:
+            if len(lights):
+                if self.agents.mode == "shared":
+                    self.rows[0] = batch_size * len(lights)
+                    self.credit[0] += self.update_ratio
+                else:
+                    self.rows[:] = batch_size
+                    np.add.at(self.credit, np.asarray(lights), self.update_ratio)
+                self.discount = discount
+                self.work.notify_all()
+            while self.credit.sum() > self.max_backlog and self.error is None:
+                self.work.wait()
+
+    def trainer(self):
+        agents = self.agents
+        while True:
+            with self.work:
+                while not self.stopped and self.credit.max() < 1:
+                    self.work.wait()
+                if self.stopped:
+                    return
+                k = int(np.argmax(self.credit))
+                self.credit[k] -= 1
+                self.busy = True
+                batch_size, discount = int(self.rows[k]), self.discount
+            try:
+                # the batch arrays belong to this thread, remember never touches them
+                with self.replay_lock:
+                    batch = agents.replay[k].get_batch(batch_size)
+                with self.model_lock:
+                    agents.dqn[k].trainModel(batch, discount, agents.input_size, agents.num_actions)
+                    errors = agents.dqn[k].td_errors
+                with self.replay_lock:
+                    agents.replay[k].updatePriorities(batch, errors)
+            except Exception as e:
+                self.error = e
+                with self.work:
+                    self.work.notify_all()
+                return
+            with self.work:
+                self.updates += 1
+                self.busy = False
+                self.work.notify_all()
+
+    def wait(self):
+        """blocks until every granted update ran"""
+        with self.work:
+            while (self.busy or self.credit.max() >= 1) and self.error is None:
+                self.work.wait()
+        if self.error is not None:
+            raise self.error
+
+    def getState(self):
+        """a copy of DQNAgents.getState once every granted update ran"""
+        self.wait()
+        with self.model_lock:
+            with self.replay_lock:
+                return checkpoint.unflatten((name, np.array(value) if isinstance(value, np.ndarray) else value)
+                                            for name, value in checkpoint.flatten(self.agents.getState()))
+
+    def setState(self, state):
+        with self.model_lock:
+            with self.replay_lock:
+                self.agents.setState(state)
+        self.refresh()
+
+    def close(self):
+        """runs the outstanding updates, then stops the trainer"""
+        try:
+            self.wait()
+        finally:
+            with self.work:
+                self.stopped = True
+                self.work.notify_all()
+            self.thread.join()
+            self.agents.close()
@@ -0,0 +1,59 @@
+"""
+Epsilon-greedy action selection for all lights at once.
+
+EpsilonGreedy.act takes the phase of every light and the observation of
+every light and returns one action per light, -1 for lights that do not
+decide in this step. The Q-values of all lights that act greedily come
+from a single call of qValues(lights, states), so a step costs one forward
+pass however many lights there are.
+"""
+import numpy as np
+
+
+def legalActions(phases, num_actions=2):
+    """(lights x actions) mask of the allowed actions
+
+    A light may only pick a new phase in a green phase, in a yellow phase
+    it is already switching and every action is masked.
+    """
+    green = np.asarray(phases) % 2 == 0
+    return np.repeat(green[:, None], num_actions, axis=1)
+
+
+class EpsilonGreedy:
+    """Explores with probability epsilon, which decays after every step down to minimum.
+
+    Lights decide every interval steps, see act.
+    """
+    def __init__(self, num_actions, epsilon=1.0, decay=0.9998, minimum=0.01, interval=15, legal=legalActions):
+        self.num_actions = num_actions
+        self.epsilon = epsilon
+        self.decay = decay
+        self.minimum = minimum
+        self.interval = interval
+        self.legal = legal
+
+    def act(self, qValues, states, phases, t):
+        """actions of all lights in step t, qValues(lights, states) gives the (n x actions) Q-values"""
+        n = len(phases)
+        actions = np.full(n, -1, dtype=np.int64)
+        if t % self.interval == 0:
+            legal = self.legal(phases, self.num_actions)
+            decide = legal.any(axis=1)
+            explore = decide & (np.random.uniform(size=n) < self.epsilon)
+            # a uniform random legal action: the largest random key of the legal ones
+            keys = np.where(legal[explore], np.random.uniform(size=(int(explore.sum()), self.num_actions)), -1)
+            actions[explore] = np.argmax(keys, axis=1)
+            greedy = np.flatnonzero(decide & ~explore)
+            if len(greedy):
+                q = np.where(legal[greedy], qValues(greedy, states[greedy]), -np.inf)
+                actions[greedy] = np.argmax(q, axis=1)
+        if self.epsilon > self.minimum:
+            self.epsilon *= self.decay
+        return actions
+
+    def getState(self):
+        return {"epsilon": self.epsilon}
+
+    def setState(self, state):
+        self.epsilon = state["epsilon"]
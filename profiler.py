@@ -0,0 +1,190 @@
+"""
+Timers and TraCI call counts for the phases of the control loop.
+
+The loop brackets every phase with begin = prof.start() and
+prof.stop(name, begin), which returns the end time so back to back phases
+need one clock read each. The result is a summary table printed every
+interval iterations. Optionally the phases also go to a trace file:
+- a name ending in .json is written in the Chrome trace event format, to
+  open in chrome://tracing or Perfetto
+- any other name is written as JSON lines, one event per line
+
+The stops may come from several threads, e.g. the thread pool of
+independent agents, a lock keeps the totals consistent and the trace puts
+every thread on a row of its own.
+
+Profiler.wrap returns a proxy of the TraCI connection that counts every call
+as domain.function. When profiling is off the loop gets NULL, whose methods
+do nothing and whose wrap returns the connection itself, so a disabled
+profiler costs one empty method call per phase.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+import json
+import time
+import threading
+
+clock = getattr(time, "perf_counter", time.time)
+
+# attributes of a connection that are data, not domains to count calls on
+PLAIN = (int, float, str, bytes, tuple, list, dict, type(None))
+
+
+def countedCall(function, counts, key):
+    def counted(*args, **kwargs):
+        counts[key] = counts.get(key, 0) + 1
+        return function(*args, **kwargs)
+    return counted
+
+
+class CountedCalls(object):
+    """Proxy of a TraCI connection or domain adding one to counts[prefix + name] per call."""
+    def __init__(self, target, counts, prefix=""):
+        self._target = target
+        self._counts = counts
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        key = self._prefix + name
+        if callable(value) and not isinstance(value, type):
+            value = countedCall(value, self._counts, key)
+        elif not isinstance(value, PLAIN):
+            value = CountedCalls(value, self._counts, key + ".")
+        # later lookups find the wrapper without going through __getattr__
+        setattr(self, name, value)
+        return value
+
+
+class Profiler:
+    """Accumulates phase times and TraCI calls, see the module docstring."""
+    def __init__(self, trace=None, interval=1, out=sys.stdout):
+        self.interval = interval
+        self.out = out
+        self.chrome = trace is not None and trace.endswith(".json")
+        self.trace = open(trace, "w") if trace else None
+        if self.chrome:
+            self.trace.write("[\n")
+        self.events = []
+        self.origin = clock()
+        self.calls = {}
+        self.lock = threading.Lock()
+        # thread ident -> tid of the trace, numbered in the order of their first stop
+        self.threads = {}
+        self.clear()
+
+    def clear(self):
+        self.totals = {}
+        self.counts = {}
+        self.maxima = {}
+        self.step_calls = {}
+        self.steps = 0
+        self.began = clock()
+
+    def start(self):
+        return clock()
+
+    def stop(self, name, begin):
+        end = clock()
+        duration = end - begin
+        with self.lock:
+            self.totals[name] = self.totals.get(name, 0.0) + duration
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if duration > self.maxima.get(name, 0.0):
+                self.maxima[name] = duration
+            if self.trace:
+                tid = self.threads.setdefault(threading.current_thread().ident, len(self.threads))
+                self.events.append({"name": name, "ph": "X", "ts": (begin - self.origin) * 1e6,
+                                    "dur": duration * 1e6, "pid": 0, "tid": tid})
+        return end
+
+    def wrap(self, conn):
+        """conn with every TraCI call counted"""
+        return CountedCalls(conn, self.calls)
+
+    def endStep(self):
+        """moves the TraCI calls of this step into the summary"""
+        self.steps += 1
+        if self.calls:
+            for key, n in self.calls.items():
+                self.step_calls[key] = self.step_calls.get(key, 0) + n
+            if self.trace:
+                with self.lock:
+                    self.events.append({"name": "traci calls", "ph": "C", "ts": (clock() - self.origin) * 1e6,
+                                        "pid": 0, "args": self.calls.copy()})
+            self.calls.clear()
+
+    def endIteration(self, iteration):
+        if self.trace:
+            self.flush()
+        if (iteration + 1) % self.interval == 0:
+            with self.lock:
+                self.summary(iteration)
+                self.clear()
+
+    def summary(self, iteration):
+        wall = clock() - self.began
+        steps = max(self.steps, 1)
+        print('Profile of iterations up to %i: %i steps in %.2f s, %.1f us per step'
+              % (iteration, self.steps, wall, wall / steps * 1e6), file=self.out)
+        print('  %-22s %9s %12s %12s %10s %7s' % ('phase', 'calls', 'us/step', 'us/call', 'max us', 'wall %'),
+              file=self.out)
+        for name in sorted(self.totals, key=self.totals.get, reverse=True):
+            total = self.totals[name]
+            print('  %-22s %9i %12.1f %12.1f %10.1f %7.1f'
+                  % (name, self.counts[name], total / steps * 1e6, total / self.counts[name] * 1e6,
+                     self.maxima[name] * 1e6, 100.0 * total / wall if wall > 0 else 0.0), file=self.out)
+        if self.step_calls:
+            print('  %-40s %12s' % ('traci call', 'calls/step'), file=self.out)
+            for key in sorted(self.step_calls, key=self.step_calls.get, reverse=True):
+                print('  %-40s %12.2f' % (key, float(self.step_calls[key]) / steps), file=self.out)
+        self.out.flush()
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+        for event in events:
+            self.trace.write(json.dumps(event) + (",\n" if self.chrome else "\n"))
+
+    def close(self):
+        if self.trace:
+            self.flush()
+            if self.chrome:
+                # every event ends with a comma, a metadata event naming
+                # the process is the last element
+                self.trace.write('{"name": "process_name", "ph": "M", "pid": 0, "args": {"name": "runner"}}\n]\n')
+            self.trace.close()
+            self.trace = None
+
+
+class NullProfiler:
+    """Profiler interface doing nothing."""
+    def start(self):
+        return 0.0
+
+    def stop(self, name, begin):
+        return 0.0
+
+    def wrap(self, conn):
+        return conn
+
+    def endStep(self):
+        pass
+
+    def endIteration(self, iteration):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL = NullProfiler()
+
+
+def create(enabled, trace=None, interval=1):
+    """a Profiler, or NULL unless enabled or a trace file is given"""
+    if enabled or trace:
+        return Profiler(trace, interval)
+    return NULL
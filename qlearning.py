@@ -1,76 +1,362 @@
 import random
 import numpy as np
-from keras.models import Sequential
-from keras import optimizers
-from keras.layers.core import Dense, Activation, Dropout
+import qnetwork
 
 max_memory = 100000
 batch_size = 64
 learning_rate = 0.01
 hidden_size = 32
 
+try:
+    xrange
+except NameError:
+    xrange = range
+
 class ExperienceReplay(object):
-    def __init__(self):
+    """Fixed size ring buffer of transitions stored column wise in NumPy arrays.
+
+    The arrays are allocated on the first remember call, when the state size
+    is known, and the oldest transition is overwritten once the memory is full.
+    """
+    def __init__(self, max_memory=max_memory):
         self.max_memory = max_memory
         self.batch_size = batch_size
-        self.memory = list()
+        self.size = 0
+        self.position = 0
+        self.states = None
+
+    def __len__(self):
+        return self.size
+
+    def allocate(self, input_size):
+        self.states = np.zeros((self.max_memory, input_size), dtype=np.float32)
+        self.actions = np.zeros(self.max_memory, dtype=np.int64)
+        self.rewards = np.zeros(self.max_memory, dtype=np.float32)
+        self.next_states = np.zeros((self.max_memory, input_size), dtype=np.float32)
+        self.game_over = np.zeros(self.max_memory, dtype=bool)
+        self.batch = None
 
     def remember(self, states, game_over):
-        # memory[i] = [[state_t, action_t, reward_t, state_t+1], game_over?]
-        self.memory.append([states, game_over])
-        if len(self.memory) > self.max_memory:
-            del self.memory[0]
+        # states = [state_t, action_t, reward_t, state_t+1]
+        if self.states is None:
+            self.allocate(len(states[0]))
+        i = self.position
+        self.states[i] = states[0]
+        self.actions[i] = states[1]
+        self.rewards[i] = states[2]
+        self.next_states[i] = states[3]
+        self.game_over[i] = game_over
+        self.position = (i + 1) % self.max_memory
+        self.size = min(self.size + 1, self.max_memory)
+        return i
+
+    def rememberBatch(self, states, actions, rewards, next_states, game_over=False):
+        """stores row i of every argument as one transition, returns the slots used"""
+        states = np.asarray(states)
+        if self.states is None:
+            self.allocate(states.shape[1])
+        n = len(states)
+        indices = (self.position + np.arange(n)) % self.max_memory
+        # with more rows than slots only the newest ones stay
+        keep = slice(max(0, n - self.max_memory), n)
+        self.states[indices[keep]] = states[keep]
+        self.actions[indices[keep]] = np.asarray(actions)[keep]
+        self.rewards[indices[keep]] = np.broadcast_to(rewards, (n, ))[keep]
+        self.next_states[indices[keep]] = np.asarray(next_states)[keep]
+        self.game_over[indices[keep]] = np.broadcast_to(game_over, (n, ))[keep]
+        self.position = (self.position + n) % self.max_memory
+        self.size = min(self.size + n, self.max_memory)
+        return indices[keep]
+
+    def sample(self, batch_size):
+        n = min(batch_size, self.size)
+        return np.array(random.sample(xrange(self.size), n), dtype=np.int64)
 
     def get_batch(self, batch_size):
-        indices = random.sample(np.arange(len(self.memory)), min(batch_size,len(self.memory)) )
-        miniBatch = []
-        for index in indices:
-            miniBatch.append(self.memory[index])
-        return miniBatch
+        """returns (states, actions, rewards, next_states, game_over) arrays
+
+        The arrays are reused by the next call.
+        """
+        return self.gather(self.sample(batch_size))
+
+    def gather(self, indices):
+        n = len(indices)
+        if self.size == 0:
+            return None
+        if self.batch is None or len(self.batch[1]) < n:
+            self.batch = (np.empty((n, self.states.shape[1]), dtype=np.float32),
+                          np.empty(n, dtype=np.int64),
+                          np.empty(n, dtype=np.float32),
+                          np.empty((n, self.states.shape[1]), dtype=np.float32),
+                          np.empty(n, dtype=bool))
+        batch = tuple(b[:n] for b in self.batch)
+        for column, out in zip((self.states, self.actions, self.rewards, self.next_states, self.game_over), batch):
+            np.take(column, indices, axis=0, out=out)
+        return batch
+
+    def updatePriorities(self, batch, errors):
+        """uniform sampling ignores the TD errors"""
+        pass
+
+    def getState(self):
+        """the stored transitions and counters, see checkpoint.py"""
+        state = {"size": self.size, "position": self.position}
+        if self.states is not None:
+            n = self.size
+            state.update(states=self.states[:n], actions=self.actions[:n], rewards=self.rewards[:n],
+                         next_states=self.next_states[:n], game_over=self.game_over[:n])
+        return state
+
+    def setState(self, state):
+        self.size = state["size"]
+        self.position = state["position"]
+        if "states" in state:
+            self.allocate(state["states"].shape[1])
+            n = self.size
+            self.states[:n] = state["states"]
+            self.actions[:n] = state["actions"]
+            self.rewards[:n] = state["rewards"]
+            self.next_states[:n] = state["next_states"]
+            self.game_over[:n] = state["game_over"]
+
+
+class SumTree(object):
+    """Binary tree of priorities in one array, leaf i is at tree[capacity + i].
+
+    The capacity is rounded up to a power of two so all leaves have the same
+    depth and a whole batch can be looked up or updated level by level.
+    """
+    def __init__(self, capacity):
+        self.capacity = 1
+        while self.capacity < capacity:
+            self.capacity *= 2
+        self.tree = np.zeros(2 * self.capacity, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def set(self, index, priority):
+        node = index + self.capacity
+        tree = self.tree
+        tree[node] = priority
+        while node > 1:
+            node //= 2
+            tree[node] = tree[2 * node] + tree[2 * node + 1]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices, dtype=np.int64) + self.capacity
+        self.tree[nodes] = priorities
+        # duplicate parents just recompute the same sum
+        while nodes[0] > 1:
+            nodes //= 2
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """leaf indices whose prefix sum interval contains the values"""
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left = 2 * nodes
+            goRight = values >= self.tree[left]
+            values -= np.where(goRight, self.tree[left], 0)
+            nodes = left + goRight
+        return nodes - self.capacity
+
+
+class PrioritizedReplay(ExperienceReplay):
+    """Proportional prioritized replay (Schaul et al. 2016).
+
+    get_batch additionally returns the importance sampling weights and the
+    sampled indices, the TD errors of the update go back via updatePriorities.
+    """
+    def __init__(self, max_memory=max_memory, alpha=0.6, beta=0.4, beta_steps=100000, epsilon=1e-3):
+        ExperienceReplay.__init__(self, max_memory)
+        self.tree = SumTree(max_memory)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = (1.0 - beta) / beta_steps
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+
+    def remember(self, states, game_over):
+        i = ExperienceReplay.remember(self, states, game_over)
+        # new transitions are replayed at least once
+        self.tree.set(i, self.max_priority)
+        return i
+
+    def rememberBatch(self, states, actions, rewards, next_states, game_over=False):
+        indices = ExperienceReplay.rememberBatch(self, states, actions, rewards, next_states, game_over)
+        if len(indices):
+            self.tree.update(indices, np.full(len(indices), self.max_priority))
+        return indices
+
+    def sample(self, batch_size):
+        n = min(batch_size, self.size)
+        # one uniform draw from each of n equal slices of the total priority
+        segment = self.tree.total() / n
+        values = (np.arange(n) + np.random.uniform(size=n)) * segment
+        return np.minimum(self.tree.find(values), self.size - 1)
+
+    def get_batch(self, batch_size):
+        """returns (states, actions, rewards, next_states, game_over, weights, indices)"""
+        if self.size == 0:
+            return None
+        indices = self.sample(batch_size)
+        batch = self.gather(indices)
+        # a value rounded past the last filled leaf is clamped to an index
+        # whose leaf may still be 0, no stored transition has less than
+        # epsilon ** alpha
+        priorities = np.maximum(self.tree.tree[indices + self.tree.capacity], self.epsilon ** self.alpha)
+        probabilities = priorities / self.tree.total()
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return batch + (weights, indices)
+
+    def updatePriorities(self, batch, errors):
+        priorities = (np.abs(errors) + self.epsilon) ** self.alpha
+        self.tree.update(batch[6], priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
+
+    def getState(self):
+        state = ExperienceReplay.getState(self)
+        state.update(tree=self.tree.tree, beta=self.beta, max_priority=self.max_priority)
+        return state
+
+    def setState(self, state):
+        ExperienceReplay.setState(self, state)
+        self.tree.tree[:] = state["tree"]
+        self.beta = state["beta"]
+        self.max_priority = state["max_priority"]
 
 
 class DeepQ:
-    def __init__(self, input_size, num_actions):
+    """Double DQN on a model from qnetwork, by default the NumPy MLP.
+
+    hidden lists the sizes of the hidden layers, e.g. (hidden_size, ), the
+    default () is the single linear layer the Keras model used to have.
+    updateTarget copies the online weights into the separate target network,
+    with tau < 1 it moves the target only that far towards them (Polyak).
+    """
+    def __init__(self, input_size, num_actions, backend="numpy", hidden=(), optimizer="sgd", tau=1.0):
+        self.backend = backend
+        self.hidden = hidden
+        self.optimizer = optimizer
+        self.tau = tau
         self.model = self.createModel('relu', input_size, num_actions)
         self.target_model = self.createModel('relu', input_size, num_actions)
+        qnetwork.syncWeights(self.model, self.target_model)
+        # minibatch buffers reused by trainModel
+        self.inputs = None
+        self.td_errors = np.zeros(0)
 
     def createModel(self, activationType, input_size, num_actions):
-            layerSize = hidden_size
-            model = Sequential()
-            #model.add(Dense(layerSize, input_shape=(input_size, ), init='lecun_uniform'))
-            model.add(Dense(num_actions, input_shape=(input_size, ), init='lecun_uniform'))
-            #model.add(Activation(activationType))
-            #model.add(Dense(num_actions, init='lecun_uniform'))
-            model.add(Activation("linear"))
-            optimizer = optimizers.SGD(lr=learning_rate, momentum=0.0, decay=0.0, nesterov=False)
-            model.compile(loss="mse", optimizer=optimizer)
-            #print model.summary()
-            return model
+        return qnetwork.createModel(self.backend, input_size, num_actions, self.hidden, activationType,
+                                    self.optimizer, learning_rate)
     def getAction(self, state):
         state = np.array(state)
         qValues = self.model.predict(state.reshape(1,len(state)))[0]
         return np.argmax(qValues)
+    def getQValues(self, states):
+        """Q-values of every row of states in one forward pass"""
+        return self.model.predict(np.asarray(states))
     def updateTarget(self):
-        self.target_model = self.model
+        qnetwork.syncWeights(self.model, self.target_model, self.tau)
+    def getWeights(self):
+        return self.model.get_weights()
+    def setWeights(self, weights):
+        self.model.set_weights(weights)
+    def getState(self):
+        """online and target weights, keyed by layer index for checkpoint.py"""
+        return {"model": dict((str(i), w) for i, w in enumerate(self.model.get_weights())),
+                "target": dict((str(i), w) for i, w in enumerate(self.target_model.get_weights()))}
+    def setState(self, state):
+        self.model.set_weights([state["model"][str(i)] for i in range(len(state["model"]))])
+        self.target_model.set_weights([state["target"][str(i)] for i in range(len(state["target"]))])
     def trainModel(self, batch, discount, input_size, num_actions):
-        X_batch = np.empty((0, input_size), dtype = np.float64)
-        Y_batch = np.empty((0, num_actions), dtype = np.float64)
-        for sample in batch:
-            state = np.array(sample[0][0])
-            action = sample[0][1]
-            reward = sample[0][2]
-            newState = np.array(sample[0][3])
-            isFinal = sample[1]
-            qValues = self.model.predict(state.reshape(1,len(state)))[0]
-            bestAction = np.argmax(self.target_model.predict(newState.reshape(1,len(newState)))[0])
-            qValuesNewState = self.model.predict(newState.reshape(1,len(newState)))[0]
-            targetValue = reward + discount * qValuesNewState[bestAction]
-
-            X_batch = np.append(X_batch, np.array([state.copy()]), axis=0)
-            Y_sample = qValues.copy()
-            Y_sample[action] = targetValue
-            Y_batch = np.append(Y_batch, np.array([Y_sample]), axis=0)
-            if isFinal:
-                X_batch = np.append(X_batch, np.array([newState.copy()]), axis=0)
-                Y_batch = np.append(Y_batch, np.array([[reward]*num_actions]), axis=0)
-        return self.model.train_on_batch(X_batch, Y_batch)
\ No newline at end of file
+        """batch is the tuple returned by ExperienceReplay.get_batch
+
+        A prioritized batch also carries importance sampling weights. The TD
+        errors of the batch are kept in self.td_errors for updatePriorities.
+        """
+        if batch is None or len(batch[1]) == 0:
+            return 0.0
+        states_batch, actions, rewards, next_states_batch, isFinal = batch[:5]
+        n = len(actions)
+        self.ensureBuffers(n, input_size, num_actions)
+        # rows [0, n) hold the states and rows [n, 2n) the new states, so the
+        # online model needs a single forward pass for both
+        inputs = self.inputs[:2 * n]
+        states, newStates = inputs[:n], inputs[n:]
+        states[:] = states_batch
+        newStates[:] = next_states_batch
+        qValues = self.model.predict(inputs)
+        bestAction = np.argmax(self.target_model.predict(newStates), axis=1)
+        rows = np.arange(n)
+        targetValue = rewards + discount * qValues[n:][rows, bestAction]
+        self.td_errors = targetValue - qValues[rows, actions]
+
+        # final transitions add a row for the new state with the plain reward
+        finals = np.flatnonzero(isFinal)
+        m = n + len(finals)
+        X_batch = self.X[:m]
+        Y_batch = self.Y[:m]
+        X_batch[:n] = states
+        Y_batch[:n] = qValues[:n]
+        Y_batch[rows, actions] = targetValue
+        X_batch[n:] = newStates[finals]
+        Y_batch[n:] = rewards[finals, None]
+        if len(batch) > 5:
+            weights = np.concatenate((batch[5], batch[5][finals]))
+            return self.model.train_on_batch(X_batch, Y_batch, sample_weight=weights)
+        return self.model.train_on_batch(X_batch, Y_batch)
+    def ensureBuffers(self, n, input_size, num_actions):
+        if self.inputs is not None and len(self.inputs) >= 2 * n and self.inputs.shape[1] == input_size:
+            return
+        self.inputs = np.empty((2 * n, input_size), dtype=np.float32)
+        self.X = np.empty((2 * n, input_size), dtype=np.float32)
+        self.Y = np.empty((2 * n, num_actions), dtype=np.float32)
+
+
+def trainStacked(online, target, agents, batches, discount):
+    """DeepQ.trainModel of the networks agents[j] on batches[j], all in one batched update
+
+    online and target are the qnetwork.StackedMLPs of the models and the
+    target models, agents must not repeat. The batches are padded to the
+    largest one, padding rows get no weight. Returns the losses and the TD
+    errors of every batch.
+    """
+    agents = np.asarray(agents)
+    sizes = np.array([len(b[1]) for b in batches])
+    n = sizes.max()
+    states, actions, rewards, next_states, isFinal = [np.concatenate([b[c] for b in batches]) for c in range(5)]
+    weights = np.concatenate([b[5] for b in batches]) if len(batches[0]) > 5 else np.ones(len(actions))
+    # transition i is row offset[i] of network owner[i]
+    owner = np.repeat(np.arange(len(agents)), sizes)
+    offset = np.arange(len(actions)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    # rows [0, n) hold the states and rows [n, 2n) the new states, like in trainModel
+    inputs = np.zeros((len(agents), 2 * n, states.shape[1]), dtype=online.dtype)
+    inputs[owner, offset] = states
+    inputs[owner, n + offset] = next_states
+    qValues = online.predict(inputs, agents)
+    bestAction = np.argmax(target.predict(inputs[:, n:], agents), axis=2)
+    targetValue = rewards + discount * qValues[owner, n + offset, bestAction[owner, offset]]
+    td_errors = targetValue - qValues[owner, offset, actions]
+
+    # final transitions add a row for the new state with the plain reward
+    finals = np.flatnonzero(isFinal)
+    counts = np.bincount(owner[finals], minlength=len(agents))
+    rank = np.arange(len(finals)) - (np.cumsum(counts) - counts)[owner[finals]]
+    m = n + counts.max()
+    X = np.zeros((len(agents), m, states.shape[1]), dtype=online.dtype)
+    Y = np.zeros((len(agents), m, qValues.shape[2]), dtype=online.dtype)
+    w = np.zeros((len(agents), m), dtype=online.dtype)
+    X[:, :n] = inputs[:, :n]
+    Y[:, :n] = qValues[:, :n]
+    Y[owner, offset, actions] = targetValue
+    w[owner, offset] = weights
+    X[owner[finals], n + rank] = next_states[finals]
+    Y[owner[finals], n + rank] = rewards[finals, None]
+    w[owner[finals], n + rank] = weights[finals]
+    loss = online.train_on_batch(X, Y, agents, w, sizes + counts)
+    return loss, np.split(td_errors, np.cumsum(sizes)[:-1])
@@ -0,0 +1,249 @@
+"""
+Model backends for DeepQ.
+
+A backend has the part of the Keras model interface DeepQ uses: predict,
+train_on_batch (with an optional sample_weight), get_weights and
+set_weights. MLP implements it in NumPy, which for networks of this size
+is far cheaper than a framework call and needs nothing imported at startup.
+The Keras backend builds the former Sequential model and only imports Keras
+when it is chosen. StackedMLP holds the weights of many MLPs of the same
+shape in stacked arrays and trains any subset of them in one batched pass.
+"""
+import numpy as np
+
+ACTIVATIONS = ("relu", "tanh", "linear")
+
+
+class SGD:
+    def __init__(self, params, learning_rate):
+        self.learning_rate = learning_rate
+
+    def step(self, params, grads):
+        for p, g in zip(params, grads):
+            p -= self.learning_rate * g
+
+
+class Adam:
+    def __init__(self, params, learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-7):
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.m = [np.zeros_like(p) for p in params]
+        self.v = [np.zeros_like(p) for p in params]
+        self.t = 0
+
+    def step(self, params, grads):
+        self.t += 1
+        rate = self.learning_rate * np.sqrt(1 - self.beta2 ** self.t) / (1 - self.beta1 ** self.t)
+        for p, g, m, v in zip(params, grads, self.m, self.v):
+            m *= self.beta1
+            m += (1 - self.beta1) * g
+            v *= self.beta2
+            v += (1 - self.beta2) * g * g
+            p -= rate * m / (np.sqrt(v) + self.epsilon)
+
+
+OPTIMIZERS = {"sgd": SGD, "adam": Adam}
+
+
+class MLP:
+    """Fully connected network with hidden layers of the given sizes and a linear output.
+
+    The weights are kept like Keras Dense layers, [kernel, bias] per layer
+    with the kernel shaped (inputs x outputs), so get_weights and
+    set_weights are interchangeable with the Keras backend. The loss is the
+    mean squared error.
+    """
+    def __init__(self, input_size, num_actions, hidden=(), activation="relu", optimizer="sgd",
+                 learning_rate=0.01, dtype=np.float32):
+        if activation not in ACTIVATIONS:
+            raise ValueError("unknown activation %s" % activation)
+        self.activation = activation
+        self.dtype = dtype
+        sizes = [input_size] + list(hidden) + [num_actions]
+        self.params = []
+        for n, m in zip(sizes[:-1], sizes[1:]):
+            # lecun_uniform like the former Keras model
+            limit = np.sqrt(3.0 / n)
+            self.params.append(np.random.uniform(-limit, limit, size=(n, m)).astype(dtype))
+            self.params.append(np.zeros(m, dtype=dtype))
+        self.grads = [np.zeros_like(p) for p in self.params]
+        self.optimizer = OPTIMIZERS[optimizer](self.params, learning_rate)
+
+    def activate(self, z):
+        if self.activation == "relu":
+            np.maximum(z, 0, out=z)
+        elif self.activation == "tanh":
+            np.tanh(z, out=z)
+        return z
+
+    def forward(self, X):
+        """returns the activations of every layer, the input first and the output last"""
+        layers = [np.asarray(X, dtype=self.dtype)]
+        last = len(self.params) // 2 - 1
+        for i in range(0, len(self.params), 2):
+            z = np.dot(layers[-1], self.params[i])
+            z += self.params[i + 1]
+            layers.append(z if i // 2 == last else self.activate(z))
+        return layers
+
+    def predict(self, X):
+        return self.forward(X)[-1]
+
+    def train_on_batch(self, X, Y, sample_weight=None):
+        """one optimizer step on the mean squared error, returns the loss before the step"""
+        layers = self.forward(X)
+        error = layers[-1] - np.asarray(Y, dtype=self.dtype)
+        if sample_weight is None:
+            loss = np.mean(error * error)
+        else:
+            w = np.asarray(sample_weight, dtype=self.dtype)[:, None]
+            loss = np.mean(w * error * error)
+            error *= w
+        # gradient of the mean over rows and outputs
+        delta = error * (2.0 / error.size)
+        for i in range(len(self.params) - 2, -1, -2):
+            np.dot(layers[i // 2].T, delta, out=self.grads[i])
+            np.sum(delta, axis=0, out=self.grads[i + 1])
+            if i > 0:
+                delta = np.dot(delta, self.params[i].T)
+                a = layers[i // 2]
+                if self.activation == "relu":
+                    delta *= a > 0
+                elif self.activation == "tanh":
+                    delta *= 1 - a * a
+        self.optimizer.step(self.params, self.grads)
+        return float(loss)
+
+    def get_weights(self):
+        return [p.copy() for p in self.params]
+
+    def set_weights(self, weights):
+        for p, w in zip(self.params, weights):
+            p[...] = w
+
+
+class StackedMLP:
+    """The MLPs models in stacked arrays, kernel i is (models x inputs x outputs).
+
+    The MLPs keep working on their own, their params become views into the
+    stacked arrays, so a change through either side shows in the other.
+    forward and train_on_batch run the networks agents[j] on X[j] for all j
+    in one matmul per layer. Updates are plain SGD steps.
+    """
+    def __init__(self, models, learning_rate=0.01):
+        first = models[0]
+        self.activation = first.activation
+        self.dtype = first.dtype
+        self.learning_rate = learning_rate
+        self.params = [np.stack([m.params[i] for m in models]) for i in range(len(first.params))]
+        for k, m in enumerate(models):
+            m.params = [p[k] for p in self.params]
+
+    def activate(self, z):
+        return MLP.activate(self, z)
+
+    def select(self, agents):
+        """the params of the networks agents, without a copy when that is all of them in order"""
+        if len(agents) == len(self.params[0]) and np.all(agents == np.arange(len(agents))):
+            return self.params
+        return [p[agents] for p in self.params]
+
+    def forward(self, X, agents, params=None):
+        """activations of every layer, X is (len(agents) x rows x inputs)"""
+        params = self.select(agents) if params is None else params
+        layers = [np.asarray(X, dtype=self.dtype)]
+        last = len(params) // 2 - 1
+        for i in range(0, len(params), 2):
+            z = np.matmul(layers[-1], params[i])
+            z += params[i + 1][:, None, :]
+            layers.append(z if i // 2 == last else self.activate(z))
+        return layers
+
+    def predict(self, X, agents):
+        return self.forward(X, agents)[-1]
+
+    def train_on_batch(self, X, Y, agents, sample_weight, rows):
+        """one SGD step of every network agents[j] on X[j], Y[j], returns their losses
+
+        agents must not repeat. sample_weight is (len(agents) x rows), 0 for
+        padding rows, and rows[j] the number of real rows of network j, each
+        network gets the gradient of its own weighted mean squared error.
+        """
+        params = self.select(agents)
+        layers = self.forward(X, agents, params)
+        error = layers[-1] - np.asarray(Y, dtype=self.dtype)
+        w = np.asarray(sample_weight, dtype=self.dtype)[:, :, None]
+        scale = (1.0 / (np.asarray(rows) * error.shape[2])).astype(self.dtype)[:, None, None]
+        loss = (w * error * error * scale).sum(axis=(1, 2))
+        delta = error * w * (2 * scale)
+        grads = [None] * len(self.params)
+        for i in range(len(self.params) - 2, -1, -2):
+            grads[i] = np.matmul(layers[i // 2].transpose(0, 2, 1), delta)
+            grads[i + 1] = delta.sum(axis=1)
+            if i > 0:
+                delta = np.matmul(delta, params[i].transpose(0, 2, 1))
+                a = layers[i // 2]
+                if self.activation == "relu":
+                    delta *= a > 0
+                elif self.activation == "tanh":
+                    delta *= 1 - a * a
+        for p, g in zip(self.params, grads):
+            if params is self.params:
+                p -= self.learning_rate * g
+            else:
+                p[agents] -= self.learning_rate * g
+        return loss
+
+
+def syncWeights(source, target, tau=1.0):
+    """target = tau * source + (1 - tau) * target, a plain copy for tau=1
+
+    The NumPy backend updates its arrays in place without temporaries, a
+    Keras model goes through get_weights and set_weights.
+    """
+    if isinstance(source, (MLP, StackedMLP)) and isinstance(target, (MLP, StackedMLP)):
+        for s, t in zip(source.params, target.params):
+            if tau == 1.0:
+                np.copyto(t, s)
+            else:
+                # t = s + (1 - tau) * (t - s)
+                t -= s
+                t *= 1.0 - tau
+                t += s
+        return
+    weights = source.get_weights()
+    if tau != 1.0:
+        weights = [tau * s + (1.0 - tau) * t for s, t in zip(weights, target.get_weights())]
+    target.set_weights(weights)
+
+
+def createKerasModel(input_size, num_actions, hidden=(), activation="relu", optimizer="sgd", learning_rate=0.01):
+    from keras.models import Sequential
+    from keras import optimizers
+    from keras.layers.core import Dense, Activation
+    model = Sequential()
+    sizes = list(hidden) + [num_actions]
+    for k, size in enumerate(sizes):
+        if k == 0:
+            model.add(Dense(size, input_shape=(input_size, ), init='lecun_uniform'))
+        else:
+            model.add(Dense(size, init='lecun_uniform'))
+        model.add(Activation(activation if k < len(sizes) - 1 else "linear"))
+    if optimizer == "adam":
+        opt = optimizers.Adam(lr=learning_rate)
+    else:
+        opt = optimizers.SGD(lr=learning_rate, momentum=0.0, decay=0.0, nesterov=False)
+    model.compile(loss="mse", optimizer=opt)
+    return model
+
+
+BACKENDS = {"numpy": MLP, "keras": createKerasModel}
+
+
+def createModel(backend, input_size, num_actions, hidden=(), activation="relu", optimizer="sgd",
+                learning_rate=0.01):
+    if backend not in BACKENDS:
+        raise ValueError("unknown model backend %s" % backend)
+    return BACKENDS[backend](input_size, num_actions, hidden, activation, optimizer, learning_rate)
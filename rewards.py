@@ -0,0 +1,106 @@
+"""
+Reward terms and metrics computed from the StateCollector arrays.
+
+A term is a sum over all lanes of one collector quantity, optionally raised
+to a power first, so every term of a step comes out of one vectorized pass
+over collector.lane_values and no term queries the simulation. The reward
+is a weighted sum of terms, given as a spec like "speed:0.1,co2:-0.0001".
+"""
+import numpy as np
+
+# rows of collector.lane_values
+QUANTITIES = ("vehicles", "speed", "halting", "waiting", "co2")
+
+# name -> (quantity, exponent), "changed" is the number of lights switched
+TERMS = {
+    "vehicles": ("vehicles", 1.0),
+    "speed": ("speed", 1.0),          # sum of the mean speeds per lane, empty lanes count as 0
+    "halting": ("halting", 1.0),      # waiting cars
+    "waiting": ("waiting", 1.0),      # waiting seconds
+    "co2": ("co2", 1.0),              # mg/s
+    "halting_pow": ("halting", 1.5),
+    "waiting_pow": ("waiting", 1.5),
+    "changed": (None, 1.0),
+}
+
+
+def register(name, quantity, exponent=1.0):
+    """adds a term named name summing quantity ** exponent over all lanes"""
+    if quantity not in QUANTITIES:
+        raise ValueError("unknown quantity %s" % quantity)
+    TERMS[name] = (quantity, float(exponent))
+
+
+def parseWeights(spec):
+    """"speed:0.1,co2:-0.0001" -> [("speed", 0.1), ("co2", -0.0001)], a missing weight is 1"""
+    weights = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition(":")
+        weights.append((name.strip(), float(weight) if weight else 1.0))
+    return weights
+
+
+class Rewards:
+    """Evaluates the reward terms and the metrics of one step.
+
+    reward is a spec for parseWeights or a list of (name, weight), metrics
+    are further term names to compute alongside, read them with value.
+    """
+    def __init__(self, reward, metrics=()):
+        weights = parseWeights(reward) if isinstance(reward, str) else list(reward)
+        self.names = []
+        for name in [n for n, w in weights] + list(metrics):
+            if name not in TERMS:
+                raise ValueError("unknown reward term %s" % name)
+            if name not in self.names:
+                self.names.append(name)
+        self.index = dict((name, k) for k, name in enumerate(self.names))
+        self.weights = np.zeros(len(self.names))
+        for name, weight in weights:
+            self.weights[self.index[name]] += weight
+        lane = [k for k, name in enumerate(self.names) if TERMS[name][0] is not None]
+        self.lane_terms = np.array(lane, dtype=np.int64)
+        self.rows = np.array([QUANTITIES.index(TERMS[self.names[k]][0]) for k in lane], dtype=np.int64)
+        self.exponents = np.array([TERMS[self.names[k]][1] for k in lane])[:, None]
+        self.powers = bool(np.any(self.exponents != 1))
+        self.changed = self.index.get("changed", -1)
+        self.values = np.zeros(len(self.names))
+        self.batch_values = np.zeros((len(self.names), 0))
+
+    def evaluate(self, collector, changed=0):
+        """computes all terms of the current step, returns the reward"""
+        x = collector.lane_values[self.rows]
+        if self.powers:
+            x = x ** self.exponents
+        self.values[self.lane_terms] = x.sum(axis=1)
+        if self.changed >= 0:
+            self.values[self.changed] = changed
+        return self.weights.dot(self.values)
+
+    def evaluateBatch(self, lane_values, changed=0):
+        """evaluate for many simulations at once, returns one reward per copy
+
+        lane_values is (quantities x lanes x copies), the collector layout
+        with one more axis, and changed holds the number of switched lights
+        per copy. The terms go into batch_values, read them with batchValue,
+        value keeps giving the terms of the last single step.
+        """
+        x = lane_values[self.rows]
+        if self.powers:
+            x = x ** self.exponents[:, :, None]
+        values = np.empty((len(self.names), lane_values.shape[2]))
+        values[self.lane_terms] = x.sum(axis=1)
+        if self.changed >= 0:
+            values[self.changed] = changed
+        self.batch_values = values
+        return self.weights.dot(values)
+
+    def value(self, name):
+        """a term of the last evaluate"""
+        return self.values[self.index[name]]
+
+    def batchValue(self, name):
+        """a term of the last evaluateBatch, one entry per copy"""
+        return self.batch_values[self.index[name]]
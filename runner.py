@@ -28,9 +28,23 @@ import optparse
 import subprocess
 import random
 import time
+import traceback
 import numpy as np
-from qlearning import DeepQ
-from qlearning import ExperienceReplay
+import demand
+from collector import StateCollector
+from rewards import Rewards
+from observation import ObservationEncoder, NeighbourhoodEncoder
+from dataset import TransitionRecorder
+import connection
+import netindex
+import checkpoint
+import profiler
+import grid as gridnet
+from episodes import EpisodeReset, stateDirectory
+from agents import DQNAgents
+from pipeline import PipelinedAgents
+from policy import EpsilonGreedy
+import workers
 
 # we need to import python modules from the $SUMO_HOME/tools directory
 try:
@@ -40,10 +54,21 @@ try:
         os.path.dirname(__file__), "..", "..", "..")), "tools"))  # tutorial in docs
     from sumolib import checkBinary
 except ImportError:
-    sys.exit(
-        "please declare environment variable 'SUMO_HOME' as the root directory of your sumo installation (it should contain folders 'bin', 'tools' and 'docs')")
+    # run works on a connection passed in, e.g. mocksumo, without SUMO
+    def checkBinary(name):
+        sys.exit(
+            "please declare environment variable 'SUMO_HOME' as the root directory of your sumo installation (it should contain folders 'bin', 'tools' and 'docs')")
+
+try:
+    import traci
+except ImportError:
+    traci = None
+
+try:
+    xrange
+except NameError:
+    xrange = range
 
-import traci
 # the port used for communicating with your sumo instance
 PORT = 8873
 
@@ -51,47 +76,7 @@ startTime = {}
 
 def generate_routefile():
     random.seed(42)  # make tests reproducible
-    N = 3600000  # number of time steps
-    # demand per second from different directions
-    with open("data/cross.rou.xml", "w") as routes:
-        print("""<routes>
-        <vType id="typeWE" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>
-        <vType id="typeNS" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>""", file=routes)
-        f = 0
-        for ep in range(500):
-            b = ep * 500
-
-            for i in range(8):
-                for j in range(8):
-                    if i == j:
-                        continue
-                    print('    <flow id="%i" begin="%i" end="%i" probability="%f" type="typeWE" from="%ii" to="%io"/>' % (f, b, b + 100, 0.005, i, j), file=routes)
-                    f += 1
-            for i in range(8):
-                for j in range(8):
-                    if i == j:
-                        continue        
-                    print('    <flow id="%i" begin="%i" end="%i" probability="%f" type="typeWE" from="%ii" to="%io"/>' % (f, b + 100, b + 200, 0.007, i, j), file=routes)
-                    f += 1
-            for i in range(8):
-                for j in range(8):
-                    if i == j:
-                        continue
-                    print('    <flow id="%i" begin="%i" end="%i" probability="%f" type="typeWE" from="%ii" to="%io"/>' % (f, b + 200, b + 300, 0.009, i, j), file=routes)
-                    f += 1
-            for i in range(8):
-                for j in range(8):
-                    if i == j:
-                        continue
-                    print('    <flow id="%i" begin="%i" end="%i" probability="%f" type="typeWE" from="%ii" to="%io"/>' % (f, b + 300, b + 400, 0.007, i, j), file=routes)
-                    f += 1
-            for i in range(8):
-                for j in range(8):
-                    if i == j:
-                        continue
-                    print('    <flow id="%i" begin="%i" end="%i" probability="%f" type="typeWE" from="%ii" to="%io"/>' % (f, b + 400, b + 500, 0.0045, i, j), file=routes)
-                    f += 1
-        print("</routes>", file=routes)
+    demand.generate(demand.RUNNER)
 
 # The program looks like this
 #    <tlLogic id="0" type="static" programID="0" offset="0">
@@ -102,157 +87,197 @@ def generate_routefile():
 #        <phase duration="6"  state="ryry"/>
 #    </tlLogic>
 
-def actionState(l):
-    actions = []
-    if traci.trafficlights.getPhase(l) % 2 == 0:
-        # we are not already switching
-        actions.append(0)
-        actions.append(1)
-    return actions
+# which phases are decisions and how actions switch comes from
+# netindex.PhaseTable, for this program action 0 asks for phase 0 and
+# action 1 for phase 2, each through the yellow phase before it
 
-def setState(light, action):
-    #0 is default state, 1 is other state
-    s = traci.trafficlights.getPhase(light)
-    if action == 0:
-        if s == 0:
-            traci.trafficlights.setPhase(light, 0)
-        else:
-            traci.trafficlights.setPhase(light, 3)
-            return 1
-    if action == 1:
-        if s == 2:
-            traci.trafficlights.setPhase(light, 2)
-        else:
-            traci.trafficlights.setPhase(light, 1)
-            return 1
-    return 0
-
-e = 1
 
-def getReward(changed):
-    lanes = traci.lane.getIDList()
-    s = 0.0
-    for l in lanes:
-        q, w, speed = 0, 0, 0
-        for c in traci.lane.getLastStepVehicleIDs(l):
-            if traci.vehicle.getWaitingTime(c) > 0:
-                q += 1
-            speed += traci.vehicle.getSpeed(c)
-        speed /= max(1, len(traci.lane.getLastStepVehicleIDs(l))) * 10
-        w = traci.lane.getWaitingTime(l)
-        #s -= 1 * (q) ** 1.5 + 2 * (w) ** 1.5 - speed ** 1.5
-        s += speed
-    #s /= max(len(traci.vehicle.getIDList()), 1)
-    for l in lanes:        
-        s -= traci.lane.getCO2Emission(l) / 10000.0
-    #s -= changed
-    return s
+def networkIndex(options):
+    """the netindex.NetIndex of the network the options control"""
+    if options.grid:
+        path = gridnet.directory(*options.grid)
+        return netindex.load(os.path.join(path, "grid.net.xml"), os.path.join(path, "grid.det.xml"))
+    return netindex.load(netindex.NET_FILE, netindex.DETECTOR_FILE)
 
-def getCO2():
-    s = 0
-    for l in traci.lane.getIDList():
-        s += traci.lane.getCO2Emission(l)
-    return s
+e = 1
 
-def getWaitingTime():
-    s = 0
-    for l in traci.lane.getIDList():
-        for c in traci.lane.getLastStepVehicleIDs(l):
-            #if traci.vehicle.getWaitingTime(c) > 0:
-                #s += 1
-            s += traci.vehicle.getWaitingTime(c)
-    return s
+# reward terms and their weights, see rewards.TERMS
+REWARD = "speed:0.1,co2:-0.0001"
+# the waiting time metric: seconds all cars waited
+WAITING = "waiting"
 
 
-def step(lights, loops, history, cars_detected, actions):
-    light_state = [0] * len(lights)
-    cars_total = [0] * len(loops)
+def step(collector, encoder, rewards, actions, phases, prof=profiler.NULL):
+    begin = prof.start()
     changed = 0
-    for l in lights:
-        changed += setState(l, actions[int(l)])
+    for k, l in enumerate(collector.lights):
+        changed += phases.setState(traci, l, k, actions[k], collector.phase[k])
+    begin = prof.stop("act", begin)
     traci.simulationStep()
-    for l in lights:
-        light_state[int(l)] = traci.trafficlights.getPhase(l)
-        history[int(l)].append(traci.trafficlights.getPhase(l))
-        history[int(l)].pop(0)
-    for i in loops:
-        cars_detected[int(i)].append(traci.inductionloop.getLastStepVehicleNumber(i))
-        cars_detected[int(i)].pop(0)
-        cars_total[int(i)] = sum(cars_detected[int(i)])
-    ss = light_state
-    ss = np.append(ss, sum(history, []))
-    cars = traci.vehicle.getIDList()
-    r = getReward(changed)
-    #for c in cars:
+    begin = prof.stop("simulationStep", begin)
+    collector.update()
+    begin = prof.stop("collect", begin)
+    ss = encoder.update(collector.phase, collector.loop_vehicles)
+    begin = prof.stop("observe", begin)
+    r = rewards.evaluate(collector, changed)
+    prof.stop("reward", begin)
+    #for c in traci.vehicle.getIDList():
         #travel_time = traci.simulation.getCurrentTime() / 1000 - startTime[c]
         #r -= travel_time
-    return ss, r, cars_detected, history
+    return ss, r
+
+
+def closeAll(*resources):
+    """closes every resource that is not None, a failing close does not skip the others
+
+    The first failure is raised after all are closed, unless the caller is
+    already unwinding from an exception, then the failures are only printed
+    so that the original error comes through.
+    """
+    failures = []
+    for resource in resources:
+        if resource is None:
+            continue
+        try:
+            resource.close()
+        except Exception:
+            failures.append(sys.exc_info())
+    if not failures:
+        return
+    if sys.exc_info()[0] is not None:
+        for failure in failures:
+            traceback.print_exception(*failure)
+        return
+    for failure in failures[1:]:
+        traceback.print_exception(*failure)
+    raise failures[0][1]
+
 
+def run(replay="uniform", agents="shared", history_len=5, record=None, reset="remove", warmup=300, pool_size=8,
+        reward=REWARD, grid=None, backend="numpy", hidden=(),
+        target_period=10, tau=1.0, checkpoint_dir=None, checkpoint_interval=10, resume=False,
+        profile=False, profile_trace=None, profile_interval=1, pipeline=False, update_ratio=1.0,
+        snapshot_interval=15, iterations=1000, index=None, conn=None):
+    """execute the TraCI control loop, on conn if given
 
-def run():
-    """execute the TraCI control loop"""
-    # first, generate the route file for this simulation
-    generate_routefile()
-    traci.init(PORT)
-    loops = traci.inductionloop.getIDList()
-    lights = traci.trafficlights.getIDList()
-    history_len = 5
-    input_size = len(lights) + history_len * len(lights)
-    num_actions = 2
-    update_target = 10
-    batch_size = 32
-    e = 1
-    exp_replay = [ExperienceReplay()] * len(lights)
-    DQN = [DeepQ(input_size, num_actions)] * len(lights)
-    maxSteps = 500
-    total_steps = 0
-    totalCO2, totalWaitingTime = [], []
-    for iteration in xrange(0, 1000):
-        R, t, = 0, 0
-        cars_detected = [[0 for i in range(20)] for j in range(len(loops))]
-        history = [[0 for i in range(history_len)] for j in range(len(lights))]
-        s = [0] * (input_size)
-        actions = [0] * len(lights)
-        totalCO2.append(0)
-        totalWaitingTime.append(0)
-        for l in lights:
-            traci.trafficlights.setPhase(l, 0)
-        while t < maxSteps:
-            for l in lights:
-                a = -1
-                if len(actionState(l)) == 0 or t % 15 != 0:
-                    actions[int(l)] = -1
-                    continue
-                elif np.random.uniform() < e:
-                    a = np.random.choice(actionState(l)) 
-                else:
-                    a = DQN[int(l)].getAction(s)
-                actions[int(l)] = a
-            ss, r, cars_detected, history = step(lights, loops, history, cars_detected, actions)
-            R += r
-            totalWaitingTime[len(totalWaitingTime) - 1] += getWaitingTime()
-            totalCO2[len(totalWaitingTime) - 1] += getCO2()
-            for l in lights:
-                if actions[int(l)] == -1:
-                    continue
-                exp_replay[int(l)].remember([s, actions[int(l)], r, ss], False)
-                if total_steps % update_target == 0:
-                    DQN[int(l)].updateTarget()
-                DQN[int(l)].trainModel(exp_replay[int(l)].get_batch(batch_size), 0.9, input_size, num_actions)
-            t += 1
-            total_steps += 1
-            if e > 0.01:
-                e *= 0.9998
-            s = ss
-        totalWaitingTime[len(totalWaitingTime) - 1] /= t
-        totalCO2[len(totalWaitingTime) - 1] /= t
-        if iteration > 10:
-            totalWaitingTime.pop(0)
-            totalCO2.pop(0)
-        print('Iteration %i completed with Average CO2: %i and Average waiting time %i reward %i epsilon %f' % (iteration, sum(totalCO2) / len(totalCO2), sum(totalWaitingTime) / len(totalWaitingTime), R, e))
-        for car in traci.vehicle.getIDList():
-            traci.vehicle.remove(car)
-    traci.close()
+    With grid=(rows, cols) it controls the generated grid network, every light
+    observes only its neighbourhood. With checkpoint_dir the training state is
+    saved there every checkpoint_interval iterations, resume continues from
+    the latest checkpoint in it. profile prints the time spent in each phase
+    of a step and the TraCI calls every profile_interval iterations,
+    profile_trace also writes the phases to that file, see profiler.py.
+    With pipeline the updates run on a background thread, update_ratio
+    times as many as the sequential loop does, while the lights act with
+    networks refreshed every snapshot_interval steps, see pipeline.py.
+    index is the netindex.NetIndex of the network, without it the ids come
+    from the simulation and every light runs netindex.STANDARD.
+    """
+    global traci
+    # the module level traci is rebound to the connection and the profiler
+    # proxy of this run, later users get the previous one back
+    previous = traci
+    # closed in the finally block however far the setup got
+    DQN = checkpoints = prof = recorder = episodes = None
+    try:
+        # first, generate the route file for this simulation
+        if grid is None:
+            generate_routefile()
+        if conn is not None:
+            # all functions of this module talk to the traci name
+            traci = conn
+        elif not connection.isEmbedded():
+            traci.init(PORT)
+        prof = profiler.create(profile, profile_trace, profile_interval)
+        traci = prof.wrap(traci)
+        if index is None:
+            collector = StateCollector(traci)
+        else:
+            collector = StateCollector(traci, index.lanes, index.loops, index.lights)
+        rewards = Rewards(reward, ("co2", WAITING))
+        loops = collector.loops
+        lights = collector.lights
+        phases = netindex.standard(len(lights)) if index is None else index.phaseTable()
+        if grid is None:
+            encoder = ObservationEncoder(len(lights), len(loops), history_len)
+        else:
+            topology = gridnet.Topology(gridnet.loadLayout(*grid), lights, loops)
+            encoder = NeighbourhoodEncoder(topology.neighbours, topology.approaches, len(loops), history_len)
+        input_size = encoder.input_size
+        recorder = TransitionRecorder(record, input_size) if record else None
+        if grid is None:
+            routeFile, netFile = demand.ROUTE_FILE, netindex.NET_FILE
+        else:
+            routeFile = os.path.join(gridnet.directory(*grid), "grid.rou.xml")
+            netFile = os.path.join(gridnet.directory(*grid), "grid.net.xml")
+        episodes = EpisodeReset(traci, reset, stateDirectory(routeFile, netFile), warmup, pool_size)
+        num_actions = 2
+        batch_size = 32
+        policy = EpsilonGreedy(num_actions, decay=0.9998, legal=phases.legal)
+        DQN = DQNAgents(len(lights), input_size, num_actions, agents, replay, backend=backend, hidden=hidden,
+                        tau=tau, prof=prof)
+        if pipeline:
+            DQN = PipelinedAgents(DQN, update_ratio, snapshot_interval)
+        maxSteps = 500
+        total_steps = 0
+        totalCO2, totalWaitingTime = [], []
+        start = 0
+        checkpoints = checkpoint.Checkpointer(checkpoint_dir) if checkpoint_dir else None
+        if resume and checkpoint.latest(checkpoint_dir):
+            path = checkpoint.latest(checkpoint_dir)
+            start, total_steps, metrics = checkpoint.resumeRun(checkpoint.load(path), DQN, policy, episodes)
+            totalCO2, totalWaitingTime = metrics["co2"], metrics["waiting"]
+            print('Resuming from %s at iteration %i' % (path, start))
+        elif resume:
+            print('No checkpoint in %s, starting a new run' % checkpoint_dir)
+        for iteration in xrange(start, iterations):
+            R, t, = 0, 0
+            begin = prof.start()
+            episodes.reset()
+            prof.stop("reset", begin)
+            s = encoder.reset()
+            totalCO2.append(0)
+            totalWaitingTime.append(0)
+            for k in range(len(lights)):
+                collector.setPhase(k, phases.greens[k, 0])
+            while t < maxSteps:
+                # all lights at once, -1 for the ones that keep their phase
+                begin = prof.start()
+                actions = policy.act(DQN.getQValues, encoder.lights(s), collector.phase, t)
+                prof.stop("select", begin)
+                ss, r = step(collector, encoder, rewards, actions, phases, prof)
+                begin = prof.start()
+                R += r
+                totalWaitingTime[len(totalWaitingTime) - 1] += rewards.value(WAITING)
+                totalCO2[len(totalWaitingTime) - 1] += rewards.value("co2")
+                decided = [k for k in range(len(lights)) if actions[k] != -1]
+                for k in decided:
+                    DQN.remember(k, [encoder.light(s, k), actions[k], r, encoder.light(ss, k)])
+                    if recorder:
+                        recorder.record(encoder.light(s, k), actions[k], r, encoder.light(ss, k))
+                begin = prof.stop("remember", begin)
+                if decided and total_steps % target_period == 0:
+                    DQN.updateTarget()
+                    begin = prof.stop("target", begin)
+                DQN.train(decided, batch_size, 0.9)
+                prof.stop("train", begin)
+                prof.endStep()
+                t += 1
+                total_steps += 1
+                s = ss
+            totalWaitingTime[len(totalWaitingTime) - 1] /= t
+            totalCO2[len(totalWaitingTime) - 1] /= t
+            if iteration > 10:
+                totalWaitingTime.pop(0)
+                totalCO2.pop(0)
+            print('Iteration %i completed with Average CO2: %i and Average waiting time %i reward %i epsilon %f' % (iteration, sum(totalCO2) / len(totalCO2), sum(totalWaitingTime) / len(totalWaitingTime), R, policy.epsilon))
+            prof.endIteration(iteration)
+            if checkpoints and (iteration + 1) % checkpoint_interval == 0:
+                checkpoints.save(iteration, checkpoint.runState(iteration, total_steps, DQN, policy, episodes,
+                                                                {"co2": totalCO2, "waiting": totalWaitingTime}))
+        traci.close()
+    finally:
+        traci = previous
+        closeAll(DQN, checkpoints, prof, recorder, episodes)
     sys.stdout.flush()
 
 
@@ -260,7 +285,68 @@ def get_options():
     optParser = optparse.OptionParser()
     optParser.add_option("--nogui", action="store_true",
                          default=False, help="run the commandline version of sumo")
+    optParser.add_option("--history-len", type="int", default=5,
+                         help="number of past phases per light in the observation [default: %default]")
+    optParser.add_option("--replay", type="choice", choices=["uniform", "prioritized"],
+                         default="uniform", help="experience replay sampling [default: %default]")
+    optParser.add_option("--agents", type="choice", choices=["shared", "independent"], default="shared",
+                         help="one network for all lights or one per light [default: %default]")
+    optParser.add_option("--workers", type="int", default=0,
+                         help="train with this many parallel rollout workers, each with its own sumo")
+    optParser.add_option("--record", metavar="DIR",
+                         help="write all transitions to this dataset directory for offline.py")
+    optParser.add_option("--reward", default=REWARD,
+                         help="reward terms and weights as name:weight,... [default: %default]")
+    optParser.add_option("--grid", metavar="ROWSxCOLS",
+                         help="control a generated grid network of this size instead of data/cross.net.xml")
+    optParser.add_option("--backend", type="choice", choices=["numpy", "keras"], default="numpy",
+                         help="implementation of the Q-network [default: %default]")
+    optParser.add_option("--hidden", default="",
+                         help="comma separated hidden layer sizes, e.g. 32 or 64,32 [default: none]")
+    optParser.add_option("--target-period", type="int", default=10,
+                         help="steps between target network updates [default: %default]")
+    optParser.add_option("--tau", type="float", default=1.0,
+                         help="fraction of the online weights blended into the target per update, "
+                              "1 copies them [default: %default]")
+    optParser.add_option("--transport", type="choice", choices=["socket", "libsumo"], default="socket",
+                         help="talk to sumo over a socket or run it in this process [default: %default]")
+    optParser.add_option("--reset", type="choice", choices=["remove", "snapshot", "pool"], default="remove",
+                         help="start episodes by removing all vehicles, from one saved state or from a pool of them [default: %default]")
+    optParser.add_option("--warmup", type="int", default=300,
+                         help="simulation steps before the first saved state [default: %default]")
+    optParser.add_option("--pool-size", type="int", default=8,
+                         help="number of saved states to start episodes from [default: %default]")
+    optParser.add_option("--checkpoint", metavar="DIR",
+                         help="save the training state to this directory while running")
+    optParser.add_option("--checkpoint-interval", type="int", default=10,
+                         help="iterations between checkpoints [default: %default]")
+    optParser.add_option("--resume", action="store_true", default=False,
+                         help="continue from the latest checkpoint in the --checkpoint directory")
+    optParser.add_option("--profile", action="store_true", default=False,
+                         help="print the time spent in each phase of a step and the TraCI calls per step")
+    optParser.add_option("--profile-trace", metavar="FILE",
+                         help="also write the phases to FILE, a Chrome trace if it ends with .json, "
+                              "JSON lines otherwise")
+    optParser.add_option("--profile-interval", type="int", default=1,
+                         help="iterations per profile summary [default: %default]")
+    optParser.add_option("--pipeline", action="store_true", default=False,
+                         help="train on a background thread while sumo steps, see pipeline.py")
+    optParser.add_option("--update-ratio", type="float", default=1.0,
+                         help="updates with --pipeline relative to the sequential loop, 2 trains twice as "
+                              "often on the same data [default: %default]")
+    optParser.add_option("--snapshot-interval", type="int", default=15,
+                         help="steps between refreshes of the acting networks with --pipeline [default: %default]")
     options, args = optParser.parse_args()
+    if options.resume and not options.checkpoint:
+        optParser.error("--resume needs --checkpoint DIR")
+    if options.workers > 0 and options.agents == "independent":
+        optParser.error("--workers trains one shared network, it does not support --agents independent")
+    options.hidden = tuple(int(n) for n in options.hidden.split(",") if n)
+    if options.grid:
+        try:
+            options.grid = tuple(int(n) for n in options.grid.split("x"))
+        except ValueError:
+            optParser.error("--grid expects ROWSxCOLS, for example 10x10")
     return options
 
 
@@ -275,9 +361,29 @@ if __name__ == "__main__":
     else:
         sumoBinary = checkBinary('sumo')
 
+    if options.workers > 0:
+        # every worker starts its own sumo on a free port
+        generate_routefile()
+        print(workers.train(options.workers, sumoBinary, episodes=1000, history_len=options.history_len,
+                            replay=options.replay, backend=options.backend, target_period=options.target_period,
+                            tau=options.tau, hidden=options.hidden))
+        sys.exit()
+
     # this is the normal way of using traci. sumo is started as a
-    # subprocess and then the python script connects and runs
-    sumoProcess = subprocess.Popen([sumoBinary, "-c", "data/cross.sumocfg", "--tripinfo-output",
-                                    "tripinfo.xml", "--remote-port", str(PORT)], stdout=sys.stdout, stderr=sys.stderr)
-    run()
-    sumoProcess.wait()
+    # subprocess and then the python script connects and runs, with
+    # --transport libsumo it runs in this process instead
+    if options.grid:
+        config = gridnet.generate(options.grid[0], options.grid[1], checkBinary('netconvert'))
+    else:
+        generate_routefile()
+        config = connection.CONFIG
+    conn, sumoProcess = connection.launch(options.transport, sumoBinary, PORT, ["--tripinfo-output", "tripinfo.xml"],
+                                          config=config)
+    run(options.replay, options.agents, options.history_len,
+        options.record, options.reset, options.warmup, options.pool_size,
+        options.reward, options.grid, options.backend, options.hidden,
+        options.target_period, options.tau, options.checkpoint, options.checkpoint_interval,
+        options.resume, options.profile, options.profile_trace, options.profile_interval, options.pipeline,
+        options.update_ratio, options.snapshot_interval, index=networkIndex(options), conn=conn)
+    if sumoProcess:
+        sumoProcess.wait()
@@ -29,6 +29,14 @@ import subprocess
 import random
 import time
 import numpy as np
+import demand
+from collector import StateCollector
+from rewards import Rewards
+from observation import ObservationEncoder
+from dataset import TransitionRecorder
+import connection
+import netindex
+from episodes import EpisodeReset, stateDirectory
 from qlearning import DeepQ
 from qlearning import ExperienceReplay
 
@@ -40,10 +48,21 @@ try:
         os.path.dirname(__file__), "..", "..", "..")), "tools"))  # tutorial in docs
     from sumolib import checkBinary
 except ImportError:
-    sys.exit(
-        "please declare environment variable 'SUMO_HOME' as the root directory of your sumo installation (it should contain folders 'bin', 'tools' and 'docs')")
+    # run works on a connection passed in, e.g. mocksumo, without SUMO
+    def checkBinary(name):
+        sys.exit(
+            "please declare environment variable 'SUMO_HOME' as the root directory of your sumo installation (it should contain folders 'bin', 'tools' and 'docs')")
+
+try:
+    import traci
+except ImportError:
+    traci = None
+
+try:
+    xrange
+except NameError:
+    xrange = range
 
-import traci
 # the port used for communicating with your sumo instance
 PORT = 8872
 
@@ -51,23 +70,7 @@ startTime = {}
 
 def generate_routefile():
     random.seed(42)  # make tests reproducible
-    N = 360000  # number of time steps
-    p = "0.009" #probability of generating car
-    # demand per second from different directions
-    pWE = 1. / 10
-    pEW = 1. / 10
-    pNS = 1. / 20
-    pSN = 1. / 20
-    with open("data/cross.rou.xml", "w") as routes:
-        print("""<routes>
-        <vType id="typeWE" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>
-        <vType id="typeNS" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>""", file=routes)
-        for i in range(8):
-            for j in range(8):
-                if i == j:
-                    continue
-                print('    <flow id="%i" begin="0" end="%i" probability="%s" type="typeWE" from="%ii" to="%io"/>' % (i * 8 + j, N, p, i, j), file=routes)
-        print("</routes>", file=routes)
+    demand.generate(demand.SHORTCYCLE)
 
 # The program looks like this
 #    <tlLogic id="0" type="static" programID="0" offset="0">
@@ -78,132 +81,105 @@ def generate_routefile():
 #        <phase duration="6"  state="ryry"/>
 #    </tlLogic>
 
-def actionState(l):
-    actions = []
-    if traci.trafficlights.getPhase(l) % 2 == 0:
-        # we are not already switching
-        actions.append(0)
-        actions.append(1)
-    return actions
-
-def setState(light, action):
-    #0 is default state, 1 is other state
-    s = traci.trafficlights.getPhase(light)
-    if action == 0:
-        if s == 0:
-            traci.trafficlights.setPhase(light, 0)
-        else:
-            traci.trafficlights.setPhase(light, 3)
-            return 1
-    if action == 1:
-        if s == 2:
-            traci.trafficlights.setPhase(light, 2)
-        else:
-            traci.trafficlights.setPhase(light, 1)
-            return 1
-    return 0
+# which phases are decisions and how actions switch comes from
+# netindex.PhaseTable, for this program action 0 asks for phase 0 and
+# action 1 for phase 2, each through the yellow phase before it
+
+
+def networkIndex(options):
+    """the netindex.NetIndex of the network the options control"""
+    return netindex.load(netindex.NET_FILE, netindex.DETECTOR_FILE)
 
 e = 1
 
-def getReward(changed):
-    lanes = traci.lane.getIDList()
-    s = 0.0
-    for l in lanes:
-        q, w, speed = 0, 0, 0
-        for c in traci.lane.getLastStepVehicleIDs(l):
-            if traci.vehicle.getWaitingTime(c) > 0:
-                q += 1
-            speed += traci.vehicle.getSpeed(c)
-        speed /= max(1, len(traci.lane.getLastStepVehicleIDs(l))) * 10
-        w = traci.lane.getWaitingTime(l)
-        #s -= 1 * (q) ** 1.5 + 2 * (w) ** 1.5 - speed ** 1.5
-        s += speed
-    #s /= max(len(traci.vehicle.getIDList()), 1)
-    #for l in lanes:        
-        #s -= traci.lane.getCO2Emission(l) / 10000.0
-    #s -= changed
-    return s
-
-def getCO2():
-    s = 0
-    for l in traci.lane.getIDList():
-        s += traci.lane.getCO2Emission(l)
-    return s
-
-def getWaitingTime():
-    s = 0
-    for l in traci.lane.getIDList():
-        for c in traci.lane.getLastStepVehicleIDs(l):
-            if traci.vehicle.getWaitingTime(c) > 0:
-                s += 1
-    return s
-
-
-def step(lights, loops, history, cars_detected, actions):
-    light_state = [0] * len(lights)
-    cars_total = [0] * len(loops)
+# reward terms and their weights, see rewards.TERMS
+REWARD = "speed:0.1"
+# the waiting time metric: number of waiting cars
+WAITING = "halting"
+
+
+def step(collector, encoder, rewards, actions, phases):
     changed = 0
-    for l in lights:
-        changed += setState(l, actions[int(l)])
+    for k, l in enumerate(collector.lights):
+        changed += phases.setState(traci, l, k, actions[k], collector.phase[k])
     traci.simulationStep()
-    for l in lights:
-        light_state[int(l)] = traci.trafficlights.getPhase(l)
-        history[int(l)].append(traci.trafficlights.getPhase(l))
-        history[int(l)].pop(0)
-    for i in loops:
-        cars_detected[int(i)].append(traci.inductionloop.getLastStepVehicleNumber(i))
-        cars_detected[int(i)].pop(0)
-        cars_total[int(i)] = sum(cars_detected[int(i)])
-    ss = np.append(cars_total, light_state)
-    ss = np.append(ss, sum(history, []))
-    cars = traci.vehicle.getIDList()
-    r = getReward(changed)
-    #for c in cars:
+    collector.update()
+    ss = encoder.update(collector.phase, collector.loop_vehicles)
+    r = rewards.evaluate(collector, changed)
+    #for c in traci.vehicle.getIDList():
         #travel_time = traci.simulation.getCurrentTime() / 1000 - startTime[c]
         #r -= travel_time
-    return ss, r, cars_detected, history
-
-
-def run():
-    """execute the TraCI control loop"""
-    # first, generate the route file for this simulation
-    #generate_routefile()
-    traci.init(PORT)
-    loops = traci.inductionloop.getIDList()
-    lights = traci.trafficlights.getIDList()
-    history_len = 15
-    input_size = len(loops) + len(lights) + history_len * len(lights)
-    num_actions = 2
-    maxSteps = 500
-    total_steps = 0
-    totalCO2, totalWaitingTime = [0] * 1000, [0] * 1000
-    for iteration in xrange(0, 1000):
-        R, t = 0, 0
-        cars_detected = [[0 for i in range(20)] for j in range(len(loops))]
-        history = [[0 for i in range(history_len)] for j in range(len(lights))]
-        s = [0] * (input_size)
-        actions = [0] * len(lights)
-        for l in lights:
-            traci.trafficlights.setPhase(l, 0)
-        while t < maxSteps:
-            for l in lights:   
-                a = traci.trafficlights.getPhase(l) / 2
-                if t % 15 == 0:
-                    a = 1 - a
-                if len(actionState(l)) == 0:
-                    a = -1
-                actions[int(l)] = a
-            ss, r, cars_detected, history = step(lights, loops, history, cars_detected, actions)
-            R += r
-            totalWaitingTime[iteration] += getWaitingTime()
-            totalCO2[iteration] += getCO2()
-            t += 1
-            total_steps += 1
-            s = ss
-        print('Iteration %i completed with Average CO2: %d and Average waiting time %d reward %i' % (iteration, sum(totalCO2) / total_steps, sum(totalWaitingTime) / total_steps, R))
-        for car in traci.vehicle.getIDList():
-            traci.vehicle.remove(car)
-    traci.close()
+    return ss, r
+
+
+def run(history_len=15, detector_window=20, record=None, reset="remove", warmup=300,
+        pool_size=8, reward=REWARD, iterations=1000, index=None, conn=None):
+    """execute the TraCI control loop, on conn if given
+
+    index is the netindex.NetIndex of the network, without it the ids come
+    from the simulation and every light runs netindex.STANDARD.
+    """
+    global traci
+    # the module level traci is rebound to the connection of this run,
+    # later users get the previous one back
+    previous = traci
+    try:
+        # first, generate the route file for this simulation
+        generate_routefile()
+        if conn is not None:
+            # all functions of this module talk to the traci name
+            traci = conn
+        elif not connection.isEmbedded():
+            traci.init(PORT)
+        if index is None:
+            collector = StateCollector(traci)
+        else:
+            collector = StateCollector(traci, index.lanes, index.loops, index.lights)
+        rewards = Rewards(reward, ("co2", WAITING))
+        loops = collector.loops
+        lights = collector.lights
+        phases = netindex.standard(len(lights)) if index is None else index.phaseTable()
+        encoder = ObservationEncoder(len(lights), len(loops), history_len, detector_window, loops=True)
+        input_size = encoder.input_size
+        recorder = TransitionRecorder(record, input_size) if record else None
+        episodes = EpisodeReset(traci, reset, stateDirectory(), warmup, pool_size)
+        num_actions = 2
+        maxSteps = 500
+        total_steps = 0
+        totalCO2, totalWaitingTime = [0] * iterations, [0] * iterations
+        for iteration in xrange(0, iterations):
+            R, t = 0, 0
+            episodes.reset()
+            s = encoder.reset()
+            actions = [0] * len(lights)
+            for k in range(len(lights)):
+                collector.setPhase(k, phases.greens[k, 0])
+            while t < maxSteps:
+                for k in range(len(lights)):
+                    # the action that keeps the current green, -1 while switching
+                    a = phases.action[k, collector.phase[k]]
+                    if t % 15 == 0 and a != -1:
+                        a = (a + 1) % num_actions
+                    actions[k] = a
+                ss, r = step(collector, encoder, rewards, actions, phases)
+                R += r
+                if recorder and t % 15 == 0:
+                    # the switching decisions of the cycle, as the learners see them
+                    for k in range(len(lights)):
+                        if actions[k] != -1:
+                            recorder.record(s, actions[k], r, ss)
+                totalWaitingTime[iteration] += rewards.value(WAITING)
+                totalCO2[iteration] += rewards.value("co2")
+                t += 1
+                total_steps += 1
+                s = ss
+            print('Iteration %i completed with Average CO2: %d and Average waiting time %d reward %i' % (iteration, sum(totalCO2) / total_steps, sum(totalWaitingTime) / total_steps, R))
+        if recorder:
+            recorder.close()
+        episodes.close()
+        traci.close()
+    finally:
+        traci = previous
     sys.stdout.flush()
 
 
@@ -211,6 +187,22 @@ def get_options():
     optParser = optparse.OptionParser()
     optParser.add_option("--nogui", action="store_true",
                          default=False, help="run the commandline version of sumo")
+    optParser.add_option("--history-len", type="int", default=15,
+                         help="number of past phases per light in the observation [default: %default]")
+    optParser.add_option("--detector-window", type="int", default=20,
+                         help="steps the detector counts are summed over [default: %default]")
+    optParser.add_option("--record", metavar="DIR",
+                         help="write all transitions to this dataset directory for offline.py")
+    optParser.add_option("--reward", default=REWARD,
+                         help="reward terms and weights as name:weight,... [default: %default]")
+    optParser.add_option("--transport", type="choice", choices=["socket", "libsumo"], default="socket",
+                         help="talk to sumo over a socket or run it in this process [default: %default]")
+    optParser.add_option("--reset", type="choice", choices=["remove", "snapshot", "pool"], default="remove",
+                         help="start episodes by removing all vehicles, from one saved state or from a pool of them [default: %default]")
+    optParser.add_option("--warmup", type="int", default=300,
+                         help="simulation steps before the first saved state [default: %default]")
+    optParser.add_option("--pool-size", type="int", default=8,
+                         help="number of saved states to start episodes from [default: %default]")
     options, args = optParser.parse_args()
     return options
 
@@ -227,8 +219,12 @@ if __name__ == "__main__":
         sumoBinary = checkBinary('sumo')
 
     # this is the normal way of using traci. sumo is started as a
-    # subprocess and then the python script connects and runs
-    sumoProcess = subprocess.Popen([sumoBinary, "-c", "data/cross.sumocfg", "--tripinfo-output",
-                                    "tripinfo.xml", "--remote-port", str(PORT)], stdout=sys.stdout, stderr=sys.stderr)
-    run()
-    sumoProcess.wait()
+    # subprocess and then the python script connects and runs, with
+    # --transport libsumo it runs in this process instead
+    generate_routefile()
+    conn, sumoProcess = connection.launch(options.transport, sumoBinary, PORT, ["--tripinfo-output", "tripinfo.xml"])
+    run(options.history_len, options.detector_window,
+        options.record, options.reset, options.warmup, options.pool_size,
+        options.reward, index=networkIndex(options), conn=conn)
+    if sumoProcess:
+        sumoProcess.wait()
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+"""
+Vectorized macroscopic stand-in for SUMO on the cross network.
+
+Network takes the lanes, connections, traffic light programs and induction
+loops of the net and detector file from netindex, Demand the flows of the
+route file.
+SurrogateEnv steps many independent copies of the network at once with a
+cell transmission model (Daganzo 1994): every lane is cut into cells a
+vehicle passes in one second at free speed and in each step a cell sends
+as much as the next one can receive. A lane end splits its flow onto the
+outgoing connections by turning fractions derived from the routes and only
+passes on green. All state is held in (cells x copies) arrays, so one step
+costs about the same for one copy as for a thousand.
+
+On top sits the interface of runner.step: actions switch the phases like
+netindex.PhaseTable.setState, the observation comes from an
+ObservationEncoder and the reward from rewards.Rewards on per lane
+vehicles, mean speed, halting vehicles, waiting time and CO2 in the layout
+of StateCollector.lane_values.
+It is a model and not SUMO, pretrain DeepQ or Linear on it and fine-tune
+in SUMO with runner.py --checkpoint DIR --resume.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+import heapq
+import optparse
+import time
+import numpy as np
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+import demand
+import netindex
+from netindex import NET_FILE, DETECTOR_FILE
+from env import REWARD
+from mocksumo import IDLE_CO2, CO2_PER_SPEED
+from observation import ObservationEncoder
+from rewards import Rewards, QUANTITIES
+
+# SUMO defaults of a passenger car
+MAX_SPEED = 55.55
+SPACING = 7.5  # length + minGap
+
+
+def laneEdge(lane):
+    return lane.rsplit("_", 1)[0]
+
+
+class Network:
+    """Lanes, connections, programs and loops of a net and detector file.
+
+    The arrays of netindex.load without the internal lanes, lanes, lights
+    and loops sorted by id like the getIDList results of SUMO. Connections
+    go from lane to lane.
+    """
+    def __init__(self, netFile=NET_FILE, detectorFile=DETECTOR_FILE):
+        self.index = index = netindex.load(netFile, detectorFile)
+        keep = np.flatnonzero(~index.lane_internal)
+        position = np.full(len(index.lanes), -1, dtype=np.int64)
+        position[keep] = np.arange(len(keep))
+        self.lanes = [index.lanes[i] for i in keep]
+        self.length = index.lane_length[keep]
+        self.speed = index.lane_speed[keep]
+        self.lights = index.lights
+        self.link_from = position[index.link_from]
+        self.link_to = position[index.link_to]
+        # connections without a light get the extra always green program
+        self.link_light = np.where(index.link_light < 0, len(self.lights), index.link_light)
+        self.link_index = np.maximum(index.link_index, 0)
+        self.num_phases = index.num_phases
+        self.durations = index.durations
+        self.phases = index.phaseTable()
+        states = index.phase_states
+        links = max([len(state) for state in states.ravel()] or [1])
+        self.green = np.ones((len(self.lights) + 1, states.shape[1], links), dtype=bool)
+        for k in range(len(self.lights)):
+            for p, state in enumerate(states[k, :self.num_phases[k]]):
+                self.green[k, p, :len(state)] = [c in "Gg" for c in state]
+        loops = np.flatnonzero(position[index.loop_lane] >= 0)
+        self.loops = [index.loops[i] for i in loops]
+        self.loop_lane = position[index.loop_lane[loops]]
+        self.loop_pos = index.loop_pos[loops]
+
+    def route(self, origin, destination):
+        """shortest lane sequence from edge origin to edge destination, None if there is none"""
+        successors = {}
+        for a, b in zip(self.link_from, self.link_to):
+            successors.setdefault(a, []).append(b)
+        queue = [(0.0, i, (i, )) for i, l in enumerate(self.lanes) if laneEdge(l) == origin]
+        heapq.heapify(queue)
+        done = set()
+        while queue:
+            distance, lane, path = heapq.heappop(queue)
+            if lane in done:
+                continue
+            done.add(lane)
+            if laneEdge(self.lanes[lane]) == destination:
+                return path
+            for n in successors.get(lane, ()):
+                if n not in done:
+                    heapq.heappush(queue, (distance + self.length[n], n, path + (n, )))
+        return None
+
+
+class Demand:
+    """Arrival rates per origin lane over time and turning fractions per connection.
+
+    The rates are piecewise constant between the flow begin and end times.
+    The turning fractions average all flows of the file, weighted by their
+    number of vehicles, along the shortest route of each flow.
+    """
+    def __init__(self, network, routeFile=demand.ROUTE_FILE):
+        vtypes = {}
+        events = []
+        volumes = {}
+        used = {}
+        for event, elem in ET.iterparse(routeFile):
+            if elem.tag == "vType":
+                vtypes[elem.get("id")] = (float(elem.get("maxSpeed", MAX_SPEED)),
+                                          float(elem.get("length", 5.0)) + float(elem.get("minGap", 2.5)))
+            elif elem.tag == "flow":
+                begin = float(elem.get("begin", 0))
+                end = float(elem.get("end", 86400))
+                if elem.get("probability"):
+                    rate = float(elem.get("probability"))
+                elif elem.get("vehsPerHour"):
+                    rate = float(elem.get("vehsPerHour")) / 3600.0
+                else:
+                    rate = 1.0 / float(elem.get("period", 1))
+                od = (elem.get("from"), elem.get("to"))
+                events.append((begin, rate, od[0]))
+                events.append((end, -rate, od[0]))
+                volumes[od] = volumes.get(od, 0.0) + rate * (end - begin)
+                vtype = elem.get("type", "DEFAULT_VEHTYPE")
+                used[vtype] = used.get(vtype, 0.0) + rate * (end - begin)
+                elem.clear()
+        total = sum(used.values()) or 1.0
+        self.max_speed = sum(vtypes.get(v, (MAX_SPEED, SPACING))[0] * n for v, n in used.items()) / total or MAX_SPEED
+        self.spacing = sum(vtypes.get(v, (MAX_SPEED, SPACING))[1] * n for v, n in used.items()) / total or SPACING
+        # a flow enters on all lanes of its edge
+        edgeLanes = {}
+        for i, l in enumerate(network.lanes):
+            edgeLanes.setdefault(laneEdge(l), []).append(i)
+        self.origins = np.array(sorted(set(i for t, r, e in events for i in edgeLanes.get(e, ()))), dtype=np.int64)
+        column = dict((o, k) for k, o in enumerate(self.origins))
+        self.times = np.array(sorted(set(t for t, r, e in events)))
+        change = np.zeros((len(self.times), len(self.origins)))
+        for t, r, e in events:
+            for i in edgeLanes.get(e, ()):
+                change[np.searchsorted(self.times, t), column[i]] += r / len(edgeLanes[e])
+        # row 0 is before the first flow begins
+        self.rates = np.vstack([np.zeros((1, len(self.origins))), np.maximum(np.cumsum(change, axis=0), 0)])
+        through = np.zeros(len(network.link_from))
+        link = dict(((a, b), k) for k, (a, b) in enumerate(zip(network.link_from, network.link_to)))
+        for (origin, destination), volume in volumes.items():
+            path = network.route(origin, destination)
+            if path is None:
+                continue
+            for a, b in zip(path[:-1], path[1:]):
+                through[link[a, b]] += volume
+        out = np.bincount(network.link_from, weights=through, minlength=len(network.lanes))
+        self.turning = np.where(through > 0, through / np.maximum(out[network.link_from], 1e-12), 0.0)
+
+    def arrivalRates(self, t):
+        """(copies x origins) vehicles per second at the times t of the copies"""
+        return self.rates[np.searchsorted(self.times, t, side="right")]
+
+
+class SurrogateEnv:
+    """copies independent simulations of network and demand behind the runner.step interface
+
+    reset and step return (copies x input_size) observations, step takes
+    (copies x lights) actions, -1 for no change, and returns one reward per
+    copy. phase holds the current phases like StateCollector.phase, one row
+    per copy, lane_values the lane quantities like StateCollector.lane_values
+    with a last axis over the copies. The traffic state is kept as (cells x
+    copies) so every gather along the network takes whole rows. capacity is
+    the saturation flow of a lane in vehicles per second and wave_speed the
+    speed of the backward wave in a jam.
+    """
+    def __init__(self, copies=1000, network=None, demand=None, history_len=5, loops=False, detector_window=20,
+                 decision_interval=15, reward=REWARD, capacity=0.5, wave_speed=5.0, episode_length=500,
+                 warmup=300, seed=None):
+        self.network = network = network or Network()
+        self.demand = demand = demand or Demand(network)
+        self.copies = copies
+        self.lights = network.lights
+        self.num_lights = len(self.lights)
+        self.num_actions = 2
+        self.decision_interval = decision_interval
+        self.episode_length = episode_length
+        self.warmup = warmup
+        self.random = np.random.RandomState(seed)
+        self.capacity = capacity
+        speed = np.minimum(network.speed, demand.max_speed)
+        cells = np.maximum(1, np.round(network.length / speed)).astype(np.int64)
+        self.lane_first = np.concatenate([[0], np.cumsum(cells)[:-1]])
+        self.lane_last = lane_last = self.lane_first + cells - 1
+        self.cell_length = np.repeat(network.length / cells, cells)
+        self.jam = (self.cell_length / demand.spacing)[:, None]
+        self.delta = np.repeat(np.minimum(1.0, wave_speed / speed), cells)[:, None]
+        # only connections some route uses, a lane without one is a sink
+        active = np.flatnonzero(demand.turning > 0)
+        active = active[np.argsort(network.link_from[active], kind="stable")]
+        self.link_from_cell = lane_last[network.link_from[active]]
+        self.link_light = network.link_light[active]
+        self.link_index = network.link_index[active]
+        self.turning = demand.turning[active]
+        approaches, starts = np.unique(network.link_from[active], return_index=True)
+        self.approach_cells = lane_last[approaches]
+        self.link_starts = starts
+        self.sink_cells = lane_last[np.setdiff1d(np.arange(len(network.lanes)), approaches)]
+        self.to_cells, column = np.unique(self.lane_first[network.link_to[active]], return_inverse=True)
+        self.link_to_column = column.reshape(-1)
+        self.merge = np.zeros((len(active), len(self.to_cells)))
+        self.merge[np.arange(len(active)), self.link_to_column] = 1
+        self.origin_cells = self.lane_first[demand.origins]
+        loop_cells = np.minimum((network.loop_pos / network.length[network.loop_lane] * cells[network.loop_lane])
+                                .astype(np.int64), cells[network.loop_lane] - 1)
+        self.loop_cells = self.lane_first[network.loop_lane] + loop_cells
+        self.n = np.zeros((cells.sum(), copies))
+        self.y = np.zeros((cells.sum(), copies))
+        self.send = np.zeros((cells.sum(), copies))
+        self.receive = np.zeros((cells.sum(), copies))
+        self.queued = np.zeros((len(demand.origins), copies))
+        self.time = np.zeros(copies)
+        self.phase_all = np.zeros((copies, self.num_lights + 1), dtype=np.int64)
+        self.phase = self.phase_all[:, :self.num_lights]
+        self.phase_time = np.zeros((copies, self.num_lights))
+        self.lane_values = np.zeros((len(QUANTITIES), len(network.lanes), copies))
+        (self.lane_vehicles, self.lane_speed, self.lane_halting, self.lane_waiting,
+         self.lane_co2) = self.lane_values
+        self.loop_vehicles = np.zeros((copies, len(network.loops)))
+        self.rewards = Rewards(reward, ("co2", "halting", "waiting"))
+        self.encoder = ObservationEncoder(self.num_lights, len(network.loops), history_len, detector_window, loops,
+                                          copies=copies)
+        self.input_size = self.encoder.input_size
+        self.t = 0
+        self.warm = False
+
+    def reset(self):
+        """starts an episode in all copies, the traffic keeps running like TrafficEnv without reset
+
+        The first reset picks a random demand time for every copy and lets
+        the programs run for warmup steps.
+        """
+        if not self.warm:
+            horizon = self.demand.times[-1] if len(self.demand.times) else 0
+            last = max(0, min(horizon, 1e6) - self.episode_length - self.warmup)
+            self.time[:] = np.floor(self.random.uniform(0, last, size=self.copies))
+            for t in range(self.warmup):
+                self.advance()
+                self.move()
+            self.warm = True
+        self.t = 0
+        self.phase[:] = self.network.phases.greens[:, 0]
+        self.phase_time[:] = 0
+        return self.encoder.reset()
+
+    def decisions(self):
+        """(copies x lights) mask of the lights that may pick an action in this step"""
+        if self.t % self.decision_interval != 0:
+            return np.zeros(self.phase.shape, dtype=bool)
+        return self.network.phases.decisions(self.phase)
+
+    def switch(self, actions):
+        """PhaseTable.setState for all lights of all copies, returns the switches per copy"""
+        phases, changed = self.network.phases.switch(self.phase, actions)
+        np.copyto(self.phase, phases)
+        self.phase_time[actions >= 0] = 0
+        return changed.sum(axis=1)
+
+    def advance(self):
+        """one second of the traffic light programs"""
+        self.phase_time += 1
+        rows = np.arange(self.num_lights)
+        done = self.phase_time >= self.network.durations[rows, self.phase]
+        self.phase[done] = ((self.phase + 1) % self.network.num_phases)[done]
+        self.phase_time[done] = 0
+
+    def move(self):
+        """one second of the cell transmission model, returns the flows out of every cell"""
+        n, y = self.n, self.y
+        send = np.minimum(n, self.capacity, out=self.send)
+        receive = np.subtract(self.jam, n, out=self.receive)
+        receive *= self.delta
+        np.clip(receive, 0, self.capacity, out=receive)
+        # every cell passes on to the next one, the lane ends are overwritten below
+        np.minimum(send[:-1], receive[1:], out=y[:-1])
+        green = self.network.green[self.link_light[:, None], self.phase_all.T[self.link_light],
+                                   self.link_index[:, None]]
+        turning = self.turning[:, None]
+        wanted = send[self.link_from_cell] * turning * green
+        demanded = self.merge.T.dot(wanted)
+        # merging turns share what the next lane receives in proportion to their demand
+        share = np.minimum(1.0, receive[self.to_cells] / np.maximum(demanded, 1e-12))
+        factor = share[self.link_to_column] * green
+        # first in first out: an approach moves no more than its most restricted turn allows
+        y[self.approach_cells] = send[self.approach_cells] * np.minimum.reduceat(factor, self.link_starts, axis=0)
+        y[self.sink_cells] = send[self.sink_cells]
+        flows = y[self.link_from_cell] * turning
+        self.queued += self.random.poisson(self.demand.arrivalRates(self.time).T)
+        entering = np.minimum(self.queued, receive[self.origin_cells])
+        self.queued -= entering
+        # the vehicles on each lane during the step
+        self.present = np.add.reduceat(n, self.lane_first, axis=0)
+        n -= y
+        n[1:] += y[:-1]
+        # what left a lane end went to the connections, not to the next lane in memory
+        n[self.lane_first[1:]] -= y[self.lane_last[:-1]]
+        n[self.to_cells] += self.merge.T.dot(flows)
+        n[self.origin_cells] += entering
+        self.time += 1
+
+    def measure(self):
+        """fills lane_values and loop_vehicles from the last move"""
+        first = self.lane_first
+        y = self.y
+        present = self.present
+        moved = np.add.reduceat(y * self.cell_length[:, None], first, axis=0)
+        halting = present - np.add.reduceat(y, first, axis=0)
+        self.lane_vehicles[:] = np.add.reduceat(self.n, first, axis=0)
+        occupied = np.maximum(present, 1e-9)
+        self.lane_speed[:] = np.where(present > 1e-9, moved / occupied, 0)
+        # vehicles that move lose their waiting time
+        self.lane_waiting *= np.where(present > 1e-9, halting / occupied, 0)
+        self.lane_waiting += halting
+        self.lane_halting[:] = halting
+        self.lane_co2[:] = IDLE_CO2 * present + CO2_PER_SPEED * moved
+        self.loop_vehicles[:] = y[self.loop_cells].T
+
+    def step(self, actions):
+        """actions holds one row of actions per copy, returns the observations and the rewards"""
+        changed = self.switch(np.asarray(actions))
+        self.advance()
+        self.move()
+        self.measure()
+        self.t += 1
+        ss = self.encoder.update(self.phase, self.loop_vehicles)
+        return ss, self.rewards.evaluateBatch(self.lane_values, changed)
+
+
+def selectActions(env, qValues, policy, s):
+    """one action per light and copy, every light observes the whole observation like in runner.run"""
+    lights = np.tile(np.arange(env.num_lights), env.copies)
+    states = np.repeat(s, env.num_lights, axis=0)
+    actions = policy.act(lambda rows, x: qValues(lights[rows], x), states, env.phase.reshape(-1), env.t)
+    return actions.reshape(env.copies, env.num_lights), lights, states
+
+
+def pretrainDQN(env, agents, policy, steps, batch_size=32, discount=0.9, target_period=10):
+    """trains agents.DQNAgents on env like runner.run, every copy adds its transitions
+
+    As in runner.run only the lights that decided train, one update per
+    transition, and steps without a decision do not train at all.
+    """
+    s = env.reset()
+    for step in range(steps):
+        if env.t == env.episode_length:
+            s = env.reset()
+        actions = selectActions(env, agents.getQValues, policy, s)[0]
+        ss, r = env.step(actions)
+        copies, lights = np.nonzero(actions != -1)
+        if len(copies):
+            agents.rememberBatch(lights, s[copies], actions[copies, lights], r[copies], ss[copies])
+            if step % target_period == 0:
+                agents.updateTarget()
+            agents.train(lights, batch_size, discount)
+        s = ss
+
+
+def pretrainLinear(env, agents, policy, steps, discount=0.9):
+    """trains linearreg.LinearAgents on env like linear.run"""
+    s = env.reset()
+    for step in range(steps):
+        if env.t == env.episode_length:
+            s = env.reset()
+        actions, lights, states = selectActions(env, agents.getQValues, policy, s)
+        ss, r = env.step(actions)
+        a = actions.reshape(-1)
+        a[a < 0] = env.num_actions - 1
+        # one update per step of the size of one simulation's, not copies times larger
+        agents.trainBatch(lights, states, a, np.repeat(r, env.num_lights), np.repeat(ss, env.num_lights, axis=0),
+                          discount, 1.0 / env.copies)
+        s = ss
+
+
+def throughput(env, steps):
+    """env steps per second of all copies under the fixed programs"""
+    env.reset()
+    actions = np.full((env.copies, env.num_lights), -1, dtype=np.int64)
+    begin = time.time()
+    for t in range(steps):
+        env.step(actions)
+    return steps * env.copies / (time.time() - begin)
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--copies", type="int", default=1000, help="simulations stepped at once [default: %default]")
+    optParser.add_option("--steps", type="int", default=1000, help="steps of every copy [default: %default]")
+    optParser.add_option("--demand", type="choice", choices=["runner", "linear", "shortcycle"], default="runner",
+                         help="demand profile to generate the route file from [default: %default]")
+    optParser.add_option("--pretrain", metavar="DIR",
+                         help="train a controller and write a checkpoint to DIR, continue in sumo with "
+                              "--checkpoint DIR --resume and the same network options")
+    optParser.add_option("--agent", type="choice", choices=["dqn", "linear"], default="dqn",
+                         help="controller to pretrain, runner.py or linear.py [default: %default]")
+    optParser.add_option("--agents", type="choice", choices=["shared", "independent"], default="shared",
+                         help="one network for all lights or one per light [default: %default]")
+    optParser.add_option("--replay", type="choice", choices=["uniform", "prioritized"], default="uniform",
+                         help="experience replay sampling [default: %default]")
+    optParser.add_option("--backend", type="choice", choices=["numpy", "keras"], default="numpy",
+                         help="implementation of the Q-network [default: %default]")
+    optParser.add_option("--hidden", default="", help="comma separated hidden layer sizes [default: none]")
+    optParser.add_option("--seed", type="int", default=42, help="seed of the arrivals and the learner")
+    options, args = optParser.parse_args()
+    options.hidden = tuple(int(n) for n in options.hidden.split(",") if n)
+    return options
+
+
+if __name__ == "__main__":
+    options = get_options()
+    np.random.seed(options.seed)
+    demand.generate({"runner": demand.RUNNER, "linear": demand.LINEAR, "shortcycle": demand.SHORTCYCLE}[options.demand])
+    network = Network()
+    flows = Demand(network)
+    if not options.pretrain:
+        env = SurrogateEnv(options.copies, network, flows, seed=options.seed)
+        print('%i copies: %.0f env-steps/s' % (options.copies, throughput(env, options.steps)))
+        sys.exit()
+    import checkpoint
+    from policy import EpsilonGreedy
+    if options.agent == "dqn":
+        # the observation and the learner of runner.run
+        from agents import DQNAgents
+        env = SurrogateEnv(options.copies, network, flows, history_len=5, seed=options.seed)
+        policy = EpsilonGreedy(env.num_actions, decay=0.9998, legal=network.phases.legal)
+        learner = DQNAgents(env.num_lights, env.input_size, env.num_actions, options.agents, options.replay,
+                            backend=options.backend, hidden=options.hidden)
+        train = lambda: pretrainDQN(env, learner, policy, options.steps)
+    else:
+        # the observation and the learner of linear.run
+        from linearreg import LinearAgents
+        env = SurrogateEnv(options.copies, network, flows, history_len=10, loops=True, detector_window=20,
+                           seed=options.seed)
+        policy = EpsilonGreedy(env.num_actions, decay=0.9999, legal=network.phases.legal)
+        learner = LinearAgents(env.num_lights, env.input_size, env.num_actions, shared=options.agents == "shared")
+        train = lambda: pretrainLinear(env, learner, policy, options.steps)
+    begin = time.time()
+    train()
+    seconds = time.time() - begin
+    print('pretrained on %i transitions in %.1f s, %.0f env-steps/s, epsilon %f'
+          % (options.steps * options.copies, seconds, options.steps * options.copies / seconds, policy.epsilon))
+    checkpoints = checkpoint.Checkpointer(options.pretrain)
+    checkpoints.save(0, checkpoint.runState(-1, 0, learner, policy, None, {"co2": [], "waiting": []}))
+    checkpoints.close()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""
+K simulations behind one batched environment, stepped concurrently.
+
+VecEnv wraps one env.TrafficEnv per connection and has the batch interface
+of surrogate.SurrogateEnv: reset and step return (K x input_size)
+observations and K rewards, actions are (K x lights). step_async hands the
+actions of every simulation to a thread of its own through an asyncio event
+loop and returns at once, step_wait gathers the results, so the learner can
+train while the simulations run their simulationStep. TraCI calls block on
+a socket, which releases the GIL, so the K simulations really overlap.
+
+launch starts K simulations on free ports, each with its own TraCI label,
+or K mocksumo.MockSumo instances. Run as a script it drives them with the
+learner of runner.py or linear.py or the cycle of shortcycle.py. Needs
+Python 3 for asyncio.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import asyncio
+import optparse
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import connection
+from env import TrafficEnv, REWARD
+
+
+def launch(count, sim="mock", seed=42, extra=(), config=connection.CONFIG):
+    """starts count simulations, returns their connections, labels and sumo processes
+
+    sim is "mock" for mocksumo.MockSumo or the sumo binary. Simulation k
+    gets the seed seed + k and the TraCI label "sim<k>".
+    """
+    from workers import freePort
+    conns, labels, processes = [], [], []
+    for k in range(count):
+        label = "sim%i" % k
+        if sim == "mock":
+            from mocksumo import MockSumo
+            conns.append(MockSumo(seed=seed + k))
+            processes.append(None)
+        else:
+            import traci
+            port = freePort()
+            processes.append(subprocess.Popen(
+                connection.sumoCommand(sim, list(extra) + ["--no-step-log", "--seed", str(seed + k),
+                                                           "--remote-port", str(port)], config),
+                stdout=open(os.devnull, "w"), stderr=sys.stderr))
+            traci.init(port, label=label)
+            conns.append(connection.compat(traci.getConnection(label)))
+        labels.append(label)
+    return conns, labels, processes
+
+
+async def gather(futures):
+    return await asyncio.gather(*futures)
+
+
+class VecEnv:
+    """TrafficEnvs on the connections conns, see the module docstring.
+
+    The keyword arguments go to every TrafficEnv. All simulations run the
+    same number of steps, t counts the steps since the last reset and
+    episode_length is where the batch loops start a new episode. Like the
+    ObservationEncoder the returned observations stay valid for one more
+    step.
+    """
+    def __init__(self, conns, labels=None, processes=None, episode_length=500, **kwargs):
+        self.labels = labels or ["sim%i" % k for k in range(len(conns))]
+        self.processes = processes or [None] * len(conns)
+        self.executor = ThreadPoolExecutor(max_workers=len(conns))
+        self.loop = asyncio.new_event_loop()
+        self.envs = self.run([(TrafficEnv, (conn, ), kwargs) for conn in conns])
+        first = self.envs[0]
+        self.copies = len(self.envs)
+        self.lights = first.lights
+        self.num_lights = len(self.lights)
+        self.phases = first.phases
+        self.num_actions = first.num_actions
+        self.input_size = first.input_size
+        self.decision_interval = first.decision_interval
+        self.episode_length = episode_length
+        self.phase = np.zeros((self.copies, self.num_lights), dtype=np.int64)
+        self.obs = np.zeros((2, self.copies, self.input_size))
+        self.rewards = np.zeros(self.copies)
+        self.current = 0
+        self.pending = None
+        self.t = 0
+
+    def submit(self, calls):
+        """starts calls, a list of (function, args, kwargs), each on its own thread"""
+        return [self.loop.run_in_executor(self.executor, lambda f=f, a=a, kw=kw: f(*a, **kw))
+                for f, a, kw in calls]
+
+    def run(self, calls):
+        return self.loop.run_until_complete(gather(self.submit(calls)))
+
+    def stack(self, observations):
+        """copies the observations into the next output buffer"""
+        self.current = 1 - self.current
+        out = self.obs[self.current]
+        for k, (obs, env) in enumerate(zip(observations, self.envs)):
+            out[k] = obs
+            self.phase[k] = env.collector.phase
+        return out
+
+    def reset(self):
+        if self.pending is not None:
+            self.step_wait()
+        self.t = 0
+        return self.stack(self.run([(env.reset, (), {}) for env in self.envs]))
+
+    def decisions(self):
+        """(K x lights) mask of the lights that may pick an action in this step"""
+        if self.t % self.decision_interval != 0:
+            return np.zeros(self.phase.shape, dtype=bool)
+        return self.phases.decisions(self.phase)
+
+    def step_async(self, actions):
+        """starts one step of every simulation with actions[k] for simulation k"""
+        if self.pending is not None:
+            raise RuntimeError("step_async called again before step_wait")
+        actions = np.asarray(actions)
+        self.pending = self.submit([(env.step, (actions[k], ), {}) for k, env in enumerate(self.envs)])
+
+    def step_wait(self):
+        """waits for the step started by step_async, returns the observations and the rewards"""
+        if self.pending is None:
+            raise RuntimeError("step_wait called without step_async")
+        results = self.loop.run_until_complete(gather(self.pending))
+        self.pending = None
+        self.t += 1
+        for k, (obs, r) in enumerate(results):
+            self.rewards[k] = r
+        return self.stack([obs for obs, r in results]), self.rewards
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.pending is not None:
+            self.step_wait()
+        self.run([(env.close, (), {}) for env in self.envs])
+        for process in self.processes:
+            if process is not None:
+                process.wait()
+        self.executor.shutdown()
+        self.loop.close()
+
+
+def cycleActions(vec):
+    """the switching of shortcycle.run for all lights of all simulations"""
+    a = vec.phases.action[np.arange(vec.num_lights), vec.phase]
+    if vec.t % 15 == 0:
+        a = np.where(a != -1, (a + 1) % vec.num_actions, -1)
+    return a
+
+
+def drive(vec, agent, learner, policy, steps, batch_size=32, discount=0.9, target_period=10):
+    """runs steps steps of every simulation, returns the mean reward per episode
+
+    agent is "dqn", "linear" or "shortcycle" with learner an
+    agents.DQNAgents, a linearreg.LinearAgents or None. The DQN trains on its
+    replay memory while the simulations step, like runner.run one update per
+    transition of the lights that decided, here those of the previous step.
+    """
+    from surrogate import selectActions
+    s = vec.reset()
+    returns, R = [], np.zeros(vec.copies)
+    decided = np.zeros(0, dtype=np.int64)
+    for step in range(steps):
+        if vec.t == vec.episode_length:
+            returns.append(R.mean())
+            R = np.zeros(vec.copies)
+            s = vec.reset()
+        if agent == "shortcycle":
+            actions = cycleActions(vec)
+        else:
+            actions, lights, states = selectActions(vec, learner.getQValues, policy, s)
+        vec.step_async(actions)
+        if agent == "dqn" and len(decided):
+            learner.train(decided, batch_size, discount)
+        ss, r = vec.step_wait()
+        R += r
+        if agent == "dqn":
+            copies, decided = np.nonzero(actions != -1)
+            if len(copies):
+                learner.rememberBatch(decided, s[copies], actions[copies, decided], r[copies], ss[copies])
+                if step % target_period == 0:
+                    learner.updateTarget()
+        elif agent == "linear":
+            a = actions.reshape(-1)
+            a[a < 0] = vec.num_actions - 1
+            learner.trainBatch(lights, states, a, np.repeat(r, vec.num_lights),
+                               np.repeat(ss, vec.num_lights, axis=0), discount, 1.0 / vec.copies)
+        s = ss
+    if vec.t == vec.episode_length:
+        returns.append(R.mean())
+    return returns
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--envs", type="int", default=4, help="simulations stepped together [default: %default]")
+    optParser.add_option("--sim", default="mock",
+                         help='"mock" for mocksumo or "sumo" for the sumo binary [default: %default]')
+    optParser.add_option("--agent", type="choice", choices=["dqn", "linear", "shortcycle"], default="dqn",
+                         help="controller of runner.py, linear.py or shortcycle.py [default: %default]")
+    optParser.add_option("--agents", type="choice", choices=["shared", "independent"], default="shared",
+                         help="one network for all lights or one per light [default: %default]")
+    optParser.add_option("--replay", type="choice", choices=["uniform", "prioritized"], default="uniform",
+                         help="experience replay sampling [default: %default]")
+    optParser.add_option("--backend", type="choice", choices=["numpy", "keras"], default="numpy",
+                         help="implementation of the Q-network [default: %default]")
+    optParser.add_option("--steps", type="int", default=1000, help="steps of every simulation [default: %default]")
+    optParser.add_option("--reset", type="choice", choices=["remove", "snapshot", "pool"], default="remove",
+                         help="how episodes start, see episodes.py [default: %default]")
+    optParser.add_option("--checkpoint", metavar="DIR",
+                         help="write the learner to DIR at the end, continue with runner.py or linear.py "
+                              "--checkpoint DIR --resume")
+    optParser.add_option("--seed", type="int", default=42, help="seed of simulation 0, k gets seed + k")
+    options, args = optParser.parse_args()
+    return options
+
+
+if __name__ == "__main__":
+    options = get_options()
+    np.random.seed(options.seed)
+    sim = options.sim
+    if sim != "mock":
+        from runner import checkBinary
+        sim = checkBinary(sim)
+    import demand
+    demand.generate({"dqn": demand.RUNNER, "linear": demand.LINEAR, "shortcycle": demand.SHORTCYCLE}[options.agent])
+    conns, labels, processes = launch(options.envs, sim, options.seed)
+    index = None
+    if sim != "mock":
+        import netindex
+        index = netindex.load()
+    from policy import EpsilonGreedy
+    learner, policy = None, None
+    if options.agent == "linear":
+        from linearreg import LinearAgents
+        from linear import REWARD as LINEAR_REWARD
+        vec = VecEnv(conns, labels, processes, history_len=10, loops=True, reset=options.reset,
+                     reward=LINEAR_REWARD, index=index)
+        policy = EpsilonGreedy(vec.num_actions, decay=0.9999, legal=vec.phases.legal)
+        learner = LinearAgents(vec.num_lights, vec.input_size, vec.num_actions, shared=options.agents == "shared")
+    elif options.agent == "dqn":
+        from agents import DQNAgents
+        vec = VecEnv(conns, labels, processes, history_len=5, reset=options.reset, reward=REWARD, index=index)
+        policy = EpsilonGreedy(vec.num_actions, decay=0.9998, legal=vec.phases.legal)
+        learner = DQNAgents(vec.num_lights, vec.input_size, vec.num_actions, options.agents, options.replay,
+                            backend=options.backend)
+    else:
+        from shortcycle import REWARD as CYCLE_REWARD
+        vec = VecEnv(conns, labels, processes, history_len=15, loops=True, reset=options.reset,
+                     reward=CYCLE_REWARD, index=index)
+    begin = time.time()
+    returns = drive(vec, options.agent, learner, policy, options.steps)
+    seconds = time.time() - begin
+    vec.close()
+    for episode, R in enumerate(returns):
+        print('Episode %i mean reward per simulation %.1f' % (episode, R))
+    print('%i simulations: %.0f env-steps/s' % (options.envs, options.steps * options.envs / seconds))
+    if options.checkpoint and learner is not None:
+        import checkpoint
+        checkpoints = checkpoint.Checkpointer(options.checkpoint)
+        checkpoints.save(0, checkpoint.runState(-1, 0, learner, policy, None, {"co2": [], "waiting": []}))
+        checkpoints.close()
@@ -0,0 +1,197 @@
+"""
+Parallel rollout workers feeding one central learner.
+
+Every worker process starts its own simulation on a free port, acts with a
+local copy of the policy and ships its transitions to the learner, which
+owns the DeepQ model and the replay memory and periodically sends the
+current weights back. With sim="mock" the workers drive mocksumo.MockSumo
+instead of SUMO. A worker that fails sends its traceback, the learner
+raises it, as it does for a worker that died without one.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import socket
+import subprocess
+import multiprocessing
+import time
+import traceback
+import numpy as np
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+from env import TrafficEnv
+from policy import EpsilonGreedy
+
+discount = 0.9
+batch_size = 32
+# seconds the learner waits for a message before it checks on the workers
+poll_interval = 1.0
+
+
+def freePort():
+    """a port no other process listens on right now"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("localhost", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def startSimulation(sim, seed, tries=5):
+    """returns the connection and the sumo process (None for the mock)
+
+    freePort only finds a port that was free a moment ago, if another
+    process takes it before sumo binds it the launch is retried on a new one.
+    """
+    if sim == "mock":
+        from mocksumo import MockSumo
+        return MockSumo(seed=seed), None
+    sys.path.append(os.path.join(os.environ.get("SUMO_HOME", ""), "tools"))
+    import traci
+    for attempt in range(tries):
+        port = freePort()
+        sumoProcess = subprocess.Popen([sim, "-c", "data/cross.sumocfg", "--no-step-log", "--seed", str(seed),
+                                        "--remote-port", str(port)], stdout=open(os.devnull, "w"))
+        try:
+            # every worker is its own process, so the module level connection is ours
+            traci.init(port)
+        except Exception:
+            if attempt == tries - 1:
+                raise
+            if sumoProcess.poll() is None:
+                sumoProcess.kill()
+            sumoProcess.wait()
+            continue
+        return traci, sumoProcess
+
+
+def workerMain(worker, sim, episodes, maxSteps, history_len, transitions, weights, backend="numpy", hidden=()):
+    """runs rolloutWorker, reports an exception to the learner before it ends the process"""
+    try:
+        rolloutWorker(worker, sim, episodes, maxSteps, history_len, transitions, weights, backend, hidden)
+    except Exception:
+        transitions.put(("error", worker, traceback.format_exc()))
+        raise
+
+
+def rolloutWorker(worker, sim, episodes, maxSteps, history_len, transitions, weights, backend="numpy", hidden=()):
+    conn, sumoProcess = startSimulation(sim, 42 + worker)
+    index = None
+    if sim != "mock":
+        import netindex
+        index = netindex.load()
+    env = TrafficEnv(conn, history_len, index=index)
+    transitions.put(("hello", worker, env.input_size))
+    from qlearning import DeepQ
+    agent = DeepQ(env.input_size, env.num_actions, backend, hidden)
+    policy = EpsilonGreedy(env.num_actions, interval=env.decision_interval, legal=env.phases.legal)
+    steps = 0
+    begin = time.time()
+    for episode in range(episodes):
+        s = env.reset()
+        states, actions, rewards, next_states = [], [], [], []
+        for t in range(maxSteps):
+            latest = None
+            while True:
+                try:
+                    latest = weights.get_nowait()
+                except Empty:
+                    break
+            if latest is not None:
+                agent.setWeights(latest)
+            a = policy.act(lambda lights, states: agent.getQValues(states), env.encoder.lights(s),
+                           env.collector.phase, env.t)
+            ss, r = env.step(a)
+            for k in np.flatnonzero(a >= 0):
+                # the env reuses its observation buffers
+                states.append(s.copy())
+                actions.append(a[k])
+                rewards.append(r)
+                next_states.append(ss.copy())
+            s = ss
+            steps += 1
+        if actions:
+            transitions.put(("transitions", worker, (np.array(states), np.array(actions), np.array(rewards),
+                                                     np.array(next_states), np.zeros(len(actions), dtype=bool))))
+    env.close()
+    if sumoProcess is not None:
+        sumoProcess.wait()
+    transitions.put(("done", worker, (steps, time.time() - begin)))
+
+
+def stopWorkers(processes):
+    for p in processes:
+        if p.is_alive():
+            p.terminate()
+        p.join()
+
+
+def train(workers, sim="mock", episodes=10, maxSteps=500, history_len=5, replay="uniform",
+          updates_per_transition=1.0, broadcast_interval=100, backend="numpy", target_period=10, tau=1.0, hidden=()):
+    """runs the workers until they finished their episodes, returns throughput statistics
+
+    The learner trains one network shared by all lights.
+    """
+    from qlearning import DeepQ, ExperienceReplay, PrioritizedReplay
+    transitions = multiprocessing.Queue()
+    weightQueues = [multiprocessing.Queue() for i in range(workers)]
+    processes = [multiprocessing.Process(target=workerMain,
+                                         args=(i, sim, episodes, maxSteps, history_len, transitions, weightQueues[i],
+                                               backend, hidden))
+                 for i in range(workers)]
+    begin = time.time()
+    for p in processes:
+        p.start()
+    DQN, exp_replay = None, None
+    received, updates, envSteps, running = 0, 0, 0, workers
+    credit = 0.0
+    while running > 0:
+        try:
+            kind, worker, payload = transitions.get(timeout=poll_interval)
+        except Empty:
+            # a worker killed from outside never sends its error
+            for i, p in enumerate(processes):
+                if not p.is_alive() and p.exitcode != 0:
+                    stopWorkers(processes)
+                    raise RuntimeError("worker %i died with exit code %s" % (i, p.exitcode))
+            continue
+        if kind == "error":
+            stopWorkers(processes)
+            raise RuntimeError("worker %i failed:\n%s" % (worker, payload))
+        if kind == "hello":
+            if DQN is None:
+                input_size = payload
+                DQN = DeepQ(input_size, 2, backend, hidden, tau=tau)
+                exp_replay = PrioritizedReplay() if replay == "prioritized" else ExperienceReplay()
+            weightQueues[worker].put(DQN.getWeights())
+        elif kind == "done":
+            running -= 1
+            envSteps += payload[0]
+        else:
+            states, actions, rewards, next_states, game_over = payload
+            exp_replay.rememberBatch(states, actions, rewards, next_states, game_over)
+            received += len(actions)
+            credit += updates_per_transition * len(actions)
+            while credit >= 1:
+                if updates % target_period == 0:
+                    DQN.updateTarget()
+                batch = exp_replay.get_batch(batch_size)
+                DQN.trainModel(batch, discount, input_size, 2)
+                exp_replay.updatePriorities(batch, DQN.td_errors)
+                updates += 1
+                credit -= 1
+                if updates % broadcast_interval == 0:
+                    w = DQN.getWeights()
+                    for q in weightQueues:
+                        q.put(w)
+    for p in processes:
+        p.join()
+    elapsed = time.time() - begin
+    return {"workers": workers, "seconds": elapsed, "env_steps": envSteps, "transitions": received,
+            "updates": updates, "steps_per_second": envSteps / elapsed}